@@ -0,0 +1,107 @@
+from encoding import row_ids, unique_rows, from_keys
+import numpy as np
+
+# Vose's alias method: after an O(n) setup every draw is O(1) regardless of how
+# skewed the weights are.
+def build_alias_table(weights):
+    n = len(weights)
+    prob = np.asarray(weights, dtype=np.float64) * n / np.sum(weights)
+    alias = np.arange(n)
+
+    small = [i for i in range(n) if prob[i] < 1.0]
+    large = [i for i in range(n) if prob[i] >= 1.0]
+    while small and large:
+        less = small.pop()
+        more = large.pop()
+        alias[less] = more
+        prob[more] -= 1.0 - prob[less]
+        if prob[more] < 1.0:
+            small.append(more)
+        else:
+            large.append(more)
+
+    # whatever is left is 1 up to rounding error
+    for i in small + large:
+        prob[i] = 1.0
+
+    return prob, alias
+
+
+# Corrupts a whole batch of cubes at once, with the same semantics the generators
+# used to apply one cube at a time: each cube draws a noise level from
+# N(noise, noise_std) clipped to [0.05, 0.8], cuts int(size * noise) of its cards and
+# adds as many cards it does not contain, drawn proportionally to the inverse
+# frequency weights. A quarter of the cut cards are also removed from the target.
+class NoiseAugmenter:
+    def __init__(self, weights, noise=0.2, noise_std=0.1, max_rejection_rounds=32):
+        self.weights = np.asarray(weights, dtype=np.float64)
+        self.noise = noise
+        self.noise_std = noise_std
+        self.max_rejection_rounds = max_rejection_rounds
+        self.prob, self.alias = build_alias_table(self.weights)
+
+    def sample(self, count, rng):
+        cards = rng.integers(len(self.prob), size=count)
+        keep = rng.random(count) < self.prob[cards]
+        return np.where(keep, cards, self.alias[cards])
+
+    # draws one card per entry of rows that is not already in that row's cube.
+    # cube_keys are the sorted row * num_cards + card keys of the batch
+    def sample_excluding(self, rows, cube_keys, num_cards, rng):
+        cards = self.sample(len(rows), rng)
+        pending = np.arange(len(rows))
+
+        for _ in range(self.max_rejection_rounds):
+            keys = rows[pending] * num_cards + cards[pending]
+            found = np.searchsorted(cube_keys, keys)
+            found[found == len(cube_keys)] = 0
+            rejected = cube_keys[found] == keys if len(cube_keys) else np.zeros(len(keys), dtype=bool)
+
+            pending = pending[rejected]
+            if len(pending) == 0:
+                return cards
+            cards[pending] = self.sample(len(pending), rng)
+
+        # cubes holding most of the weight mass, fall back to renormalizing over the excluded cards
+        for i in pending:
+            row = rows[i]
+            start, end = np.searchsorted(cube_keys, [row * num_cards, (row + 1) * num_cards])
+            excludes = np.setdiff1d(np.arange(num_cards), cube_keys[start:end] - row * num_cards)
+            sampler = self.weights[excludes]
+            cards[i] = rng.choice(excludes, p=sampler / np.sum(sampler))
+        return cards
+
+    # returns (x, y) batches as (flat, offsets)
+    def corrupt(self, flat, offsets, num_cards, rng):
+        flat, offsets = unique_rows(flat, offsets, num_cards)
+        batch_size = len(offsets) - 1
+        sizes = np.diff(offsets)
+        cube_keys = row_ids(offsets) * num_cards + flat
+
+        noise = np.clip(rng.normal(self.noise, self.noise_std, size=batch_size), 0.05, 0.8)
+        flip_amount = (sizes * noise).astype(np.int64)
+        flip_rows = np.repeat(np.arange(batch_size), flip_amount)
+
+        # cuts are drawn with replacement from each cube's cards
+        cut_positions = offsets[flip_rows] + (rng.random(len(flip_rows)) * sizes[flip_rows]).astype(np.int64)
+        cut_keys = cube_keys[cut_positions]
+
+        # the target loses flip_amount // 4 of the cuts, again drawn with replacement
+        flip_offsets = np.concatenate(([0], np.cumsum(flip_amount)))
+        y_flip_amount = flip_amount // 4
+        y_flip_rows = np.repeat(np.arange(batch_size), y_flip_amount)
+        y_cut_positions = flip_offsets[y_flip_rows] + (rng.random(len(y_flip_rows)) * flip_amount[y_flip_rows]).astype(np.int64)
+        y_cut_keys = cut_keys[y_cut_positions]
+
+        add_keys = flip_rows * num_cards + self.sample_excluding(flip_rows, cube_keys, num_cards, rng)
+
+        x_keys = np.concatenate((cube_keys[~np.isin(cube_keys, cut_keys)], add_keys))
+        y_keys = cube_keys[~np.isin(cube_keys, y_cut_keys)]
+
+        return from_keys(x_keys, batch_size, num_cards), from_keys(y_keys, batch_size, num_cards)
+
+
+# independent, reproducible streams derived from one seed, keyed e.g. by (epoch,) for
+# the epoch's shuffle and (epoch, batch_number) for each batch
+def make_rng(seed, *key):
+    return np.random.default_rng(np.random.SeedSequence(seed, spawn_key=key))
@@ -0,0 +1,67 @@
+from model import CubeCobraMLSystem
+import tensorflow as tf
+import numpy as np
+import json
+import os
+import sys
+import time
+
+# usage: python bench_draft.py [freq_path] [model_dir]
+# per-pick latency and decoder FLOPs of the dense draft path, which evaluates the
+# output layer for every card and masks, against scoring only the pack's cards
+params = sys.argv[1:]
+
+num_cards = 30456
+if len(params) > 0:
+    with open(params[0]) as f:
+        num_cards = len(json.load(f))
+model_dir = params[1] if len(params) > 1 else './model/'
+pool_size = 23
+pack_size = 15
+repeats = 50
+
+
+def timed(fn):
+    fn()
+    start = time.perf_counter()
+    for _ in range(repeats):
+        fn()
+    return (time.perf_counter() - start) / repeats * 1000
+
+
+# multiply-adds of the decoder per row, the encoder costs the same on both paths
+def decoder_flops(outputs):
+    return 2 * (128 * 256 + 256 * 512 + 512 * outputs)
+
+
+model = CubeCobraMLSystem(num_cards)
+if os.path.exists(os.path.join(model_dir, 'encoder')):
+    model.load_weights(model_dir)
+
+rng = np.random.default_rng(0)
+
+print('num_cards: {}, pool: {} cards, pack: {} cards\n'.format(num_cards, pool_size, pack_size))
+print('{:<12}{:>14}{:>16}{:>16}{:>20}'.format('batch', 'dense ms', 'candidates ms', 'dense MFLOP', 'candidates MFLOP'))
+
+for batch_size in [1, 8, 64, 256]:
+    pool_cards = [rng.choice(num_cards, pool_size, replace=False) for _ in range(batch_size)]
+    pack_cards = [rng.choice(num_cards, pack_size, replace=False) for _ in range(batch_size)]
+
+    ragged_pools = tf.ragged.constant(pool_cards, dtype=tf.int32)
+    ragged_packs = tf.ragged.constant(pack_cards, dtype=tf.int32)
+    dense_packs = np.zeros((batch_size, num_cards), dtype=np.float32)
+    for i, cards in enumerate(pack_cards):
+        dense_packs[i, cards] = 1
+    dense_packs = tf.constant(dense_packs)
+
+    dense = model.draft(ragged_pools, dense_packs).numpy()
+    candidates = model.draft_candidates(ragged_pools, ragged_packs)
+    for i, cards in enumerate(pack_cards):
+        assert np.allclose(dense[i, cards], candidates[i].numpy(), atol=1e-5)
+
+    results = [
+        timed(lambda: model.draft(ragged_pools, dense_packs).numpy()),
+        timed(lambda: model.draft_candidates(ragged_pools, ragged_packs).flat_values.numpy()),
+    ]
+    flops = [batch_size * decoder_flops(num_cards) / 1e6, batch_size * decoder_flops(pack_size) / 1e6]
+    print('{:<12}{:>14.2f}{:>16.2f}{:>16.1f}{:>20.1f}  ({:.1f}x)'.format(batch_size, *results, *flops, results[0] / results[1]))
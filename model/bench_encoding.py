@@ -0,0 +1,65 @@
+from encoding import BatchEncoder, flatten, multi_hot, multi_hot_lists
+import numpy as np
+import json
+import sys
+import time
+
+# usage: python bench_encoding.py [freq_path] [batch_size]
+# compares the per-row loops the generators used against the flattened scatter
+params = sys.argv[1:]
+
+num_cards = 30456
+if len(params) > 0:
+    with open(params[0]) as f:
+        num_cards = len(json.load(f))
+batch_size = int(params[1]) if len(params) > 1 else 1024
+repeats = 10
+
+
+def loop_encoding(indices, batch_size):
+    vec = np.zeros((batch_size, num_cards))
+    for i, index in enumerate(indices):
+        vec[i, index] = 1
+    return vec
+
+
+def loop_encode_deck(mainboards, batch_size):
+    vec = np.zeros((batch_size, num_cards))
+    for i, mainboard in enumerate(mainboards):
+        for index in mainboard:
+            vec[i, index] = 1
+    return vec
+
+
+def timed(fn):
+    fn()
+    start = time.perf_counter()
+    for _ in range(repeats):
+        fn()
+    return (time.perf_counter() - start) / repeats * 1000
+
+
+rng = np.random.default_rng(0)
+workloads = {
+    'cubes (360 cards)': [rng.choice(num_cards, 360, replace=False).tolist() for _ in range(batch_size)],
+    'pools (45 cards)': [rng.choice(num_cards, 45, replace=False).tolist() for _ in range(batch_size)],
+    'decks (23 cards)': [rng.choice(num_cards, 23, replace=False).tolist() for _ in range(batch_size)],
+}
+
+print('num_cards: {}, batch size: {}\n'.format(num_cards, batch_size))
+print('{:<20}{:>14}{:>14}{:>14}{:>14}{:>14}'.format('workload', 'loop ms', 'lists ms', 'csr f32 ms', 'csr u8 ms', 'reused u8 ms'))
+
+for name, lists in workloads.items():
+    flat, offsets = flatten(lists)
+    encoder = BatchEncoder(num_cards, dtype=np.uint8)
+
+    assert (multi_hot(flat, offsets, num_cards) == loop_encoding(lists, batch_size)).all()
+
+    results = [
+        timed(lambda: loop_encoding(lists, batch_size)) if name.startswith('cubes') else timed(lambda: loop_encode_deck(lists, batch_size)),
+        timed(lambda: multi_hot_lists(lists, num_cards)),
+        timed(lambda: multi_hot(flat, offsets, num_cards, dtype=np.float32)),
+        timed(lambda: multi_hot(flat, offsets, num_cards, dtype=np.uint8)),
+        timed(lambda: encoder.encode(name, flat, offsets)),
+    ]
+    print('{:<20}{:>14.2f}{:>14.2f}{:>14.2f}{:>14.2f}{:>14.2f}  ({:.1f}x)'.format(name, *results, results[0] / results[-1]))
@@ -0,0 +1,70 @@
+from model import CubeCobraMLSystem
+import tensorflow as tf
+import numpy as np
+import json
+import os
+import sys
+import time
+
+# usage: python bench_infer.py [freq_path] [batch_size] [model_dir]
+# compares running each head on its own, which encodes the batch once per head,
+# against infer, which encodes it once and fans the embedding out to the heads
+params = sys.argv[1:]
+
+num_cards = 30456
+if len(params) > 0:
+    with open(params[0]) as f:
+        num_cards = len(json.load(f))
+batch_size = int(params[1]) if len(params) > 1 else 256
+model_dir = params[2] if len(params) > 2 else './model/'
+repeats = 20
+
+
+def timed(fn):
+    fn()
+    start = time.perf_counter()
+    for _ in range(repeats):
+        fn()
+    return (time.perf_counter() - start) / repeats * 1000
+
+
+rng = np.random.default_rng(0)
+pools = np.zeros((batch_size, num_cards), dtype=np.float32)
+packs = np.zeros((batch_size, num_cards), dtype=np.float32)
+for i in range(batch_size):
+    pools[i, rng.choice(num_cards, 45, replace=False)] = 1
+    packs[i, rng.choice(num_cards, 15, replace=False)] = 1
+pools = tf.constant(pools)
+packs = tf.constant(packs)
+
+model = CubeCobraMLSystem(num_cards)
+if os.path.exists(os.path.join(model_dir, 'encoder')):
+    model.load_weights(model_dir)
+
+separate = {
+    'recommend': lambda: model.recommend(pools),
+    'deck_build': lambda: model.deck_build(pools),
+    'draft': lambda: model.draft(pools, packs),
+    'correlate': lambda: model.correlate(pools),
+}
+
+embedding = model.embed(pools)
+workloads = [
+    ('recommend + deck_build', ('recommend', 'deck_build')),
+    ('all four heads', ('recommend', 'deck_build', 'draft', 'correlate')),
+]
+
+print('num_cards: {}, batch size: {}\n'.format(num_cards, batch_size))
+print('{:<26}{:>14}{:>14}{:>18}'.format('heads', 'separate ms', 'infer ms', 'embedding ms'))
+
+for name, heads in workloads:
+    outputs = model.infer(pools, heads=heads, packs=packs)
+    for head in heads:
+        assert np.allclose(outputs[head].numpy(), separate[head]().numpy(), atol=1e-5)
+
+    results = [
+        timed(lambda: [separate[head]().numpy() for head in heads]),
+        timed(lambda: [output.numpy() for output in model.infer(pools, heads=heads, packs=packs).values()]),
+        timed(lambda: [output.numpy() for output in model.infer(heads=heads, packs=packs, embedding=embedding).values()]),
+    ]
+    print('{:<26}{:>14.2f}{:>14.2f}{:>18.2f}  ({:.1f}x)'.format(name, *results, results[0] / results[1]))
@@ -0,0 +1,64 @@
+from model import CubeCobraMLSystem
+import tensorflow as tf
+import numpy as np
+import json
+import sys
+import time
+
+# usage: python bench_serving.py [model_dir] [serving_dir] [freq_path]
+# load time and batched recommend throughput of the five Keras models save_weights
+# writes, chained by hand like demo/server/ml.js, against the fused export of
+# export_serving.py
+params = sys.argv[1:]
+
+model_dir = params[0] if len(params) > 0 else './model/'
+serving_dir = params[1] if len(params) > 1 else './model/serving/'
+freq_path = params[2] if len(params) > 2 else '../data/train/oracleFrequency.json'
+repeats = 20
+
+with open(freq_path) as f:
+    num_cards = len(json.load(f))
+
+
+def timed(fn):
+    fn()
+    start = time.perf_counter()
+    for _ in range(repeats):
+        fn()
+    return (time.perf_counter() - start) / repeats
+
+
+start = time.perf_counter()
+model = CubeCobraMLSystem(num_cards)
+model.load_weights(model_dir)
+five_models_load = time.perf_counter() - start
+
+start = time.perf_counter()
+fused = tf.saved_model.load(serving_dir)
+fused_load = time.perf_counter() - start
+
+print('num_cards: {}\n'.format(num_cards))
+print('{:<24}{:>12.2f} s'.format('five models load', five_models_load))
+print('{:<24}{:>12.2f} s\n'.format('fused export load', fused_load))
+
+recommend = fused.signatures['recommend']
+recommend_top_k = fused.signatures['recommend_top_k']
+
+rng = np.random.default_rng(0)
+print('{:<12}{:>20}{:>20}{:>20}'.format('batch', 'five models cubes/s', 'fused cubes/s', 'fused top k cubes/s'))
+
+for batch_size in [1, 16, 128, 512]:
+    cubes = np.zeros((batch_size, num_cards), dtype=np.float32)
+    for i in range(batch_size):
+        cubes[i, rng.choice(num_cards, 360, replace=False)] = 1
+    cubes = tf.constant(cubes)
+
+    chained = model.cube_decoder.model(model.encoder.model(cubes)).numpy()
+    assert np.allclose(chained, recommend(cubes=cubes)['scores'].numpy(), atol=1e-5)
+
+    results = [
+        timed(lambda: model.cube_decoder.model(model.encoder.model(cubes)).numpy()),
+        timed(lambda: recommend(cubes=cubes)['scores'].numpy()),
+        timed(lambda: [output.numpy() for output in recommend_top_k(cubes=cubes).values()]),
+    ]
+    print('{:<12}{:>20.0f}{:>20.0f}{:>20.0f}'.format(batch_size, *[batch_size / result for result in results]))
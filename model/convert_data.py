@@ -0,0 +1,30 @@
+from correlations import convert_correlations
+from dataset import COLLECTIONS, convert_collection
+import json
+import os
+import sys
+
+# usage: python convert_data.py [data_dir] [out_dir]
+params = sys.argv[1:]
+
+data_dir = params[0] if len(params) > 0 else '../data/train/'
+out_dir = params[1] if len(params) > 1 else os.path.join(data_dir, 'bin')
+
+for collection in COLLECTIONS:
+    json_path = os.path.join(data_dir, collection)
+    if not os.path.isdir(json_path):
+        print('Skipping {}, {} does not exist'.format(collection, json_path))
+        continue
+
+    print('Converting {}...\n'.format(collection))
+    convert_collection(json_path, os.path.join(out_dir, collection), collection)
+
+correlations_path = os.path.join(data_dir, 'correlations.json')
+if os.path.exists(correlations_path):
+    with open(os.path.join(data_dir, 'oracleFrequency.json')) as f:
+        num_cards = len(json.load(f))
+
+    print('Converting correlations...\n')
+    convert_correlations(correlations_path, os.path.join(out_dir, 'correlations'), num_cards)
+
+print('Done.\n')
@@ -0,0 +1,129 @@
+from dataset import CSRColumn, open_memmap
+import numpy as np
+import json
+import os
+
+# Card co-occurrence counts kept as a sparse CSR matrix. process_data.js writes them
+# as one flat JSON list of num_cards * num_cards counts, almost all of them zero.
+# Rows are only normalized, and only densified, for the cards a batch asks for.
+
+META_FILE = 'meta.json'
+
+
+class CorrelationMatrix:
+    def __init__(self, indptr, indices, counts, row_sums, epsilon=1):
+        self.num_cards = len(indptr) - 1
+        self.cards = CSRColumn(indices, indptr)
+        self.counts = counts
+        self.row_sums = row_sums
+        self.epsilon = epsilon
+
+    @property
+    def nnz(self):
+        return len(self.counts)
+
+    # (row, card, value) of the nonzero entries of rows, each row normalized to a distribution
+    def entries(self, rows):
+        positions, offsets = self.cards.positions(rows)
+        row_ids = np.repeat(np.arange(len(rows)), np.diff(offsets))
+
+        scale = 1 / (np.asarray(self.row_sums[rows], dtype=np.float64) + self.epsilon)
+        values = np.asarray(self.counts[positions]) * scale[row_ids]
+        return row_ids, np.asarray(self.cards.indices[positions]), values
+
+    # each row normalized to a distribution, as the generators used to do for the whole matrix
+    def rows(self, rows, dtype=np.float32):
+        row_ids, cards, values = self.entries(rows)
+        out = np.zeros((len(rows), self.num_cards), dtype=dtype)
+        np.put(out, row_ids * self.num_cards + cards, values)
+        return out
+
+
+# yields the rows of the flat JSON list one at a time without ever holding the dense matrix
+def iter_json_rows(json_path, num_cards, chunk_size=1 << 26):
+    pending = np.zeros(0, dtype=np.int64)
+    tail = ''
+
+    with open(json_path) as f:
+        while True:
+            chunk = f.read(chunk_size)
+            text = tail + chunk
+            tail = ''
+            if chunk:
+                # keep the number that may be cut in half for the next chunk
+                cut = text.rfind(',')
+                text, tail = text[:max(cut, 0)], text[cut + 1:]
+
+            text = text.strip().strip('[]').strip()
+            if text:
+                pending = np.concatenate((pending, np.fromstring(text, dtype=np.int64, sep=',')))
+
+            full = len(pending) // num_cards
+            for row in pending[:full * num_cards].reshape(full, num_cards):
+                yield row
+            pending = pending[full * num_cards:]
+
+            if not chunk:
+                break
+
+
+def from_rows(rows, num_cards):
+    indptr = np.zeros(num_cards + 1, dtype=np.int64)
+    indices = []
+    counts = []
+
+    for i, row in enumerate(rows):
+        nonzero = np.flatnonzero(row)
+        indices.append(nonzero.astype(np.int32))
+        counts.append(row[nonzero].astype(np.int32))
+        indptr[i + 1] = indptr[i] + len(nonzero)
+
+    indices = np.concatenate(indices) if indices else np.zeros(0, dtype=np.int32)
+    counts = np.concatenate(counts) if counts else np.zeros(0, dtype=np.int32)
+    # differences of the running total, empty rows at the end included, which
+    # np.add.reduceat rejects as out of bounds
+    totals = np.zeros(len(counts) + 1, dtype=np.int64)
+    np.cumsum(counts, out=totals[1:])
+    row_sums = totals[indptr[1:]] - totals[indptr[:-1]]
+
+    return CorrelationMatrix(indptr, indices, counts, row_sums)
+
+
+def save_correlations(matrix, path):
+    os.makedirs(path, exist_ok=True)
+    with open(os.path.join(path, 'indptr.bin'), 'wb') as f:
+        f.write(np.asarray(matrix.cards.offsets, dtype=np.int64).tobytes())
+    with open(os.path.join(path, 'indices.bin'), 'wb') as f:
+        f.write(np.asarray(matrix.cards.indices, dtype=np.int32).tobytes())
+    with open(os.path.join(path, 'counts.bin'), 'wb') as f:
+        f.write(np.asarray(matrix.counts, dtype=np.int32).tobytes())
+    with open(os.path.join(path, 'row_sums.bin'), 'wb') as f:
+        f.write(np.asarray(matrix.row_sums, dtype=np.int64).tobytes())
+    with open(os.path.join(path, META_FILE), 'w') as f:
+        json.dump({'num_cards': matrix.num_cards, 'nnz': matrix.nnz}, f)
+
+
+# path is either the flat JSON list from process_data.js or a directory written by save_correlations
+def load_correlations(path, num_cards):
+    if not os.path.isdir(path):
+        print('Parsing correlations from {}'.format(path))
+        return from_rows(iter_json_rows(path, num_cards), num_cards)
+
+    with open(os.path.join(path, META_FILE)) as f:
+        meta = json.load(f)
+    if meta['num_cards'] != num_cards:
+        raise ValueError('{} holds correlations for {} cards, expected {}'.format(path, meta['num_cards'], num_cards))
+
+    return CorrelationMatrix(
+        open_memmap(os.path.join(path, 'indptr.bin'), np.int64, num_cards + 1),
+        open_memmap(os.path.join(path, 'indices.bin'), np.int32, meta['nnz']),
+        open_memmap(os.path.join(path, 'counts.bin'), np.int32, meta['nnz']),
+        open_memmap(os.path.join(path, 'row_sums.bin'), np.int64, num_cards),
+    )
+
+
+def convert_correlations(json_path, out_path, num_cards):
+    matrix = from_rows(iter_json_rows(json_path, num_cards), num_cards)
+    save_correlations(matrix, out_path)
+    print("Wrote {} nonzero correlations for {} cards to {}".format(matrix.nnz, num_cards, out_path))
+    return matrix.nnz
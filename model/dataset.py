@@ -0,0 +1,326 @@
+import numpy as np
+import json
+import os
+import time
+
+# Columns stored for each collection written by process_data.js. Ragged columns are
+# stored CSR-style as a flat int32 array of card indices plus an int64 offsets array
+# of length num_records + 1. Scalar columns hold exactly one int32 per record.
+RAGGED = 'ragged'
+SCALAR = 'scalar'
+
+COLLECTIONS = {
+    'cubes': {'cards': RAGGED},
+    'decks': {'mainboard': RAGGED, 'sideboard': RAGGED},
+    'picks': {'pool': RAGGED, 'pack': RAGGED, 'pick': SCALAR},
+}
+
+META_FILE = 'meta.json'
+
+
+def split_record(collection, record):
+    # cubes are bare lists of card indices, decks and picks are dicts
+    if collection == 'cubes':
+        return {'cards': record}
+    return {name: record[name] for name in COLLECTIONS[collection]}
+
+
+def list_shards(path):
+    return sorted(file for file in os.listdir(path) if file.endswith('.json'))
+
+
+def open_memmap(filename, dtype, length):
+    # np.memmap refuses to map empty files
+    if length == 0:
+        return np.zeros(0, dtype=dtype)
+    return np.memmap(filename, dtype=dtype, mode='r', shape=(length,))
+
+
+class CSRColumn:
+    def __init__(self, indices, offsets=None):
+        self.indices = indices
+        self.offsets = offsets
+
+    def __len__(self):
+        if self.offsets is None:
+            return len(self.indices)
+        return len(self.offsets) - 1
+
+    def __getitem__(self, row):
+        if self.offsets is None:
+            return self.indices[row:row + 1]
+        return self.indices[self.offsets[row]:self.offsets[row + 1]]
+
+    @property
+    def nbytes(self):
+        return self.indices.nbytes + (0 if self.offsets is None else self.offsets.nbytes)
+
+    # positions in indices of every entry of rows, plus the batch offsets
+    def positions(self, rows):
+        rows = np.asarray(rows, dtype=np.int64)
+        if self.offsets is None:
+            return rows, np.arange(len(rows) + 1, dtype=np.int64)
+
+        starts = np.asarray(self.offsets[rows])
+        lengths = np.asarray(self.offsets[rows + 1]) - starts
+
+        offsets = np.zeros(len(rows) + 1, dtype=np.int64)
+        np.cumsum(lengths, out=offsets[1:])
+
+        return np.repeat(starts - offsets[:-1], lengths) + np.arange(offsets[-1]), offsets
+
+    # gathers a batch of rows as (flat indices, batch offsets) without touching any other record
+    def take(self, rows):
+        positions, offsets = self.positions(rows)
+        return np.asarray(self.indices[positions]), offsets
+
+
+def pack_column(kind, values):
+    if kind == SCALAR:
+        return CSRColumn(np.asarray(values, dtype=np.int32))
+
+    offsets = np.zeros(len(values) + 1, dtype=np.int64)
+    np.cumsum(np.fromiter(map(len, values), dtype=np.int64, count=len(values)), out=offsets[1:])
+    indices = np.fromiter((index for value in values for index in value), dtype=np.int32, count=offsets[-1])
+    return CSRColumn(indices, offsets)
+
+
+def pack_records(collection, records):
+    split = [split_record(collection, record) for record in records]
+    return {
+        name: pack_column(kind, [record[name] for record in split])
+        for name, kind in COLLECTIONS[collection].items()
+    }
+
+
+class CSRWriter:
+    def __init__(self, path, collection):
+        os.makedirs(path, exist_ok=True)
+
+        self.path = path
+        self.collection = collection
+        self.columns = COLLECTIONS[collection]
+        self.num_records = 0
+        self.nnz = {name: 0 for name in self.columns}
+
+        self.index_files = {}
+        self.offset_files = {}
+        for name, kind in self.columns.items():
+            self.index_files[name] = open(os.path.join(path, name + '.indices.bin'), 'wb')
+            if kind == RAGGED:
+                self.offset_files[name] = open(os.path.join(path, name + '.offsets.bin'), 'wb')
+                self.offset_files[name].write(np.zeros(1, dtype=np.int64).tobytes())
+
+    def append(self, records):
+        for name, column in pack_records(self.collection, records).items():
+            if column.offsets is not None:
+                self.offset_files[name].write((self.nnz[name] + column.offsets[1:]).tobytes())
+            self.index_files[name].write(column.indices.tobytes())
+            self.nnz[name] += len(column.indices)
+        self.num_records += len(records)
+
+    def close(self):
+        for file in list(self.index_files.values()) + list(self.offset_files.values()):
+            file.close()
+
+        meta = {
+            'collection': self.collection,
+            'num_records': self.num_records,
+            'columns': {name: {'kind': kind, 'nnz': self.nnz[name]} for name, kind in self.columns.items()},
+        }
+        with open(os.path.join(self.path, META_FILE), 'w') as f:
+            json.dump(meta, f)
+
+
+class CSRDataset:
+    def __init__(self, path):
+        with open(os.path.join(path, META_FILE)) as f:
+            meta = json.load(f)
+
+        self.path = path
+        self.collection = meta['collection']
+        self.num_records = meta['num_records']
+
+        self.columns = {}
+        for name, spec in meta['columns'].items():
+            indices = open_memmap(os.path.join(path, name + '.indices.bin'), np.int32, spec['nnz'])
+            offsets = None
+            if spec['kind'] == RAGGED:
+                offsets = open_memmap(os.path.join(path, name + '.offsets.bin'), np.int64, self.num_records + 1)
+            self.columns[name] = CSRColumn(indices, offsets)
+
+    def __len__(self):
+        return self.num_records
+
+    def __getitem__(self, name):
+        return self.columns[name]
+
+
+# a single decoded JSON shard held in memory in the same layout as CSRDataset
+class CSRShard:
+    def __init__(self, collection, columns):
+        self.collection = collection
+        self.columns = columns
+        self.num_records = len(next(iter(columns.values())))
+
+    @property
+    def nbytes(self):
+        return sum(column.nbytes for column in self.columns.values())
+
+    def __len__(self):
+        return self.num_records
+
+    def __getitem__(self, name):
+        return self.columns[name]
+
+
+# numpy buffer that doubles its capacity when full, so appending n values is amortized O(n)
+class GrowableArray:
+    def __init__(self, dtype, capacity=1 << 16):
+        self.data = np.zeros(capacity, dtype=dtype)
+        self.size = 0
+
+    def reserve(self, size):
+        if size > len(self.data):
+            self.data.resize(max(size, 2 * len(self.data)), refcheck=False)
+
+    def append(self, value):
+        self.reserve(self.size + 1)
+        self.data[self.size] = value
+        self.size += 1
+
+    def extend(self, values):
+        self.reserve(self.size + len(values))
+        self.data[self.size:self.size + len(values)] = values
+        self.size += len(values)
+
+    # trims the buffer in place and hands it over
+    def finish(self):
+        self.data.resize(self.size, refcheck=False)
+        return self.data
+
+
+# builds the columns of a collection one record at a time
+class CSRBuilder:
+    def __init__(self, collection):
+        self.collection = collection
+        self.columns = COLLECTIONS[collection]
+        self.num_records = 0
+
+        self.indices = {name: GrowableArray(np.int32) for name in self.columns}
+        self.offsets = {}
+        for name, kind in self.columns.items():
+            if kind == RAGGED:
+                self.offsets[name] = GrowableArray(np.int64)
+                self.offsets[name].append(0)
+
+    def append(self, record):
+        for name, value in split_record(self.collection, record).items():
+            if name in self.offsets:
+                self.indices[name].extend(value)
+                self.offsets[name].append(self.indices[name].size)
+            else:
+                self.indices[name].append(value)
+        self.num_records += 1
+
+    def finish(self):
+        return CSRShard(self.collection, {
+            name: CSRColumn(self.indices[name].finish(), self.offsets[name].finish() if name in self.offsets else None)
+            for name in self.columns
+        })
+
+
+# yields the elements of a top level JSON list one at a time, with the byte offsets
+# each one spans in the file. The file is read in chunks, so only one chunk and one
+# record are ever held as python objects. Shards only hold card indices, which are
+# ASCII, so decoding as latin-1 keeps character positions equal to byte offsets.
+def iter_json_spans(path, chunk_size=1 << 22):
+    decoder = json.JSONDecoder()
+
+    with open(path, 'rb') as f:
+        buffer = f.read(chunk_size).decode('latin-1')
+        base = 0
+        pos = len(buffer) - len(buffer.lstrip())
+        if buffer[pos:pos + 1] != '[':
+            raise ValueError('{} does not hold a JSON list'.format(path))
+        pos += 1
+
+        while True:
+            # skip the separator, topping the buffer up when it runs out
+            while pos < len(buffer) and buffer[pos] in ' \t\r\n,':
+                pos += 1
+            if pos == len(buffer):
+                base += len(buffer)
+                buffer = f.read(chunk_size).decode('latin-1')
+                pos = 0
+                if not buffer:
+                    raise ValueError('{} ends before its closing bracket'.format(path))
+                continue
+            if buffer[pos] == ']':
+                return
+
+            try:
+                record, end = decoder.raw_decode(buffer, pos)
+            except json.JSONDecodeError:
+                # the record runs past the end of the buffer
+                more = f.read(chunk_size).decode('latin-1')
+                if not more:
+                    raise
+                base += pos
+                buffer = buffer[pos:] + more
+                pos = 0
+                continue
+
+            yield record, base + pos, base + end
+            pos = end
+            if pos > chunk_size:
+                base += pos
+                buffer = buffer[pos:]
+                pos = 0
+
+
+def iter_json_records(path, chunk_size=1 << 22):
+    for record, _, _ in iter_json_spans(path, chunk_size):
+        yield record
+
+
+# streams every shard of a collection into one in-memory CSRShard, without building the
+# list of records json.load would return
+def load_collection(path, collection):
+    files = list_shards(path)
+    builder = CSRBuilder(collection)
+    bytes_read = 0
+    start = time.perf_counter()
+
+    for i, file in enumerate(files):
+        filename = os.path.join(path, file)
+        for record in iter_json_records(filename):
+            builder.append(record)
+
+        bytes_read += os.path.getsize(filename)
+        elapsed = time.perf_counter() - start
+        print("Loaded {} of {} from {}: {}, {} records, {:.0f} records/s, {:.1f} MB/s".format(
+            i + 1, len(files), path, file, builder.num_records, builder.num_records / elapsed, bytes_read / 2**20 / elapsed))
+
+    shard = builder.finish()
+    print("Loaded {} {} into {:.1f} MB".format(len(shard), collection, shard.nbytes / 2**20))
+    return shard
+
+
+def decode_shard(path, collection):
+    with open(path) as f:
+        return CSRShard(collection, pack_records(collection, json.load(f)))
+
+
+def convert_collection(json_path, out_path, collection):
+    files = list_shards(json_path)
+    writer = CSRWriter(out_path, collection)
+
+    for i, file in enumerate(files):
+        print("Converting {} of {} from {}: {}".format(i, len(files), json_path, file))
+        with open(os.path.join(json_path, file)) as f:
+            writer.append(json.load(f))
+
+    writer.close()
+    print("Wrote {} {} to {}".format(writer.num_records, collection, out_path))
+    return writer.num_records
@@ -0,0 +1,88 @@
+import tensorflow as tf
+import numpy as np
+
+# State of a batch of concurrent drafts for CubeCobraMLSystem. The encoder's first
+# layer is a Dense layer on the multi-hot pool, so its pre-activation is the bias plus
+# the kernel rows of the pool's cards. Each session keeps that sum and adds one kernel
+# row per picked card, a pick then only runs the rest of the encoder and the draft
+# decoder, whatever the pool size. Up to float rounding this is what draft computes
+# from the whole pool.
+class DraftSession:
+    def __init__(self, model, num_sessions=1, pools=None):
+        self.model = model
+        self.num_cards = model.num_cards
+
+        first = model.encoder.model.layers[0]
+        if not first.built:
+            first.build((None, self.num_cards))
+        self.kernel = first.kernel
+        self.bias = first.bias
+
+        if pools is not None:
+            num_sessions = len(pools)
+        self.num_sessions = num_sessions
+
+        # sorted session * num_cards + card keys of the cards already summed, a card only
+        # counts once as in the multi-hot pool
+        self.pool_keys = np.zeros(0, dtype=np.int64)
+        self.preactivation = tf.tile(self.bias[None, :], [num_sessions, 1])
+
+        if pools is not None:
+            sessions = np.repeat(np.arange(num_sessions), [len(pool) for pool in pools])
+            cards = np.concatenate([np.asarray(pool, dtype=np.int64) for pool in pools]) if len(pools) else np.zeros(0, dtype=np.int64)
+            self.add(cards, sessions)
+
+    def __len__(self):
+        return self.num_sessions
+
+    def add_rows(self, sessions, cards):
+        if len(cards) == 0:
+            return
+        self.preactivation = tf.tensor_scatter_nd_add(
+            self.preactivation,
+            tf.constant(sessions, dtype=tf.int64)[:, None],
+            tf.gather(self.kernel, tf.constant(cards, dtype=tf.int64)),
+        )
+
+    # adds cards[i] to the pool of sessions[i], all sessions in order by default.
+    # cards below 0 and cards already in the pool are skipped
+    def add(self, cards, sessions=None):
+        cards = np.asarray(cards, dtype=np.int64)
+        sessions = np.arange(self.num_sessions) if sessions is None else np.asarray(sessions, dtype=np.int64)
+
+        keys = (sessions * self.num_cards + cards)[cards >= 0]
+        # also drops the same card twice for one session in a single call
+        keys = np.setdiff1d(keys, self.pool_keys)
+
+        self.pool_keys = np.union1d(self.pool_keys, keys)
+        self.add_rows(keys // self.num_cards, keys % self.num_cards)
+
+    def pools(self):
+        sessions = self.pool_keys // self.num_cards
+        bounds = np.searchsorted(sessions, np.arange(self.num_sessions + 1))
+        cards = self.pool_keys % self.num_cards
+        return [cards[bounds[i]:bounds[i + 1]] for i in range(self.num_sessions)]
+
+    # pick probabilities of every session, packs as in draft_from_preactivation
+    def pick_probabilities(self, packs):
+        return self.model.draft_from_preactivation(self.preactivation, packs)
+
+    # picks a card from each pack and adds it to the pool, returns the picked cards, -1
+    # for sessions with an empty pack. packs are ragged card indices. Picks are the most
+    # likely card, or drawn from the pick probabilities when rng is given
+    def pick(self, packs, rng=None):
+        probabilities = self.pick_probabilities(packs).to_tensor(default_value=0.0).numpy()
+        cards = packs.to_tensor(default_value=-1).numpy()
+        if cards.shape[1] == 0:
+            return np.full(self.num_sessions, -1, dtype=np.int64)
+
+        if rng is None:
+            positions = probabilities.argmax(axis=1)
+        else:
+            cumulative = np.cumsum(probabilities, axis=1)
+            draws = rng.random(len(cards)) * cumulative[:, -1]
+            positions = np.minimum((cumulative <= draws[:, None]).sum(axis=1), np.maximum((cards >= 0).sum(axis=1) - 1, 0))
+
+        picks = cards[np.arange(len(cards)), positions].astype(np.int64)
+        self.add(picks)
+        return picks
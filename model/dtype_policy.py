@@ -0,0 +1,78 @@
+from pipeline import make_train_step
+import tensorflow as tf
+import numpy as np
+import time
+
+# Dtypes of a training run, picked with train.py --dtype-policy. inputs is the dtype of
+# the multi-hot rows the generators build, 0 and 1 are exact in each of them, so uint8
+# quarters and float16 halves the batch bytes of float32 without changing the data.
+# Targets are always float32, correlation targets are fractions. keras is the Keras
+# policy the layers compute in, the mixed policies compute in 16 bits and keep float32
+# variables. float16 math is only fast on GPUs and the few CPUs with float16 units, most
+# recent CPUs have bfloat16 instead (AVX512_BF16, AMX). Outputs stay float32, see Decoder.
+POLICIES = {
+    'float32': {'inputs': np.float32, 'keras': 'float32'},
+    'uint8': {'inputs': np.uint8, 'keras': 'float32'},
+    'mixed_float16': {'inputs': np.float16, 'keras': 'mixed_float16'},
+    # numpy has no bfloat16, the Encoder casts the uint8 rows
+    'mixed_bfloat16': {'inputs': np.uint8, 'keras': 'mixed_bfloat16'},
+}
+
+
+# layers take the global policy when they are created, so this runs before the model is
+def set_policy(name):
+    tf.keras.mixed_precision.set_global_policy(POLICIES[name]['keras'])
+    return POLICIES[name]
+
+
+def batch_nbytes(batch):
+    if isinstance(batch, (list, tuple)):
+        return sum(batch_nbytes(part) for part in batch)
+    # card index inputs, the values and row splits
+    if isinstance(batch, tf.RaggedTensor):
+        return sum(part.numpy().nbytes for part in tf.nest.flatten(batch, expand_composites=True))
+    return batch.nbytes
+
+
+# TensorFlow's allocator keeps its own peak, which unlike the process high-water mark can
+# be reset, so every policy is measured from its own start
+def memory_device():
+    return 'GPU:0' if tf.config.list_physical_devices('GPU') else 'CPU:0'
+
+
+def reset_peak_memory():
+    tf.config.experimental.reset_memory_stats(memory_device())
+    return tf.config.experimental.get_memory_info(memory_device())['current'] / 2**20
+
+
+def peak_memory_mb():
+    return tf.config.experimental.get_memory_info(memory_device())['peak'] / 2**20
+
+
+# trains on the first steps batches of generator and returns samples/s, leaving out the
+# first step which traces the train step, the bytes of one batch and the mean over the
+# steps of the loss and every metric. Metrics are reset every step, as train_on_batch does
+def train_steps(model, generator, steps):
+    train_step = make_train_step(model)
+    results = []
+    samples = 0
+    for i in range(steps + 1):
+        if i == 1:
+            start = time.perf_counter()
+        x, y = generator[i % len(generator)]
+        model.reset_metrics()
+        results.append(train_step(x, y))
+        if i > 0:
+            samples += sum(len(target) for target in y)
+    seconds = time.perf_counter() - start
+
+    means = {name: float(np.mean([result[name] for result in results])) for name in results[0]}
+    return samples / seconds, batch_nbytes(x) + batch_nbytes(y), means
+
+
+# largest difference of results from baseline, relative for the loss and absolute for
+# the metrics, which are fractions
+def max_difference(results, baseline):
+    differences = [abs(results['loss'] - baseline['loss']) / max(abs(baseline['loss']), 1e-12)]
+    differences += [abs(results[name] - baseline[name]) for name in baseline if name != 'loss' and not name.endswith('_loss')]
+    return max(differences)
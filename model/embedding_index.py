@@ -0,0 +1,137 @@
+import numpy as np
+
+# Card similarity on the table written by export_embeddings.py, one L2 normalized
+# encoder embedding per card, so a dot product is the cosine similarity demo/server/ml.js
+# computes one card at a time. exact_top_k scores every card, IVFIndex clusters the
+# cards with spherical k-means and only scores the cards of the num_probes clusters
+# closest to each query. Both take a [queries, dim] batch and return [queries, k]
+# indices and scores, best first.
+
+
+def normalize(x):
+    x = np.asarray(x, dtype=np.float32)
+    norms = np.linalg.norm(x, axis=-1, keepdims=True)
+    return x / np.maximum(norms, 1e-12)
+
+
+def load_embeddings(filename):
+    return np.load(filename, mmap_mode='r')
+
+
+# the k best columns of each row of scores, best first
+def top_k_rows(scores, k):
+    k = min(k, scores.shape[1])
+    top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+    top_scores = np.take_along_axis(scores, top, axis=1)
+    order = np.argsort(-top_scores, axis=1, kind='stable')
+    return np.take_along_axis(top, order, axis=1), np.take_along_axis(top_scores, order, axis=1)
+
+
+def exact_top_k(embeddings, queries, k, chunk_size=1024):
+    indices = []
+    scores = []
+    for start in range(0, len(queries), chunk_size):
+        chunk_indices, chunk_scores = top_k_rows(queries[start:start + chunk_size] @ embeddings.T, k)
+        indices.append(chunk_indices)
+        scores.append(chunk_scores)
+    return np.concatenate(indices), np.concatenate(scores)
+
+
+# fraction of the exact top k found by the approximate top k, per query then averaged
+def recall(exact_indices, approximate_indices):
+    hits = [len(np.intersect1d(exact, approximate)) for exact, approximate in zip(exact_indices, approximate_indices)]
+    return np.sum(hits) / exact_indices.size
+
+
+# the k cards closest to each of cards other than the card itself, what ml.js synergies
+# returns, searched with index when given, otherwise exactly
+def similar_cards(embeddings, cards, k, index=None):
+    cards = np.asarray(cards, dtype=np.int64)
+    search = exact_top_k if index is None else index.search
+    indices, scores = search(embeddings, np.asarray(embeddings[cards]), k + 1)
+    keep = np.argsort(indices == cards[:, None], axis=1, kind='stable')[:, :k]
+    return np.take_along_axis(indices, keep, axis=1), np.take_along_axis(scores, keep, axis=1)
+
+
+class IVFIndex:
+    def __init__(self, centroids, order, offsets, num_probes=8):
+        self.centroids = centroids
+        # the cards of list i are order[offsets[i]:offsets[i + 1]]
+        self.order = order
+        self.offsets = offsets
+        self.num_probes = num_probes
+
+    @property
+    def num_lists(self):
+        return len(self.centroids)
+
+    @classmethod
+    def build(cls, embeddings, num_lists=None, num_probes=8, iterations=10, rng=None):
+        rng = np.random.default_rng(0) if rng is None else rng
+        embeddings = np.asarray(embeddings, dtype=np.float32)
+        num_lists = num_lists or max(1, int(np.sqrt(len(embeddings))))
+
+        centroids = embeddings[rng.choice(len(embeddings), num_lists, replace=False)]
+        for _ in range(iterations):
+            assignment = np.argmax(embeddings @ centroids.T, axis=1)
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, assignment, embeddings)
+            # empty lists restart from a random card
+            empty = np.bincount(assignment, minlength=num_lists) == 0
+            sums[empty] = embeddings[rng.choice(len(embeddings), empty.sum(), replace=False)]
+            centroids = normalize(sums)
+
+        assignment = np.argmax(embeddings @ centroids.T, axis=1)
+        order = np.argsort(assignment, kind='stable')
+        offsets = np.concatenate(([0], np.cumsum(np.bincount(assignment, minlength=num_lists)))).astype(np.int64)
+        return cls(centroids, order, offsets, num_probes)
+
+    @classmethod
+    def load(cls, filename, num_probes=8):
+        with np.load(filename) as data:
+            return cls(data['centroids'], data['order'], data['offsets'], num_probes)
+
+    def save(self, filename):
+        np.savez(filename, centroids=self.centroids, order=self.order, offsets=self.offsets)
+
+    # candidate cards of every query as flat card indices plus per query offsets
+    def candidates(self, queries, num_probes):
+        probes = top_k_rows(queries @ self.centroids.T, num_probes)[0]
+        starts = self.offsets[probes].ravel()
+        lengths = self.offsets[probes + 1].ravel() - starts
+
+        # positions in order of every card of every probed list
+        list_offsets = np.concatenate(([0], np.cumsum(lengths)))
+        positions = np.arange(list_offsets[-1]) - np.repeat(list_offsets[:-1] - starts, lengths)
+        return self.order[positions], list_offsets[::num_probes]
+
+    def search(self, embeddings, queries, k, num_probes=None, chunk_size=16):
+        queries = np.asarray(queries, dtype=np.float32)
+        num_probes = min(num_probes or self.num_probes, self.num_lists)
+        indices = []
+        scores = []
+        for start in range(0, len(queries), chunk_size):
+            chunk_indices, chunk_scores = self.search_chunk(embeddings, queries[start:start + chunk_size], k, num_probes)
+            indices.append(chunk_indices)
+            scores.append(chunk_scores)
+        return np.concatenate(indices), np.concatenate(scores)
+
+    # queries with fewer than k candidates are padded with index -1 and score -inf
+    def search_chunk(self, embeddings, queries, k, num_probes):
+        flat, offsets = self.candidates(queries, num_probes)
+        indices = np.full((len(queries), k), -1, dtype=np.int64)
+        if len(flat) == 0:
+            return indices, np.full((len(queries), k), -np.inf, dtype=np.float32)
+
+        # candidates padded to the longest row of the chunk, padding scores -inf
+        lengths = np.diff(offsets)
+        positions = offsets[:-1, None] + np.arange(lengths.max())
+        valid = positions < offsets[1:, None]
+        cards = flat[np.minimum(positions, len(flat) - 1)]
+        scores = np.einsum('ijk,ik->ij', embeddings[cards], queries)
+        scores[~valid] = -np.inf
+
+        top, top_scores = top_k_rows(scores, k)
+        found = np.isfinite(top_scores)
+        indices[:, :top.shape[1]] = np.where(found, np.take_along_axis(cards, top, axis=1), -1)
+        return indices, np.pad(top_scores, ((0, 0), (0, k - top.shape[1])), constant_values=-np.inf)
@@ -0,0 +1,99 @@
+import numpy as np
+
+# Batch encoding shared by the generators. A batch of ragged card lists is handled
+# as (flat, offsets): the card indices of every row concatenated, plus an offsets
+# array of length rows + 1, the same layout CSRColumn.take returns.
+
+def flatten(lists):
+    offsets = np.zeros(len(lists) + 1, dtype=np.int64)
+    np.cumsum(np.fromiter(map(len, lists), dtype=np.int64, count=len(lists)), out=offsets[1:])
+    flat = np.fromiter((index for row in lists for index in row), dtype=np.int32, count=offsets[-1])
+    return flat, offsets
+
+
+def concat_rows(parts):
+    if len(parts) == 0:
+        return np.zeros(0, dtype=np.int32), np.zeros(1, dtype=np.int64)
+
+    flat = np.concatenate([part[0] for part in parts])
+    lengths = np.concatenate([np.diff(part[1]) for part in parts])
+    offsets = np.zeros(len(lengths) + 1, dtype=np.int64)
+    np.cumsum(lengths, out=offsets[1:])
+    return flat, offsets
+
+
+def row_ids(offsets):
+    return np.repeat(np.arange(len(offsets) - 1), np.diff(offsets))
+
+
+# builds a batch from row * num_cards + card keys, sorting each row and dropping duplicates
+def from_keys(keys, batch_size, num_cards):
+    keys = np.sort(keys)
+    if len(keys):
+        keys = keys[np.concatenate(([True], keys[1:] != keys[:-1]))]
+    offsets = np.zeros(batch_size + 1, dtype=np.int64)
+    np.cumsum(np.bincount(keys // num_cards, minlength=batch_size), out=offsets[1:])
+    return (keys % num_cards).astype(np.int32), offsets
+
+
+def unique_rows(flat, offsets, num_cards):
+    return from_keys(row_ids(offsets) * num_cards + flat, len(offsets) - 1, num_cards)
+
+
+# row-wise union of two batches with the same number of rows
+def union_rows(a, b, num_cards):
+    keys = np.concatenate((row_ids(a[1]) * num_cards + a[0], row_ids(b[1]) * num_cards + b[0]))
+    return from_keys(keys, len(a[1]) - 1, num_cards)
+
+
+# sets out[row, card] = 1 for every entry with one scatter into the flattened buffer
+def scatter(out, flat, offsets, value=1):
+    np.put(out, row_ids(offsets) * out.shape[1] + flat, value)
+    return out
+
+
+# rows beyond len(offsets) - 1 are left empty, so a short final batch still has batch_size rows
+def multi_hot(flat, offsets, num_cards, batch_size=None, dtype=np.float32, out=None):
+    if batch_size is None:
+        batch_size = len(offsets) - 1
+
+    if out is None:
+        out = np.zeros((batch_size, num_cards), dtype=dtype)
+    else:
+        if out.shape != (batch_size, num_cards) or not out.flags.c_contiguous:
+            raise ValueError('out must be a C-contiguous {} buffer, got {}'.format((batch_size, num_cards), out.shape))
+        out.fill(0)
+
+    return scatter(out, flat, offsets)
+
+
+def multi_hot_lists(lists, num_cards, batch_size=None, dtype=np.float32, out=None):
+    flat, offsets = flatten(lists)
+    return multi_hot(flat, offsets, num_cards, batch_size=batch_size, dtype=dtype, out=out)
+
+
+# Keeps one output buffer per name and reuses it for every batch. A buffer is
+# overwritten by the next encode call with the same name, so this is only safe when
+# each batch is consumed before the next one is built (no prefetch queue in between),
+# as in the batch workers of workers.py, which copy every batch out of the generator.
+class BatchEncoder:
+    def __init__(self, num_cards, dtype=np.float32):
+        self.num_cards = num_cards
+        self.dtype = dtype
+        self.buffers = {}
+
+    def buffer(self, name, batch_size, dtype=None):
+        dtype = self.dtype if dtype is None else dtype
+        buf = self.buffers.get(name)
+        if buf is None or buf.shape[0] != batch_size or buf.dtype != dtype:
+            buf = np.zeros((batch_size, self.num_cards), dtype=dtype)
+            self.buffers[name] = buf
+        return buf
+
+    def encode(self, name, flat, offsets, batch_size=None, dtype=None):
+        if batch_size is None:
+            batch_size = len(offsets) - 1
+        return multi_hot(flat, offsets, self.num_cards, batch_size=batch_size, out=self.buffer(name, batch_size, dtype))
+
+    def encode_lists(self, name, lists, batch_size=None):
+        return self.encode(name, *flatten(lists), batch_size=batch_size)
@@ -0,0 +1,187 @@
+from model import CubeCobraMLSystem
+from augment import NoiseAugmenter, make_rng
+from dataset import COLLECTIONS, list_shards, decode_shard
+from encoding import multi_hot, union_rows, unique_rows
+from metrics import TopRatedPercent, RelativePick
+import tensorflow as tf
+import multiprocessing
+import numpy as np
+import argparse
+import threading
+import queue
+import json
+import os
+import time
+
+# Scores a trained model on the test shards of process_data.js. Each head streams its
+# collection one JSON shard at a time, a background thread decodes the next shard and
+# cuts batches while the model predicts, and the metrics accumulate batch by batch.
+# With several workers every process loads the model and scores every workers-th shard,
+# their accumulators are merged at the end. Cubes are corrupted like DataGenerator does,
+# seeded per shard and batch so results do not depend on the number of workers.
+
+HEADS = {
+    'recommend': 'cubes',
+    'deck_build': 'decks',
+    'draft': 'picks',
+}
+
+
+def prefetch(iterable, size=4):
+    items = queue.Queue(size)
+    done = object()
+
+    def produce():
+        for item in iterable:
+            items.put(item)
+        items.put(done)
+
+    threading.Thread(target=produce, daemon=True).start()
+    while True:
+        item = items.get()
+        if item is done:
+            return
+        yield item
+
+
+# (shard number, batch number, columns) for every batch_size records of the shards
+def iter_batches(path, collection, shard_numbers, batch_size):
+    files = list_shards(path)
+    for shard_number in shard_numbers:
+        shard = decode_shard(os.path.join(path, files[shard_number]), collection)
+        for batch_number, start in enumerate(range(0, len(shard), batch_size)):
+            rows = np.arange(start, min(start + batch_size, len(shard)))
+            yield shard_number, batch_number, {name: shard[name].take(rows) for name in COLLECTIONS[collection]}
+
+
+class Evaluator:
+    def __init__(self, model, num_cards, augmenter=None, seed=0):
+        self.model = model
+        self.num_cards = num_cards
+        self.augmenter = augmenter
+        self.seed = seed
+
+    def ragged(self, indices):
+        return tf.RaggedTensor.from_row_splits(*unique_rows(*indices, self.num_cards), validate=False)
+
+    def metrics(self, head):
+        if head == 'draft':
+            return {'top1': RelativePick(1), 'top3': RelativePick(3)}
+        return {'accuracy': TopRatedPercent()}
+
+    # the true rows and predictions of one batch of a head
+    def predict(self, head, shard_number, batch_number, columns):
+        if head == 'recommend':
+            x = y = columns['cards']
+            if self.augmenter is not None:
+                x, y = self.augmenter.corrupt(*x, self.num_cards, make_rng(self.seed, shard_number, batch_number))
+            return multi_hot(*y, self.num_cards), self.model.recommend(self.ragged(x)).numpy()
+
+        if head == 'deck_build':
+            pools = union_rows(columns['mainboard'], columns['sideboard'], self.num_cards)
+            return multi_hot(*columns['mainboard'], self.num_cards), self.model.deck_build(self.ragged(pools)).numpy()
+
+        packs = multi_hot(*columns['pack'], self.num_cards)
+        return multi_hot(*columns['pick'], self.num_cards), self.model.draft(self.ragged(columns['pool']), packs).numpy()
+
+    def evaluate_head(self, head, path, shard_numbers, batch_size):
+        metrics = self.metrics(head)
+        samples = 0
+        start = time.perf_counter()
+        for shard_number, batch_number, columns in prefetch(iter_batches(path, HEADS[head], shard_numbers, batch_size)):
+            y_true, y_pred = self.predict(head, shard_number, batch_number, columns)
+            for metric in metrics.values():
+                metric.update(y_true, y_pred)
+            samples += len(y_true)
+        return {'metrics': metrics, 'samples': samples, 'seconds': time.perf_counter() - start}
+
+
+def merge_results(results):
+    merged = results[0]
+    for result in results[1:]:
+        for head, head_result in result.items():
+            for name, metric in head_result['metrics'].items():
+                merged[head]['metrics'][name].merge(metric)
+            merged[head]['samples'] += head_result['samples']
+            # workers run side by side, so a head took as long as its slowest worker
+            merged[head]['seconds'] = max(merged[head]['seconds'], head_result['seconds'])
+    return merged
+
+
+def evaluate_worker(params, worker=0, num_workers=1):
+    with open(params['freq_path']) as f:
+        card_freqs = json.load(f)
+    num_cards = len(card_freqs)
+
+    model = CubeCobraMLSystem(num_cards)
+    model.load_weights(params['model_dir'])
+
+    augmenter = None
+    if params['noise'] > 0:
+        augmenter = NoiseAugmenter([1 / (freq + 1) for freq in card_freqs], params['noise'], params['noise_std'])
+    evaluator = Evaluator(model, num_cards, augmenter, params['seed'])
+
+    results = {}
+    for head in params['heads']:
+        path = os.path.join(params['data_dir'], HEADS[head])
+        shard_numbers = range(worker, len(list_shards(path)), num_workers)
+        results[head] = evaluator.evaluate_head(head, path, shard_numbers, params['batch_size'])
+    return results
+
+
+def evaluate(params, num_workers=1):
+    if num_workers <= 1:
+        return evaluate_worker(params)
+
+    # TensorFlow does not survive fork, every worker starts a fresh interpreter
+    context = multiprocessing.get_context('spawn')
+    with context.Pool(num_workers) as pool:
+        results = pool.starmap(evaluate_worker, [(params, worker, num_workers) for worker in range(num_workers)])
+    return merge_results(results)
+
+
+def print_results(results):
+    print('{:<12}{:>10}{:>12}  {}'.format('head', 'samples', 'samples/s', 'metrics'))
+    for head, result in results.items():
+        rate = result['samples'] / result['seconds'] if result['seconds'] else 0
+        metrics = ', '.join('{} {:.4f}'.format(name, metric.result()) for name, metric in result['metrics'].items())
+        print('{:<12}{:>10}{:>12.1f}  {}'.format(head, result['samples'], rate, metrics))
+
+
+def results_json(results):
+    return {
+        head: {
+            'samples': result['samples'],
+            'seconds': result['seconds'],
+            **{name: metric.result() for name, metric in result['metrics'].items()},
+        }
+        for head, result in results.items()
+    }
+
+
+def parse_params(args=None):
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--model-dir', default='./model/')
+    parser.add_argument('--data-dir', default='../data/test/')
+    parser.add_argument('--freq-path', default='../data/train/oracleFrequency.json')
+    parser.add_argument('--heads', nargs='+', choices=list(HEADS), default=list(HEADS))
+    parser.add_argument('--batch-size', type=int, default=256)
+    parser.add_argument('--workers', type=int, default=1, help='processes, each scores every workers-th shard')
+    parser.add_argument('--noise', type=float, default=0, help='cube corruption as in training, 0.2 is what the generators train with')
+    parser.add_argument('--noise-std', type=float, default=0.1)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--out', default=None, help='also write the results to this JSON file')
+    return parser.parse_args(args)
+
+
+if __name__ == '__main__':
+    params = parse_params()
+
+    start = time.perf_counter()
+    results = evaluate(vars(params), params.workers)
+    print_results(results)
+    print('\nEvaluated in {:.1f} s'.format(time.perf_counter() - start))
+
+    if params.out:
+        with open(params.out, 'w') as f:
+            json.dump(results_json(results), f, indent=2)
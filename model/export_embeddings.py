@@ -0,0 +1,82 @@
+from embedding_index import IVFIndex, normalize, exact_top_k, recall
+from numpy_engine import NumpyEngine
+import numpy as np
+import argparse
+import json
+import os
+import time
+
+# Builds the card embedding table, the encoder on every one-hot card, which is the
+# encoder on the identity matrix. Each chunk of cards is encoded as rows of a single
+# card index, so no num_cards wide input is built. The normalized table is saved as a
+# float32 .npy, then an IVFIndex over it, and the recall and query time of the index
+# are measured against exact search.
+
+
+def build_table(encode, num_cards, chunk_size=1024):
+    table = []
+    for start in range(0, num_cards, chunk_size):
+        cards = np.arange(start, min(start + chunk_size, num_cards))
+        table.append(encode(cards))
+    return normalize(np.concatenate(table))
+
+
+# TensorFlow is only imported when encoding with the model rather than --weights
+def model_encoder(model_dir, num_cards):
+    from model import CubeCobraMLSystem
+    import tensorflow as tf
+
+    model = CubeCobraMLSystem(num_cards)
+    model.load_weights(model_dir)
+    return lambda cards: model.embed(tf.RaggedTensor.from_row_lengths(cards, np.ones(len(cards), dtype=np.int64))).numpy()
+
+
+def engine_encoder(weights):
+    engine = NumpyEngine(weights)
+    return lambda cards: engine.encode(list(cards[:, None]))
+
+
+def timed(fn, repeats=1):
+    start = time.perf_counter()
+    for _ in range(repeats):
+        result = fn()
+    return result, (time.perf_counter() - start) / repeats
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('model_dir', nargs='?', default='./model/')
+    parser.add_argument('out_file', nargs='?', default='./model/embeddings.npy')
+    parser.add_argument('--freq-path', default='../data/train/oracleFrequency.json')
+    parser.add_argument('--weights', default=None, help='encode with numpy_engine from this weight file instead of the model')
+    parser.add_argument('--lists', type=int, default=None, help='IVF lists, sqrt(num_cards) by default')
+    parser.add_argument('--probes', type=int, default=8, help='lists searched per query')
+    parser.add_argument('--k', type=int, default=100)
+    parser.add_argument('--queries', type=int, default=1000, help='cards queried to measure recall and latency')
+    params = parser.parse_args()
+
+    with open(params.freq_path) as f:
+        num_cards = len(json.load(f))
+
+    encode = engine_encoder(params.weights) if params.weights else model_encoder(params.model_dir, num_cards)
+    table, seconds = timed(lambda: build_table(encode, num_cards))
+    np.save(params.out_file, table)
+    print('Encoded {} cards in {:.2f} s, wrote {}\n'.format(num_cards, seconds, params.out_file))
+
+    index, seconds = timed(lambda: IVFIndex.build(table, params.lists, params.probes))
+    index_file = os.path.splitext(params.out_file)[0] + '.ivf.npz'
+    index.save(index_file)
+    print('Built {} lists in {:.2f} s, wrote {}\n'.format(index.num_lists, seconds, index_file))
+
+    rng = np.random.default_rng(0)
+    queries = table[rng.choice(num_cards, min(params.queries, num_cards), replace=False)]
+    (exact, _), exact_seconds = timed(lambda: exact_top_k(table, queries, params.k))
+    (approximate, _), ivf_seconds = timed(lambda: index.search(table, queries, params.k))
+    single = queries[:100]
+    _, exact_single = timed(lambda: [exact_top_k(table, query[None], params.k) for query in single])
+    _, ivf_single = timed(lambda: [index.search(table, query[None], params.k) for query in single])
+
+    print('recall@{} with {} probes: {:.4f}\n'.format(params.k, params.probes, recall(exact, approximate)))
+    print('{:<24}{:>12}{:>12}'.format('ms per query', 'exact', 'ivf'))
+    print('{:<24}{:>12.3f}{:>12.3f}'.format('batch of {}'.format(len(queries)), exact_seconds * 1000 / len(queries), ivf_seconds * 1000 / len(queries)))
+    print('{:<24}{:>12.3f}{:>12.3f}'.format('one at a time', exact_single * 1000 / len(single), ivf_single * 1000 / len(single)))
@@ -0,0 +1,84 @@
+from model import CubeCobraMLSystem
+from numpy_engine import NumpyEngine, write_weights
+import numpy as np
+import json
+import sys
+import time
+
+# usage: python export_numpy.py [model_dir] [out_file] [freq_path]
+# writes the weights of a trained model for numpy_engine.py and checks that the numpy
+# engine reproduces every head of the TensorFlow model on a random batch
+ACTIVATION_NAMES = ['relu', 'linear', 'sigmoid', 'softmax']
+
+
+# keras keeps the function, tf.nn.softmax is called softmax_v2
+def activation_name(layer):
+    name = layer.activation.__name__
+    for known in ACTIVATION_NAMES:
+        if name.startswith(known):
+            return known
+    raise ValueError('{} uses activation {}, the numpy engine has {}'.format(layer.name, name, ACTIVATION_NAMES))
+
+
+def layer_weights(component):
+    layers = []
+    for layer in component.model.layers:
+        kernel, bias = layer.get_weights()
+        layers.append({'kernel': kernel, 'bias': bias, 'activation': activation_name(layer)})
+    return layers
+
+
+# the components write_weights stores, by the attribute names of CubeCobraMLSystem
+def model_components(model):
+    return {
+        'encoder': layer_weights(model.encoder),
+        'cube_decoder': layer_weights(model.cube_decoder),
+        'deck_build_decoder': layer_weights(model.deck_build_decoder),
+        'draft_decoder': layer_weights(model.draft_decoder),
+        'correlation_decoder': layer_weights(model.correlation_decoder),
+    }
+
+
+if __name__ == '__main__':
+    params = sys.argv[1:]
+
+    model_dir = params[0] if len(params) > 0 else './model/'
+    out_file = params[1] if len(params) > 1 else './model/weights.bin'
+    freq_path = params[2] if len(params) > 2 else '../data/train/oracleFrequency.json'
+    tolerance = 1e-4
+
+    with open(freq_path) as f:
+        num_cards = len(json.load(f))
+
+    print('Loading Model...\n')
+    model = CubeCobraMLSystem(num_cards)
+    model.load_weights(model_dir)
+
+    write_weights(out_file, num_cards, model_components(model))
+
+    start = time.perf_counter()
+    engine = NumpyEngine(out_file)
+    print('Wrote {}, opened in {:.1f} ms\n'.format(out_file, (time.perf_counter() - start) * 1000))
+
+    rng = np.random.default_rng(0)
+    pools = np.zeros((16, num_cards), dtype=np.float32)
+    packs = np.zeros((16, num_cards), dtype=np.float32)
+    for i in range(16):
+        pools[i, rng.choice(num_cards, 45, replace=False)] = 1
+        packs[i, rng.choice(num_cards, 15, replace=False)] = 1
+
+    checks = [
+        ('encode', engine.encode(pools), model.embed(pools)),
+        ('encode indices', engine.encode([np.flatnonzero(row) for row in pools]), model.embed(pools)),
+        ('recommend', engine.recommend(pools), model.recommend(pools)),
+        ('deck_build', engine.deck_build(pools), model.deck_build(pools)),
+        ('draft', engine.draft(pools, packs), model.draft(pools, packs)),
+        ('correlate', engine.correlate(pools), model.correlate(pools)),
+    ]
+    for name, numpy_result, tf_result in checks:
+        error = np.max(np.abs(numpy_result - tf_result.numpy()))
+        print('{:<16} max abs error {:.2e}'.format(name, error))
+        if error > tolerance:
+            raise ValueError('{} differs from TensorFlow by {:.2e}, more than {:.0e}'.format(name, error, tolerance))
+
+    print('\nDone.\n')
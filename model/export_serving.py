@@ -0,0 +1,93 @@
+from model import CubeCobraMLSystem
+import tensorflow as tf
+import argparse
+import json
+
+# One SavedModel with the encoder and every head, instead of the five Keras models
+# save_weights writes. Each entry point is a named serving signature with a variable
+# batch size. *_indices signatures take card indices as the values and row_splits of
+# a ragged [batch, (cards)] tensor, signatures cannot take ragged tensors directly,
+# and return ragged results the same way. Dense signatures are XLA compiled when
+# jit_compile is set, the index signatures use sparse ops XLA does not compile.
+
+
+def ragged(values, row_splits):
+    return tf.RaggedTensor.from_row_splits(values, row_splits, validate=False)
+
+
+class ServingModule(tf.Module):
+    def __init__(self, model, k=100, deck_size=24, sideboard_size=24, jit_compile=True):
+        super().__init__()
+        self.model = model
+        num_cards = model.num_cards
+
+        dense = tf.TensorSpec([None, num_cards], tf.float32)
+        values = tf.TensorSpec([None], tf.int32)
+        splits = tf.TensorSpec([None], tf.int64)
+
+        def dense_function(fn, *specs):
+            return tf.function(fn, input_signature=list(specs), jit_compile=jit_compile)
+
+        def index_function(fn, *specs):
+            return tf.function(fn, input_signature=list(specs))
+
+        # not signatures, which tf.saved_model.save reserves for loaded objects
+        self.serving_functions = {
+            'embed': dense_function(
+                lambda cards: {'embedding': model.encoder(cards)}, dense),
+            'recommend': dense_function(
+                lambda cubes: {'scores': model.recommend(cubes)}, dense),
+            'deck_build': dense_function(
+                lambda pools: {'scores': model.deck_build(pools)}, dense),
+            'draft': dense_function(
+                lambda pools, packs: {'probabilities': model.draft(pools, packs)}, dense, dense),
+            'recommend_top_k': dense_function(
+                lambda cubes: model.recommend_top_k(cubes, k=k), dense),
+            'deck_build_top_k': dense_function(
+                lambda pools: model.deck_build_top_k(pools, k=deck_size, sideboard_k=sideboard_size), dense),
+
+            'embed_indices': index_function(
+                lambda cards, row_splits: {'embedding': model.encoder(ragged(cards, row_splits))}, values, splits),
+            'recommend_indices': index_function(
+                lambda cubes, row_splits: {'scores': model.recommend(ragged(cubes, row_splits))}, values, splits),
+            'deck_build_indices': index_function(
+                lambda pools, row_splits: {'scores': model.deck_build(ragged(pools, row_splits))}, values, splits),
+            'recommend_top_k_indices': index_function(
+                lambda cubes, row_splits: model.recommend_top_k(ragged(cubes, row_splits), k=k), values, splits),
+            'deck_build_top_k_indices': index_function(
+                lambda pools, row_splits: model.deck_build_top_k(ragged(pools, row_splits), k=deck_size, sideboard_k=sideboard_size), values, splits),
+            'draft_indices': index_function(self.draft_indices, values, splits, values, splits),
+        }
+
+    # probabilities of only the pack cards, in pack order, split like the packs
+    def draft_indices(self, pools, pool_splits, packs, pack_splits):
+        probabilities = self.model.draft_candidates(ragged(pools, pool_splits), ragged(packs, pack_splits))
+        return {'probabilities': probabilities.values, 'row_splits': probabilities.row_splits}
+
+
+def export_serving(model, out_dir, k=100, jit_compile=True):
+    module = ServingModule(model, k=k, jit_compile=jit_compile)
+    tf.saved_model.save(module, out_dir, signatures=module.serving_functions)
+    return module
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('model_dir', nargs='?', default='./model/')
+    parser.add_argument('out_dir', nargs='?', default='./model/serving/')
+    parser.add_argument('--freq-path', default='../data/train/oracleFrequency.json')
+    parser.add_argument('--k', type=int, default=100, help='adds and removes returned by the top k signatures')
+    parser.add_argument('--no-xla', action='store_true', help='do not XLA compile the dense signatures')
+    params = parser.parse_args()
+
+    with open(params.freq_path) as f:
+        num_cards = len(json.load(f))
+
+    print('Loading Model...\n')
+    model = CubeCobraMLSystem(num_cards)
+    model.load_weights(params.model_dir)
+
+    print('Exporting to {}...\n'.format(params.out_dir))
+    module = export_serving(model, params.out_dir, k=params.k, jit_compile=not params.no_xla)
+    print('Signatures: {}'.format(', '.join(sorted(module.serving_functions))))
+    print('Done.\n')
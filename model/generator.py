@@ -1,7 +1,11 @@
 from tensorflow.keras.utils import Sequence
+import tensorflow as tf
+from augment import NoiseAugmenter, make_rng
+from dataset import load_collection
+from encoding import multi_hot, union_rows, unique_rows
+from correlations import load_correlations
 import numpy as np
 import json
-import os
 
 class DataGenerator(Sequence):
     def __init__(
@@ -16,45 +20,44 @@ class DataGenerator(Sequence):
         noise_std=0.1,
         corr_multiplier=32, # loop through correlations 32 times per epoch
         cube_multiplier=8, # loop through cubes 8 times per epoch
+        seed=None, # makes shuffling and augmentation reproducible
+        sparse_inputs=False, # emit card indices instead of multi-hot model inputs
+        input_dtype=np.float32, # dtype of multi-hot model inputs, see dtype_policy.py
     ):
         super().__init__()
 
         print('Loading Data...\n')
         with open(freq_path) as f:
             card_freqs = json.load(f)
-        with open(correlations_path) as f:
-            card_correlations = json.load(f)
 
         self.num_batches = num_batches
         self.noise = noise
         self.noise_std = noise_std
         self.num_cards = len(card_freqs)
+        self.sparse_inputs = sparse_inputs
+        self.input_dtype = input_dtype
+        # a BatchEncoder, only set where batches are copied before the next is built
+        self.encoder = None
 
-        # card_correlations is stored in 1d format, but we need it in 2d format based on num_cards x num_cards
-        self.card_correlations_y = np.array(card_correlations).astype(np.uint)
-        self.card_correlations_y = self.card_correlations_y.reshape((self.num_cards, self.num_cards))
-
-        # Normalize each distribution
-        epsilon = 1
-        self.card_correlations_y = self.card_correlations_y / (self.card_correlations_y.sum(axis=1, keepdims=True) + epsilon)
-
-        self.card_correlations_x = np.identity(self.num_cards)
+        # sparse co-occurrence counts, rows are normalized when a batch asks for them
+        self.card_correlations = load_correlations(correlations_path, self.num_cards)
 
         # inverse of card frequency
         self.neg_sampler = np.array([1/(freq+1) for freq in card_freqs])
+        self.augmenter = NoiseAugmenter(self.neg_sampler, noise, noise_std)
+
+        # each batch draws from its own stream keyed by (epoch, batch_number)
+        self.seed = np.random.SeedSequence(seed).entropy
+        self.epoch = 0
 
         self.cubes_path = cubes_path
         self.decks_path = decks_path
         self.picks_path = picks_path
 
-        # list of files in cubes_path
-        self.x_cubes_files = np.array(os.listdir(cubes_path))
-        self.x_decks_files = np.array(os.listdir(decks_path))
-        self.x_picks_files = np.array(os.listdir(picks_path))
-
-        self.cubes = self.load_all(self.x_cubes_files, cubes_path)
-        self.decks = self.load_all(self.x_decks_files, decks_path)
-        self.picks = self.load_all(self.x_picks_files, picks_path)
+        # each collection is streamed into compact int32 card index columns
+        self.cubes = load_collection(cubes_path, 'cubes')
+        self.decks = load_collection(decks_path, 'decks')
+        self.picks = load_collection(picks_path, 'picks')
 
         self.x_cubes = len(self.cubes)
         self.x_decks = len(self.decks)
@@ -77,139 +80,81 @@ class DataGenerator(Sequence):
         
         self.prep_next_epoch()
 
-    def load_all(self, files, path):
-        data = []
-        for file, i in zip(files, range(len(files))):
-            print("Loading {} of {} from {}: {}".format(i, len(files), path, file))
-            with open(os.path.join(path, file)) as f:
-                data += json.load(f)
-        return np.array(data)    
-    
     def __len__(self):
         return self.num_batches
 
+    def batch_rows(self, indices, batch_number, batch_size):
+        start = (batch_number * batch_size) % len(indices)
+        return np.take(indices, np.arange(start, start + batch_size), mode='wrap')
+
     def __getitem__(self, batch_number):
-        # load those files
-        cubes = []
-        cube_index = (batch_number * self.cube_batch_size) % self.x_cubes
-        if cube_index + self.cube_batch_size < self.x_cubes:
-            cubes = self.cubes[cube_index:cube_index+self.cube_batch_size]
-        else:
-            cubes = np.concatenate((self.cubes[cube_index:], self.cubes[:self.cube_batch_size - (self.x_cubes - cube_index)]))
-        
-        decks = []
-        deck_index = (batch_number * self.deck_batch_size) % self.x_decks
-        if deck_index + self.deck_batch_size < self.x_decks:
-            decks = self.decks[deck_index:deck_index+self.deck_batch_size]
-        else:
-            decks = np.concatenate((self.decks[deck_index:], self.decks[:self.deck_batch_size - (self.x_decks - deck_index)]))
-
-        picks = []
-        pick_index = (batch_number * self.pick_batch_size) % self.x_picks
-        if pick_index + self.pick_batch_size < self.x_picks:
-            picks = self.picks[pick_index:pick_index+self.pick_batch_size]
-        else:
-            picks = np.concatenate((self.picks[pick_index:], self.picks[:self.pick_batch_size - (self.x_picks - pick_index)]))
-
-        X_cubes, y_cubes = self.generate_cubes(np.array(cubes), self.cube_batch_size)
-        X_decks, y_decks = self.generate_decks(np.array(decks), self.deck_batch_size)
-        X_picks, y_picks = self.generate_picks(np.array(picks), self.pick_batch_size)
-
-        corr_start = (batch_number * self.corr_batch_size) % self.num_cards
-        if corr_start + self.corr_batch_size < self.num_cards:
-            corr_indeces = self.corr_indices[corr_start:corr_start+self.corr_batch_size]
-        else:
-            corr_indeces = np.concatenate((self.corr_indices[corr_start:], self.corr_indices[:self.corr_batch_size - (self.num_cards - corr_start)]))
-        x_corr = self.card_correlations_x[corr_indeces]
-        y_corr = self.card_correlations_y[corr_indeces]
+        cube_rows = self.batch_rows(self.cube_indices, batch_number, self.cube_batch_size)
+        deck_rows = self.batch_rows(self.deck_indices, batch_number, self.deck_batch_size)
+        pick_rows = self.batch_rows(self.pick_indices, batch_number, self.pick_batch_size)
+
+        X_cubes, y_cubes = self.generate_cubes(cube_rows, self.cube_batch_size, self.batch_rng(batch_number))
+        X_decks, y_decks = self.generate_decks(deck_rows, self.deck_batch_size)
+        X_picks, y_picks = self.generate_picks(pick_rows, self.pick_batch_size)
+
+        corr_indeces = self.batch_rows(self.corr_indices, batch_number, self.corr_batch_size)
+        x_corr = self.encode_input((corr_indeces, np.arange(len(corr_indeces) + 1)), len(corr_indeces), 'x_corr')
+        y_corr = self.card_correlations.rows(corr_indeces)
 
         return [[X_cubes, X_decks, X_picks, x_corr], [y_cubes, y_decks, y_picks, y_corr]]
         
+    def batch_rng(self, batch_number):
+        return make_rng(self.seed, self.epoch, batch_number)
+
     def prep_next_epoch(self):
         # shuffle all indices
-        np.random.shuffle(self.cubes)
-        np.random.shuffle(self.decks)
-        np.random.shuffle(self.picks)
-        np.random.shuffle(self.corr_indices)
+        rng = make_rng(self.seed, self.epoch)
+        rng.shuffle(self.cube_indices)
+        rng.shuffle(self.deck_indices)
+        rng.shuffle(self.pick_indices)
+        rng.shuffle(self.corr_indices)
 
     def on_epoch_end(self):
+        self.epoch += 1
         self.prep_next_epoch()
 
-    def to_vector_encoding(self, indices, batch_size):
-        vec = np.zeros((batch_size,self.num_cards))
-        for i,index in enumerate(indices):
-            vec[i,index] = 1
-        return vec
-
-    def generate_cubes(self, raw_cubes, batch_size):
-        cubes = self.to_vector_encoding(raw_cubes, batch_size)
-
-        cut_mask = np.zeros((batch_size,self.num_cards))
-        add_mask = np.zeros((batch_size,self.num_cards))
-        y_cut_mask = np.zeros((batch_size,self.num_cards))
-
-        for i,cube in enumerate(cubes):
-            includes = np.where(cube == 1)[0]
-            excludes = np.where(cube == 0)[0]
-            size = len(includes)
-            noise = np.clip(
-                np.random.normal(self.noise,self.noise_std),
-                a_min = 0.05,
-                a_max = 0.8,
-            )
-            flip_amount = int(size * noise)
-            flip_include = np.random.choice(includes, flip_amount)
-
-            sampler = self.neg_sampler[excludes]
-            normalized = sampler / np.sum(sampler)
-
-            flip_exclude = np.random.choice(excludes, flip_amount, p=normalized)
-            y_flip_include = np.random.choice(flip_include, flip_amount//4)
-            cut_mask[i,flip_include] = -1
-            y_cut_mask[i,y_flip_include] = -1
-            add_mask[i,flip_exclude] = 1
-
-        x_cubes = cubes + cut_mask + add_mask
-        y_cubes = cubes + y_cut_mask
+    # multi-hot rows of a (flat, offsets) batch, built in the reused buffer name when
+    # the generator has an encoder, see workers.py
+    def multi_hot(self, name, indices, batch_size, dtype=np.float32):
+        if self.encoder is None:
+            return multi_hot(*indices, self.num_cards, batch_size, dtype=dtype)
+        return self.encoder.encode(name, *indices, batch_size=batch_size, dtype=dtype)
+
+    def encode_rows(self, name, column, rows, batch_size):
+        return self.multi_hot(name, column.take(rows), batch_size)
+
+    # in sparse mode model inputs are the deduplicated card indices of each row,
+    # which the Encoder sums kernel rows over, otherwise they are multi-hot rows
+    def encode_input(self, indices, batch_size, name):
+        if self.sparse_inputs:
+            return tf.RaggedTensor.from_row_splits(*unique_rows(*indices, self.num_cards), validate=False)
+        return self.multi_hot(name, indices, batch_size, dtype=self.input_dtype)
+
+    def generate_cubes(self, rows, batch_size, rng):
+        (x_flat, x_offsets), (y_flat, y_offsets) = self.augmenter.corrupt(*self.cubes['cards'].take(rows), self.num_cards, rng)
+
+        x_cubes = self.encode_input((x_flat, x_offsets), batch_size, 'x_cubes')
+        y_cubes = self.multi_hot('y_cubes', (y_flat, y_offsets), batch_size)
 
         return [x_cubes, y_cubes]
-    
-    
-    def encode_deck(self, mainboards, batch_size):
-        vec = np.zeros((batch_size,self.num_cards))
-        for i,mainboard in enumerate(mainboards):
-            for index in mainboard:
-                vec[i,index] = 1
-        return vec
-    
-    def encode_pool(self, mainboards, sideboards, batch_size):       
-        vec = np.zeros((batch_size, self.num_cards))
-        for i,mainboard in enumerate(mainboards):
-            for index in mainboard:
-                vec[i,index] = 1
-        for i,sideboard in enumerate(sideboards):
-            for index in sideboard:
-                vec[i,index] = 1
-        return vec
 
     # decks have mainboard, sideboard, basics
-    def generate_decks(self, decks, batch_size):        
-        mainboards = np.array(list(map(lambda x: x['mainboard'], decks)))
-        sideboards = np.array(list(map(lambda x: x['sideboard'], decks)))
+    def generate_decks(self, rows, batch_size):
+        mainboards = self.decks['mainboard'].take(rows)
+        sideboards = self.decks['sideboard'].take(rows)
 
-        x = self.encode_pool(mainboards, sideboards, batch_size)
-        y = self.encode_deck(mainboards, batch_size)
+        x = self.encode_input(union_rows(mainboards, sideboards, self.num_cards), batch_size, 'x_decks')
+        y = self.multi_hot('y_decks', mainboards, batch_size)
 
         return [x, y]
-    
-    def generate_picks(self, picks, batch_size):        
-        pools = np.array(list(map(lambda x: x['pool'], picks)))
-        packs = np.array(list(map(lambda x: x['pack'], picks)))
-        pick = np.array(list(map(lambda x: [x['pick']], picks)))
 
-        x_pool = self.to_vector_encoding(pools, batch_size)
-        x_pack = self.to_vector_encoding(packs, batch_size)
-        y_pick = self.to_vector_encoding(pick, batch_size)
+    def generate_picks(self, rows, batch_size):
+        x_pool = self.encode_input(self.picks['pool'].take(rows), batch_size, 'x_pools')
+        x_pack = self.encode_input(self.picks['pack'].take(rows), batch_size, 'x_packs')
+        y_pick = self.encode_rows('y_picks', self.picks['pick'], rows, batch_size)
 
         return [[x_pool, x_pack], y_pick]
-
@@ -0,0 +1,171 @@
+from tensorflow.keras.utils import Sequence
+import tensorflow as tf
+from augment import NoiseAugmenter, make_rng
+from dataset import CSRDataset
+from encoding import multi_hot, union_rows, unique_rows
+from correlations import load_correlations
+import numpy as np
+import json
+import os
+
+# Reads the memory-mapped CSR layout written by convert_data.py. Opening the data
+# only maps the files, so startup does not depend on dataset size and worker
+# processes share the same pages through the OS page cache.
+class DataGenerator(Sequence):
+    def __init__(
+        self,
+        data_path,
+        freq_path,
+        correlations_path,
+        num_batches=128,
+        noise=0.2,
+        noise_std=0.1,
+        corr_multiplier=32, # loop through correlations 32 times per epoch
+        cube_multiplier=8, # loop through cubes 8 times per epoch
+        seed=None, # makes shuffling and augmentation reproducible
+        sparse_inputs=False, # emit card indices instead of multi-hot model inputs
+        input_dtype=np.float32, # dtype of multi-hot model inputs, see dtype_policy.py
+        shard_size=10000, # records per shard when pipeline.py reads the data in blocks
+    ):
+        super().__init__()
+
+        print('Loading Data...\n')
+        with open(freq_path) as f:
+            card_freqs = json.load(f)
+
+        self.num_batches = num_batches
+        self.noise = noise
+        self.noise_std = noise_std
+        self.num_cards = len(card_freqs)
+        self.sparse_inputs = sparse_inputs
+        self.input_dtype = input_dtype
+        # a BatchEncoder, only set where batches are copied before the next is built
+        self.encoder = None
+
+        # sparse co-occurrence counts, rows are normalized when a batch asks for them
+        self.card_correlations = load_correlations(correlations_path, self.num_cards)
+
+        # inverse of card frequency
+        self.neg_sampler = np.array([1/(freq+1) for freq in card_freqs])
+        self.augmenter = NoiseAugmenter(self.neg_sampler, noise, noise_std)
+
+        # each batch draws from its own stream keyed by (epoch, batch_number)
+        self.seed = np.random.SeedSequence(seed).entropy
+        self.epoch = 0
+
+        self.data_path = data_path
+        self.shard_size = shard_size
+        self.cubes = CSRDataset(os.path.join(data_path, 'cubes'))
+        self.decks = CSRDataset(os.path.join(data_path, 'decks'))
+        self.picks = CSRDataset(os.path.join(data_path, 'picks'))
+
+        self.x_cubes = len(self.cubes)
+        self.x_decks = len(self.decks)
+        self.x_picks = len(self.picks)
+
+        self.corr_indices = np.arange(self.num_cards)
+        self.cube_indices = np.arange(self.x_cubes)
+        self.deck_indices = np.arange(self.x_decks)
+        self.pick_indices = np.arange(self.x_picks)
+
+        self.corr_batch_size = len(self.corr_indices) // self.num_batches * corr_multiplier
+        self.cube_batch_size = self.x_cubes // self.num_batches * cube_multiplier
+        self.deck_batch_size = self.x_decks // self.num_batches
+        self.pick_batch_size = self.x_picks // self.num_batches
+
+        print("Cube Batch Size: {}, for {} cubes".format(self.cube_batch_size, self.x_cubes))
+        print("Deck Batch Size: {}, for {} decks".format(self.deck_batch_size, self.x_decks))
+        print("Pick Batch Size: {}, for {} picks".format(self.pick_batch_size, self.x_picks))
+        print("Correlation Batch Size: {}".format(self.corr_batch_size))
+
+        self.prep_next_epoch()
+
+    def __len__(self):
+        return self.num_batches
+
+    # pipeline.py reads contiguous blocks of shard_size records as shards
+    def num_shards(self, collection):
+        return -(-len(getattr(self, collection)) // self.shard_size)
+
+    def read_shard(self, collection, shard):
+        dataset = getattr(self, collection)
+        rows = np.arange(shard * self.shard_size, min((shard + 1) * self.shard_size, len(dataset)))
+        return {name: column.take(rows) for name, column in dataset.columns.items()}
+
+    def batch_rows(self, indices, batch_number, batch_size):
+        start = (batch_number * batch_size) % len(indices)
+        rows = np.take(indices, np.arange(start, start + batch_size), mode='wrap')
+        # reading the mapped files in order keeps page faults sequential
+        return np.sort(rows)
+
+    def __getitem__(self, batch_number):
+        cube_rows = self.batch_rows(self.cube_indices, batch_number, self.cube_batch_size)
+        deck_rows = self.batch_rows(self.deck_indices, batch_number, self.deck_batch_size)
+        pick_rows = self.batch_rows(self.pick_indices, batch_number, self.pick_batch_size)
+
+        X_cubes, y_cubes = self.generate_cubes(cube_rows, self.cube_batch_size, self.batch_rng(batch_number))
+        X_decks, y_decks = self.generate_decks(deck_rows, self.deck_batch_size)
+        X_picks, y_picks = self.generate_picks(pick_rows, self.pick_batch_size)
+
+        corr_indeces = self.batch_rows(self.corr_indices, batch_number, self.corr_batch_size)
+        x_corr = self.encode_input((corr_indeces, np.arange(len(corr_indeces) + 1)), len(corr_indeces), 'x_corr')
+        y_corr = self.card_correlations.rows(corr_indeces)
+
+        return [[X_cubes, X_decks, X_picks, x_corr], [y_cubes, y_decks, y_picks, y_corr]]
+
+    def batch_rng(self, batch_number):
+        return make_rng(self.seed, self.epoch, batch_number)
+
+    def prep_next_epoch(self):
+        # shuffle all indices
+        rng = make_rng(self.seed, self.epoch)
+        rng.shuffle(self.cube_indices)
+        rng.shuffle(self.deck_indices)
+        rng.shuffle(self.pick_indices)
+        rng.shuffle(self.corr_indices)
+
+    def on_epoch_end(self):
+        self.epoch += 1
+        self.prep_next_epoch()
+
+    # multi-hot rows of a (flat, offsets) batch, built in the reused buffer name when
+    # the generator has an encoder, see workers.py
+    def multi_hot(self, name, indices, batch_size, dtype=np.float32):
+        if self.encoder is None:
+            return multi_hot(*indices, self.num_cards, batch_size, dtype=dtype)
+        return self.encoder.encode(name, *indices, batch_size=batch_size, dtype=dtype)
+
+    def encode_rows(self, name, column, rows, batch_size):
+        return self.multi_hot(name, column.take(rows), batch_size)
+
+    # in sparse mode model inputs are the deduplicated card indices of each row,
+    # which the Encoder sums kernel rows over, otherwise they are multi-hot rows
+    def encode_input(self, indices, batch_size, name):
+        if self.sparse_inputs:
+            return tf.RaggedTensor.from_row_splits(*unique_rows(*indices, self.num_cards), validate=False)
+        return self.multi_hot(name, indices, batch_size, dtype=self.input_dtype)
+
+    def generate_cubes(self, rows, batch_size, rng):
+        (x_flat, x_offsets), (y_flat, y_offsets) = self.augmenter.corrupt(*self.cubes['cards'].take(rows), self.num_cards, rng)
+
+        x_cubes = self.encode_input((x_flat, x_offsets), batch_size, 'x_cubes')
+        y_cubes = self.multi_hot('y_cubes', (y_flat, y_offsets), batch_size)
+
+        return [x_cubes, y_cubes]
+
+    # decks have mainboard, sideboard, basics
+    def generate_decks(self, rows, batch_size):
+        mainboards = self.decks['mainboard'].take(rows)
+        sideboards = self.decks['sideboard'].take(rows)
+
+        x = self.encode_input(union_rows(mainboards, sideboards, self.num_cards), batch_size, 'x_decks')
+        y = self.multi_hot('y_decks', mainboards, batch_size)
+
+        return [x, y]
+
+    def generate_picks(self, rows, batch_size):
+        x_pool = self.encode_input(self.picks['pool'].take(rows), batch_size, 'x_pools')
+        x_pack = self.encode_input(self.picks['pack'].take(rows), batch_size, 'x_packs')
+        y_pick = self.encode_rows('y_picks', self.picks['pick'], rows, batch_size)
+
+        return [[x_pool, x_pack], y_pick]
@@ -1,4 +1,11 @@
 from tensorflow.keras.utils import Sequence
+import tensorflow as tf
+from augment import NoiseAugmenter, make_rng
+from dataset import COLLECTIONS, decode_shard, list_shards
+from encoding import concat_rows, multi_hot, union_rows, unique_rows
+from shard_cache import ShardCache
+from shard_index import load_index
+from correlations import load_correlations
 import numpy as np
 import json
 import os
@@ -16,174 +23,209 @@ class DataGenerator(Sequence):
         noise_std=0.1,
         corr_multiplier=32, # loop through correlations 32 times per epoch
         cube_multiplier=16,
+        cache_bytes=2 * 1024 ** 3, # decoded shards kept in memory across batches
+        shards_per_batch=4, # shards whose records are shuffled together, about what a batch reads
+        seed=None, # makes shuffling and augmentation reproducible
+        sparse_inputs=False, # emit card indices instead of multi-hot model inputs
+        input_dtype=np.float32, # dtype of multi-hot model inputs, see dtype_policy.py
+        record_shuffle=False, # shuffle records across all shards and read them through the shard index
     ):
         super().__init__()
 
         print('Loading Data...\n')
         with open(freq_path) as f:
             card_freqs = json.load(f)
-        with open(correlations_path) as f:
-            card_correlations = json.load(f)
 
         self.num_batches = num_batches
         self.noise = noise
         self.noise_std = noise_std
         self.num_cards = len(card_freqs)
+        self.sparse_inputs = sparse_inputs
+        self.input_dtype = input_dtype
+        # a BatchEncoder, only set where batches are copied before the next is built
+        self.encoder = None
 
-        # card_correlations is stored in 1d format, but we need it in 2d format based on num_cards x num_cards
-        self.card_correlations_y = np.array(card_correlations).astype(np.uint)
-        self.card_correlations_y = self.card_correlations_y.reshape((self.num_cards, self.num_cards))
-
-        # Normalize each distribution
-        epsilon = 1
-        self.card_correlations_y = self.card_correlations_y / (self.card_correlations_y.sum(axis=1, keepdims=True) + epsilon)
-
-        self.card_correlations_x = np.identity(self.num_cards)
+        # sparse co-occurrence counts, rows are normalized when a batch asks for them
+        self.card_correlations = load_correlations(correlations_path, self.num_cards)
 
         # inverse of card frequency
         self.neg_sampler = np.array([1/(freq+1) for freq in card_freqs])
+        self.augmenter = NoiseAugmenter(self.neg_sampler, noise, noise_std)
+
+        # each batch draws from its own stream keyed by (epoch, batch_number)
+        self.seed = np.random.SeedSequence(seed).entropy
+        self.epoch = 0
 
         self.cubes_path = cubes_path
         self.decks_path = decks_path
         self.picks_path = picks_path
 
         # list of files in cubes_path
-        self.x_cubes_files = np.array(os.listdir(cubes_path))
-        self.x_decks_files = np.array(os.listdir(decks_path))
-        self.x_picks_files = np.array(os.listdir(picks_path))
+        self.x_cubes_files = np.array(list_shards(cubes_path))
+        self.x_decks_files = np.array(list_shards(decks_path))
+        self.x_picks_files = np.array(list_shards(picks_path))
+
+        self.shard_cache = ShardCache(cache_bytes)
+        self.shards_per_batch = shards_per_batch
+
+        # exact record counts and record offsets, built once and refreshed when shards change
+        self.record_shuffle = record_shuffle
+        self.cube_index = load_index(cubes_path)
+        self.deck_index = load_index(decks_path)
+        self.pick_index = load_index(picks_path)
 
-        self.x_cubes = len(self.x_cubes_files)
-        self.x_decks = len(self.x_decks_files)
-        self.x_picks = len(self.x_picks_files)
+        self.x_cubes = len(self.cube_index)
+        self.x_decks = len(self.deck_index)
+        self.x_picks = len(self.pick_index)
 
+        # record order of the epoch, set by prep_next_epoch
         self.corr_indices = np.arange(self.num_cards)
-        self.cube_indices = np.arange(self.x_cubes)
-        self.deck_indices = np.arange(self.x_decks)
-        self.pick_indices = np.arange(self.x_picks)
+        self.cube_indices = None
+        self.deck_indices = None
+        self.pick_indices = None
 
         self.corr_batch_size = (len(self.corr_indices) * corr_multiplier)// self.num_batches 
-        self.cube_batch_size = (len(self.x_cubes_files) * cube_multiplier) // self.num_batches
-        self.deck_batch_size = len(self.x_decks_files) // self.num_batches
-        self.pick_batch_size = len(self.x_picks_files) // self.num_batches
+        self.cube_batch_size = (self.x_cubes * cube_multiplier) // self.num_batches
+        self.deck_batch_size = self.x_decks // self.num_batches
+        self.pick_batch_size = self.x_picks // self.num_batches
 
-        print("Cube Batch Size: {}, for {} cubes".format(self.cube_batch_size, len(self.x_cubes_files)))
-        print("Deck Batch Size: {}, for {} decks".format(self.deck_batch_size, len(self.x_picks_files)))
-        print("Pick Batch Size: {}, for {} picks".format(self.pick_batch_size, len(self.x_picks_files)))
+        print("Cube Batch Size: {}, for {} cubes".format(self.cube_batch_size, self.x_cubes))
+        print("Deck Batch Size: {}, for {} decks".format(self.deck_batch_size, self.x_decks))
+        print("Pick Batch Size: {}, for {} picks".format(self.pick_batch_size, self.x_picks))
         print("Correlation Batch Size: {}, for {} correlations".format(self.corr_batch_size, len(self.corr_indices)))
         
         self.prep_next_epoch()
 
-    def load_all(self, files, path):
-        for file, i in zip(files, range(len(files))):
-            print("Loading {} of {} from {}: {}".format(i, len(files), path, file))
-            with open(os.path.join(path, file)) as f:
-                yield json.load(f)
+    @property
+    def samples_per_epoch(self):
+        return max(self.x_cubes, self.x_decks, self.x_picks)
+
+    # Every record once per epoch, in an order that keeps batches on few shards: the
+    # shards are shuffled and cut into groups of shards_per_batch, and the records of
+    # each group are shuffled together. Batches walk through the order, so each one
+    # reads the shards of one group, or two where it straddles a boundary.
+    def epoch_order(self, index, rng):
+        shards = rng.permutation(index.num_shards)
+        order = [np.zeros(0, dtype=np.int64)]
+        for start in range(0, len(shards), self.shards_per_batch):
+            group = shards[start:start + self.shards_per_batch]
+            rows = np.concatenate([np.arange(index.shard_offsets[shard], index.shard_offsets[shard + 1]) for shard in group])
+            order.append(rng.permutation(rows))
+        return np.concatenate(order)
+
+    # the batch_number-th batch_size records of order, wrapping around for collections
+    # looped through more than once per epoch. Decodes every shard they come from once,
+    # through the cache, and returns each column of the batch as (flat, offsets)
+    def load_batch(self, path, collection, order, batch_number, batch_size):
+        index = self.shard_index(collection)
+        rows = np.take(order, np.arange(batch_number * batch_size, (batch_number + 1) * batch_size), mode='wrap')
+        if self.record_shuffle:
+            return index.take(rows, collection)
+
+        shards = np.searchsorted(index.shard_offsets, rows, side='right') - 1
+        parts = []
+        for shard in np.unique(shards):
+            decoded = self.shard_cache.get(os.path.join(path, index.files[shard]), collection)
+            local = rows[shards == shard] - index.shard_offsets[shard]
+            parts.append({name: column.take(local) for name, column in decoded.columns.items()})
+        return {name: concat_rows([part[name] for part in parts]) for name in COLLECTIONS[collection]}
     
+    def shard_files(self, collection):
+        return {
+            'cubes': (self.x_cubes_files, self.cubes_path),
+            'decks': (self.x_decks_files, self.decks_path),
+            'picks': (self.x_picks_files, self.picks_path),
+        }[collection]
+
+    def shard_index(self, collection):
+        return {'cubes': self.cube_index, 'decks': self.deck_index, 'picks': self.pick_index}[collection]
+
+    # whole-shard access for pipeline.py. It reads from several threads, so it does not go through the cache
+    def num_shards(self, collection):
+        return len(self.shard_files(collection)[0])
+
+    def read_shard(self, collection, shard):
+        files, path = self.shard_files(collection)
+        decoded = decode_shard(os.path.join(path, files[shard]), collection)
+        return {name: column.take(np.arange(len(decoded))) for name, column in decoded.columns.items()}
+
     def __len__(self):
         return self.num_batches
 
     def __getitem__(self, batch_number):
-        # load those files
-        cubes = []
-        cube_index = (batch_number * self.cube_batch_size) % self.x_cubes
-        for i in range(cube_index, cube_index + self.cube_batch_size):
-            cubes.extend(next(self.load_all([self.x_cubes_files[i % self.x_cubes]], self.cubes_path)))
-        
-        decks = []
-        deck_index = (batch_number * self.deck_batch_size) % self.x_decks
-        for i in range(deck_index, deck_index + self.deck_batch_size):
-            decks.extend(next(self.load_all([self.x_decks_files[i % self.x_decks]], self.decks_path)))
-
-        picks = []
-        pick_index = (batch_number * self.pick_batch_size) % self.x_picks
-        for i in range(pick_index, pick_index + self.pick_batch_size):
-            picks.extend(next(self.load_all([self.x_picks_files[i % self.x_picks]], self.picks_path)))
-
-        X_cubes, y_cubes = self.generate_cubes(np.array(cubes), self.cube_batch_size)
-        X_decks, y_decks = self.generate_decks(np.array(decks), self.deck_batch_size)
-        X_picks, y_picks = self.generate_picks(np.array(picks), self.pick_batch_size)
-
-        corr_start = (batch_number * self.corr_batch_size) % self.num_cards
-        if corr_start + self.corr_batch_size < self.num_cards:
-            corr_indeces = self.corr_indices[corr_start:corr_start+self.corr_batch_size]
-        else:
-            corr_indeces = np.concatenate((self.corr_indices[corr_start:], self.corr_indices[:self.corr_batch_size - (self.num_cards - corr_start)]))
-        x_corr = self.card_correlations_x[corr_indeces]
-        y_corr = self.card_correlations_y[corr_indeces]
+        cubes = self.load_batch(self.cubes_path, 'cubes', self.cube_indices, batch_number, self.cube_batch_size)
+        decks = self.load_batch(self.decks_path, 'decks', self.deck_indices, batch_number, self.deck_batch_size)
+        picks = self.load_batch(self.picks_path, 'picks', self.pick_indices, batch_number, self.pick_batch_size)
+
+        X_cubes, y_cubes = self.generate_cubes(cubes['cards'], self.cube_batch_size, self.batch_rng(batch_number))
+        X_decks, y_decks = self.generate_decks(decks, self.deck_batch_size)
+        X_picks, y_picks = self.generate_picks(picks, self.pick_batch_size)
+
+        # wraps around as often as needed, batches may hold more rows than there are cards
+        corr_indeces = np.take(self.corr_indices, np.arange(batch_number * self.corr_batch_size, (batch_number + 1) * self.corr_batch_size), mode='wrap')
+        x_corr = self.encode_input((corr_indeces, np.arange(len(corr_indeces) + 1)), len(corr_indeces), 'x_corr')
+        y_corr = self.card_correlations.rows(corr_indeces)
 
         return [[X_cubes, X_decks, X_picks, x_corr], [y_cubes, y_decks, y_picks, y_corr]]
         
+    def batch_rng(self, batch_number):
+        return make_rng(self.seed, self.epoch, batch_number)
+
     def prep_next_epoch(self):
         # shuffle all indices
-        np.random.shuffle(self.cube_indices)
-        np.random.shuffle(self.deck_indices)
-        np.random.shuffle(self.pick_indices)
-        np.random.shuffle(self.corr_indices)
+        rng = make_rng(self.seed, self.epoch)
+        if self.record_shuffle:
+            self.cube_indices = rng.permutation(self.x_cubes)
+            self.deck_indices = rng.permutation(self.x_decks)
+            self.pick_indices = rng.permutation(self.x_picks)
+        else:
+            self.cube_indices = self.epoch_order(self.cube_index, rng)
+            self.deck_indices = self.epoch_order(self.deck_index, rng)
+            self.pick_indices = self.epoch_order(self.pick_index, rng)
+        rng.shuffle(self.corr_indices)
 
     def on_epoch_end(self):
+        self.epoch += 1
+        print("Shard cache: {}".format(self.shard_cache.stats()))
         self.prep_next_epoch()
 
-    def to_vector_encoding(self, indices, batch_size):
-        vec = np.zeros((batch_size,self.num_cards))
-        for i,index in enumerate(indices):
-            vec[i,index] = 1
-        return vec
-
-    def generate_cubes(self, raw_cubes, batch_size):
-        cubes = self.to_vector_encoding(raw_cubes, batch_size)
-
-        cut_mask = np.zeros((batch_size,self.num_cards))
-        add_mask = np.zeros((batch_size,self.num_cards))
-        y_cut_mask = np.zeros((batch_size,self.num_cards))
-
-        for i,cube in enumerate(cubes):
-            includes = np.where(cube == 1)[0]
-            excludes = np.where(cube == 0)[0]
-            size = len(includes)
-            noise = np.clip(
-                np.random.normal(self.noise,self.noise_std),
-                a_min = 0.05,
-                a_max = 0.8,
-            )
-            flip_amount = int(size * noise)
-            flip_include = np.random.choice(includes, flip_amount)
-
-            sampler = self.neg_sampler[excludes]
-            normalized = sampler / np.sum(sampler)
-
-            flip_exclude = np.random.choice(excludes, flip_amount, p=normalized)
-            y_flip_include = np.random.choice(flip_include, flip_amount//4)
-            cut_mask[i,flip_include] = -1
-            y_cut_mask[i,y_flip_include] = -1
-            add_mask[i,flip_exclude] = 1
-
-        x_cubes = cubes + cut_mask + add_mask
-        y_cubes = cubes + y_cut_mask
+    # multi-hot rows of a (flat, offsets) batch, built in the reused buffer name when
+    # the generator has an encoder, see workers.py
+    def multi_hot(self, name, indices, batch_size, dtype=np.float32):
+        if self.encoder is None:
+            return multi_hot(*indices, self.num_cards, batch_size, dtype=dtype)
+        return self.encoder.encode(name, *indices, batch_size=batch_size, dtype=dtype)
+
+    # indices is a (flat, offsets) batch
+    def to_vector_encoding(self, name, indices, batch_size):
+        return self.multi_hot(name, indices, batch_size)
+
+    # in sparse mode model inputs are the deduplicated card indices of each row,
+    # which the Encoder sums kernel rows over, otherwise they are multi-hot rows
+    def encode_input(self, indices, batch_size, name):
+        if self.sparse_inputs:
+            return tf.RaggedTensor.from_row_splits(*unique_rows(*indices, self.num_cards), validate=False)
+        return self.multi_hot(name, indices, batch_size, dtype=self.input_dtype)
+
+    def generate_cubes(self, raw_cubes, batch_size, rng):
+        (x_flat, x_offsets), (y_flat, y_offsets) = self.augmenter.corrupt(*raw_cubes, self.num_cards, rng)
+
+        x_cubes = self.encode_input((x_flat, x_offsets), batch_size, 'x_cubes')
+        y_cubes = self.to_vector_encoding('y_cubes', (y_flat, y_offsets), batch_size)
 
         return [x_cubes, y_cubes]
     
     
     def encode_deck(self, mainboards, batch_size):
-        vec = np.zeros((batch_size,self.num_cards))
-        for i,mainboard in enumerate(mainboards):
-            for index in mainboard:
-                vec[i,index] = 1
-        return vec
+        return self.to_vector_encoding('y_decks', mainboards, batch_size)
     
     def encode_pool(self, mainboards, sideboards, batch_size):       
-        vec = np.zeros((batch_size, self.num_cards))
-        for i,mainboard in enumerate(mainboards):
-            for index in mainboard:
-                vec[i,index] = 1
-        for i,sideboard in enumerate(sideboards):
-            for index in sideboard:
-                vec[i,index] = 1
-        return vec
+        return self.encode_input(union_rows(mainboards, sideboards, self.num_cards), batch_size, 'x_decks')
 
     # decks have mainboard, sideboard, basics
     def generate_decks(self, decks, batch_size):        
-        mainboards = np.array(list(map(lambda x: x['mainboard'], decks)))
-        sideboards = np.array(list(map(lambda x: x['sideboard'], decks)))
+        mainboards = decks['mainboard']
+        sideboards = decks['sideboard']
 
         x = self.encode_pool(mainboards, sideboards, batch_size)
         y = self.encode_deck(mainboards, batch_size)
@@ -191,12 +233,12 @@ class DataGenerator(Sequence):
         return [x, y]
     
     def generate_picks(self, picks, batch_size):        
-        pools = np.array(list(map(lambda x: x['pool'], picks)))
-        packs = np.array(list(map(lambda x: x['pack'], picks)))
-        pick = np.array(list(map(lambda x: [x['pick']], picks)))
+        pools = picks['pool']
+        packs = picks['pack']
+        pick = picks['pick']
 
-        x_pool = self.to_vector_encoding(pools, batch_size)
-        x_pack = self.to_vector_encoding(packs, batch_size)
-        y_pick = self.to_vector_encoding(pick, batch_size)
+        x_pool = self.encode_input(pools, batch_size, 'x_pools')
+        x_pack = self.encode_input(packs, batch_size, 'x_packs')
+        y_pick = self.to_vector_encoding('y_picks', pick, batch_size)
 
         return [[x_pool, x_pack], y_pick]
@@ -1,4 +1,7 @@
 from tensorflow.keras.utils import Sequence
+from correlations import load_correlations
+from encoding import multi_hot
+import tensorflow as tf
 import numpy as np
 import json
 import os
@@ -11,36 +14,24 @@ class DataGenerator(Sequence):
         batch_size=128,
         noise=0.2,
         noise_std=0.1,
+        sparse_inputs=False, # emit card indices instead of identity rows
+        input_dtype=np.float32, # dtype of multi-hot model inputs, see dtype_policy.py
     ):
         super().__init__()
 
         print('Loading Data...\n')
         with open(freq_path) as f:
             card_freqs = json.load(f)
-        with open(correlations_path) as f:
-            card_correlations = json.load(f)
 
         self.batch_size = batch_size
         self.noise = noise
         self.noise_std = noise_std
         self.num_cards = len(card_freqs)
+        self.sparse_inputs = sparse_inputs
+        self.input_dtype = input_dtype
 
-        # card_correlations is stored in 1d format, but we need it in 2d format based on num_cards x num_cards
-        self.card_correlations_y = np.array(card_correlations).astype(np.uint)
-        self.card_correlations_y = self.card_correlations_y.reshape((self.num_cards, self.num_cards))
-
-
-        for i in range(100):
-            print(i, self.card_correlations_y[i].sum())
-
-        # Normalize each distribution
-        epsilon = 1
-        self.card_correlations_y = self.card_correlations_y / (self.card_correlations_y.sum(axis=1, keepdims=True) + epsilon)
-
-        for i in range(100):
-            print(i, self.card_correlations_y[i].sum())
-
-        self.card_correlations_x = np.identity(self.num_cards)
+        # sparse co-occurrence counts, rows are normalized when a batch asks for them
+        self.card_correlations = load_correlations(correlations_path, self.num_cards)
 
         self.corr_indices = np.arange(self.num_cards)
 
@@ -53,18 +44,16 @@ class DataGenerator(Sequence):
 
     def __getitem__(self, batch_number):
         corr_indeces = self.corr_indices[batch_number * self.batch_size:(batch_number + 1) * self.batch_size]
-        x_corr = self.card_correlations_x[corr_indeces]
-        y_corr = self.card_correlations_y[corr_indeces]
-
-        # print sum accross first axis
-        print(x_corr.sum(axis=1))
-        print(y_corr.sum(axis=1))
-
-        # print the mean accross first axis
-        print(x_corr.mean(axis=1) * self.num_cards)
-        print(y_corr.mean(axis=1) * self.num_cards)
+        x_corr = self.encode_input((corr_indeces, np.arange(len(corr_indeces) + 1)), len(corr_indeces))
+        y_corr = self.card_correlations.rows(corr_indeces)
 
         return [x_corr, y_corr]
+
+    # each input row is a single card, either as its index or as an identity row
+    def encode_input(self, indices, batch_size):
+        if self.sparse_inputs:
+            return tf.RaggedTensor.from_row_splits(*indices, validate=False)
+        return multi_hot(*indices, self.num_cards, batch_size, dtype=self.input_dtype)
         
     def prep_next_epoch(self):
         np.random.shuffle(self.corr_indices)
@@ -0,0 +1,107 @@
+import numpy as np
+import argparse
+import asyncio
+import json
+import time
+
+# Load test for serve.py. For every concurrency level that many clients send requests
+# back to back over keep-alive connections for --seconds, then throughput and latency
+# percentiles are printed next to the batch sizes the server formed, which shows what
+# the micro-batching trades: more concurrency fills larger batches and raises
+# throughput, at the cost of tail latency.
+
+
+def make_body(endpoint, oracles, rng, cube_size, pack_size):
+    def cards(count):
+        return [oracles[i] for i in rng.choice(len(oracles), count, replace=False)]
+    if endpoint == 'draft':
+        return {'pack': cards(pack_size), 'pool': cards(cube_size // 8)}
+    if endpoint == 'rotodraft':
+        return {'pool': cards(cube_size // 8)}
+    return {'cards': cards(cube_size)}
+
+
+async def request(reader, writer, method, path, body=None):
+    payload = json.dumps(body).encode('utf-8') if body is not None else b''
+    writer.write('{} {} HTTP/1.1\r\nHost: localhost\r\nContent-Type: application/json\r\nContent-Length: {}\r\n\r\n'.format(
+        method, path, len(payload)).encode('latin-1') + payload)
+    await writer.drain()
+
+    status = int((await reader.readline()).split()[1])
+    length = 0
+    while True:
+        line = await reader.readline()
+        if line in (b'\r\n', b'\n', b''):
+            break
+        name, _, value = line.decode('latin-1').partition(':')
+        if name.strip().lower() == 'content-length':
+            length = int(value)
+    response = json.loads(await reader.readexactly(length))
+    if status != 200:
+        raise RuntimeError('{} {} returned {}: {}'.format(method, path, status, response))
+    return response
+
+
+async def client(host, port, path, bodies, deadline, latencies):
+    reader, writer = await asyncio.open_connection(host, port)
+    try:
+        i = 0
+        while time.perf_counter() < deadline:
+            start = time.perf_counter()
+            await request(reader, writer, 'POST', path, bodies[i % len(bodies)])
+            latencies.append(time.perf_counter() - start)
+            i += 1
+    finally:
+        writer.close()
+
+
+async def metrics(host, port):
+    reader, writer = await asyncio.open_connection(host, port)
+    try:
+        return await request(reader, writer, 'GET', '/metrics')
+    finally:
+        writer.close()
+
+
+def batch_counts(summary):
+    return {int(size): count for size, count in summary['batch_sizes'].items()}
+
+
+async def run(params):
+    with open(params.oracle_map) as f:
+        oracles = list(json.load(f).values())
+    rng = np.random.default_rng(0)
+    bodies = [make_body(params.endpoint, oracles, rng, params.cube_size, params.pack_size) for _ in range(256)]
+    path = '/api/' + params.endpoint
+
+    print('{:<12}{:>12}{:>10}{:>10}{:>10}{:>12}'.format('clients', 'requests/s', 'p50 ms', 'p90 ms', 'p99 ms', 'mean batch'))
+    for concurrency in params.concurrency:
+        before = batch_counts((await metrics(params.host, params.port))[path])
+        latencies = []
+        start = time.perf_counter()
+        deadline = start + params.seconds
+        await asyncio.gather(*[client(params.host, params.port, path, bodies[i::concurrency] or bodies, deadline, latencies) for i in range(concurrency)])
+        elapsed = time.perf_counter() - start
+
+        after = batch_counts((await metrics(params.host, params.port))[path])
+        batches = {size: after[size] - before.get(size, 0) for size in after}
+        num_batches = sum(batches.values())
+        mean_batch = sum(size * count for size, count in batches.items()) / num_batches if num_batches else 0
+
+        p50, p90, p99 = np.percentile(np.array(latencies) * 1000, [50, 90, 99]) if latencies else (0, 0, 0)
+        print('{:<12}{:>12.1f}{:>10.1f}{:>10.1f}{:>10.1f}{:>12.1f}'.format(concurrency, len(latencies) / elapsed, p50, p90, p99, mean_batch))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--endpoint', choices=['recommend', 'deckbuild', 'draft', 'rotodraft', 'embed'], default='recommend')
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 4, 16, 64])
+    parser.add_argument('--seconds', type=float, default=10)
+    parser.add_argument('--cube-size', type=int, default=360)
+    parser.add_argument('--pack-size', type=int, default=15)
+    parser.add_argument('--oracle-map', default='../demo/server/indexToOracleMap.json')
+    params = parser.parse_args()
+
+    asyncio.run(run(params))
@@ -1,35 +1,111 @@
 import numpy as np
 import tensorflow as tf
-import math
+
+# Test metrics on whole batches. y_true and y_pred are [batch, num_cards] arrays, the
+# *_rows functions return one score per row, top_rated_percent and relative_pick their
+# mean. TopRatedPercent and RelativePick accumulate the same means batch by batch and
+# merge across workers, TopRatedPercentMetric and RelativePickMetric are the Keras
+# versions for model.compile / model.evaluate.
 
 def decode_vector(vector):
-    return [i for i, x in enumerate(vector) if x == 1]
+    return np.flatnonzero(np.asarray(vector) == 1)
 
 def get_top_n_indices(vector, n):
-    return np.argpartition(vector, -n)[-n:]
+    return np.argpartition(vector, -n, axis=-1)[..., -n:]
 
-def top_rated_percent(y_true, y_pred):
-    accuracies = []
+# the cards of each row's true cube against its ceil(1.2 * size) highest predictions,
+# (matches + 1) / (size + 1)
+def top_rated_cutoff(sizes):
+    # ceil(1.2 * size) in integers, float32 rounds 50 * 1.2 up to 60.000004
+    return (sizes * 6 + 4) // 5
+
+def top_rated_percent_rows(y_true, y_pred):
+    y_true = np.asarray(y_true) == 1
+    y_pred = np.asarray(y_pred)
 
-    for i in range(len(y_true)):
-        true_cube = decode_vector(y_true[i])
-        pred_cube = get_top_n_indices(y_pred[i], math.ceil(len(true_cube) * 1.2))
-        
-        accuracy = (len(set(true_cube) & set(pred_cube)) + 1) / (len(true_cube) + 1)
-        accuracies.append(accuracy)
+    sizes = y_true.sum(axis=1)
+    top_n = np.minimum(top_rated_cutoff(sizes.astype(np.int64)), y_pred.shape[1])
+    max_n = top_n.max(initial=0)
+    if max_n == 0:
+        return np.ones(len(y_true))
 
-    return np.mean(accuracies)
+    # the max_n best of each row, best first, then only the first top_n of each count
+    top = get_top_n_indices(y_pred, max_n)
+    order = np.argsort(-np.take_along_axis(y_pred, top, axis=1), axis=1, kind='stable')
+    top = np.take_along_axis(top, order, axis=1)
+
+    hits = np.take_along_axis(y_true, top, axis=1) & (np.arange(max_n) < top_n[:, None])
+    return (hits.sum(axis=1) + 1) / (sizes + 1)
+
+def top_rated_percent(y_true, y_pred):
+    return np.mean(top_rated_percent_rows(y_true, y_pred))
+
+# 1 where the true pick is among the k highest predictions
+def relative_pick_rows(y_true, y_pred, k):
+    true_top = np.argmax(y_true, axis=1)
+    pred_top = get_top_n_indices(np.asarray(y_pred), k)
+    return (pred_top == true_top[:, None]).any(axis=1).astype(np.float64)
 
 def relative_pick(y_true, y_pred, k):
-    accuracies = []
+    return np.mean(relative_pick_rows(y_true, y_pred, k))
+
+
+class StreamingMean:
+    def __init__(self):
+        self.total = 0.0
+        self.count = 0
+
+    def add(self, values):
+        self.total += float(np.sum(values))
+        self.count += len(values)
+
+    def merge(self, other):
+        self.total += other.total
+        self.count += other.count
+        return self
+
+    def result(self):
+        return self.total / self.count if self.count else 0.0
+
+
+class TopRatedPercent(StreamingMean):
+    def update(self, y_true, y_pred):
+        self.add(top_rated_percent_rows(y_true, y_pred))
+
+
+class RelativePick(StreamingMean):
+    def __init__(self, k):
+        super().__init__()
+        self.k = k
+
+    def update(self, y_true, y_pred):
+        self.add(relative_pick_rows(y_true, y_pred, self.k))
+
+
+class TopRatedPercentMetric(tf.keras.metrics.Mean):
+    def __init__(self, name='top_rated_percent', **kwargs):
+        super().__init__(name=name, **kwargs)
+
+    def update_state(self, y_true, y_pred, sample_weight=None):
+        y_true = tf.cast(tf.equal(y_true, 1), tf.float32)
+        sizes = tf.reduce_sum(y_true, axis=1)
+        top_n = tf.minimum(top_rated_cutoff(tf.cast(sizes, tf.int32)), tf.shape(y_pred)[1])
+
+        # top_k returns the best first
+        _, top = tf.math.top_k(y_pred, k=tf.reduce_max(top_n))
+        ranks = tf.range(tf.shape(top)[1])
+        hits = tf.gather(y_true, top, batch_dims=1) * tf.cast(ranks[None, :] < top_n[:, None], tf.float32)
+        return super().update_state((tf.reduce_sum(hits, axis=1) + 1) / (sizes + 1), sample_weight)
+
 
-    for i in range(len(y_true)):
-        true_top = get_top_n_indices(y_true[i], 1)
-        pred_top = get_top_n_indices(y_pred[i], k)
+class RelativePickMetric(tf.keras.metrics.Mean):
+    def __init__(self, k, name=None, **kwargs):
+        super().__init__(name=name or 'relative_pick_top{}'.format(k), **kwargs)
+        self.k = k
 
-        if true_top in pred_top:
-            accuracies.append(1)
-        else:
-            accuracies.append(0)
+    def update_state(self, y_true, y_pred, sample_weight=None):
+        hits = tf.math.in_top_k(tf.argmax(y_true, axis=1), y_pred, self.k)
+        return super().update_state(tf.cast(hits, tf.float32), sample_weight)
 
-    return np.mean(accuracies)
+    def get_config(self):
+        return {**super().get_config(), 'k': self.k}
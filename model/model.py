@@ -3,18 +3,74 @@ from tensorflow.keras.layers import Dense
 from tensorflow.keras.models import Model, Sequential
 from tensorflow import keras
 
+import numpy as np
+import hashlib
 import os
+
+def is_sparse(x):
+    return isinstance(x, (tf.RaggedTensor, tf.SparseTensor))
+
+# card index inputs are ragged [batch, (cards)] tensors, or sparse tensors holding card indices as values
+def to_multi_hot_sparse(indices, num_cards, dtype=tf.float32):
+    if isinstance(indices, tf.SparseTensor):
+        indices = tf.RaggedTensor.from_sparse(indices)
+    coords = tf.stack([indices.value_rowids(), tf.cast(indices.values, tf.int64)], axis=1)
+    ones = tf.ones_like(indices.values, dtype=dtype)
+    return tf.SparseTensor(coords, ones, tf.stack([indices.nrows(), tf.cast(num_cards, tf.int64)]))
+
+def to_ragged(indices):
+    if isinstance(indices, tf.SparseTensor):
+        return tf.RaggedTensor.from_sparse(indices)
+    return indices
+
+# softmax over each row of a ragged tensor
+def ragged_softmax(logits):
+    rows = logits.value_rowids()
+    shifted = logits.values - tf.gather(tf.math.segment_max(logits.values, rows), rows)
+    exp = tf.exp(shifted)
+    return logits.with_values(exp / tf.gather(tf.math.segment_sum(exp, rows), rows))
+
+def to_multi_hot(indices, num_cards):
+    sparse = to_multi_hot_sparse(indices, num_cards)
+    return tf.minimum(tf.scatter_nd(sparse.indices, sparse.values, sparse.dense_shape), 1.0)
+
 class Encoder(Model):
-    def __init__(self,name):
+    def __init__(self, name, num_cards=None):
         super().__init__()
+        self.num_cards = num_cards
         self.model = Sequential([
             Dense(512, activation='relu', name=name + "_e1"),
             Dense(256, activation='relu', name=name + "_e3"),
             Dense(128, activation='linear', name=name + "_bottleneck")
         ])
     
+    # multi-hot rows may be uint8 or float16 (dtype_policy.py), Dense layers only cast
+    # floating point inputs to their compute dtype themselves
     def call(self, x):
-        return self.model(x)
+        if is_sparse(x):
+            return self.from_preactivation(self.preactivation(x))
+        return self.model(tf.cast(x, self.compute_dtype))
+
+    # The first layer on card indices: multiplying a multi-hot row by the kernel is the
+    # sum of the kernel rows of its cards, so this uses the same weights as the dense
+    # path without building num_cards wide inputs. Rows must not repeat a card.
+    def preactivation(self, indices):
+        # the Sequential is never called as a whole on this path, building it builds
+        # every layer and lets Keras list its weights for training
+        if not self.model.built:
+            self.model.build((None, self.num_cards))
+        first = self.model.layers[0]
+        # under a mixed policy the kernel reads as float16 or bfloat16 here, the sparse
+        # matmul needs both operands in the same dtype
+        sparse = to_multi_hot_sparse(indices, first.kernel.shape[0], self.compute_dtype)
+        return tf.sparse.sparse_dense_matmul(sparse, first.kernel) + first.bias
+
+    def from_preactivation(self, preactivation):
+        layers = self.model.layers
+        x = layers[0].activation(preactivation)
+        for layer in layers[1:]:
+            x = layer(x)
+        return x
     
     def save_weights(self, filename):
         print('Saving weights to ' + filename)
@@ -23,6 +79,9 @@ class Encoder(Model):
     def load_weights(self, filename):
         self.model = keras.models.load_model(filename)
     
+# candidates per batch above which Decoder.candidate_logits transposes the output kernel
+TRANSPOSE_CANDIDATES = 512
+
 class Decoder(Model):
     def __init__(self, name, output_dim, output_act):
         super().__init__()
@@ -30,11 +89,36 @@ class Decoder(Model):
         self.model = Sequential([
             Dense(256, activation='relu', name=name + "_d1"),
             Dense(512, activation='relu', name=name + "_d3"),
-            Dense(output_dim, activation=output_act, name=name + "_reconstruction")
+            # outputs stay float32 under a mixed precision policy, a float16 sigmoid or
+            # softmax saturates and the losses clip to 1e-7, below float16 precision
+            Dense(output_dim, activation=output_act, name=name + "_reconstruction", dtype='float32')
         ])
     
     def call(self, x):
         return self.model(x)
+
+    # Logits of only the candidate cards of each row, candidates are card indices as a
+    # ragged [batch, (cards)] or sparse tensor. The output layer is evaluated for the
+    # gathered kernel columns alone, so the cost is per candidate instead of per card.
+    # Returns logits before the output activation, ragged like candidates.
+    def candidate_logits(self, x, candidates, training=None):
+        candidates = to_ragged(candidates)
+        layers = self.model.layers
+        for layer in layers[:-1]:
+            x = layer(x, training=training)
+
+        last = layers[-1]
+        if not last.built:
+            last.build(x.shape)
+        cards = tf.cast(candidates.values, tf.int32)
+        # gathering kernel columns reads one cache line per unit and card, past a few
+        # hundred candidates transposing the kernel once and gathering rows is faster
+        kernel = tf.cond(
+            tf.size(cards) > TRANSPOSE_CANDIDATES,
+            lambda: tf.gather(tf.transpose(last.kernel), cards),
+            lambda: tf.transpose(tf.gather(last.kernel, cards, axis=1)))
+        hidden = tf.cast(tf.gather(x, candidates.value_rowids()), kernel.dtype)
+        return candidates.with_values(tf.reduce_sum(hidden * kernel, axis=1) + tf.gather(last.bias, cards))
     
     def save_weights(self, filename):
         print('Saving weights to ' + filename)
@@ -47,9 +131,10 @@ class Decoder(Model):
 class RegularizationSystem(Model):
     def __init__(self, num_cards):
         super().__init__()
-        self.encoder = Encoder('encoder')
+        self.encoder = Encoder('encoder', num_cards)
         self.correlation_decoder = Decoder('correlate', num_cards, tf.nn.softmax)
 
+    # inputs are multi-hot rows or card indices, see Encoder.preactivation
     def call(self, inputs, training=None):
         embedding = self.encoder(inputs, training=training)
         return self.correlation_decoder(embedding, training=training)
@@ -62,47 +147,175 @@ class RegularizationSystem(Model):
         self.encoder.load_weights(os.path.join(filename, "encoder", 'model'))
         self.correlation_decoder.load_weights(os.path.join(filename, "correlation_decoder", 'model'))
 
+HEADS = ('recommend', 'deck_build', 'draft', 'correlate')
+
+# rows of every input stacked into one batch, so the encoder runs once over all of them
+def concat_inputs(inputs):
+    if any(is_sparse(x) for x in inputs):
+        return tf.concat([x if isinstance(x, tf.RaggedTensor) else tf.RaggedTensor.from_sparse(x) for x in inputs], axis=0)
+    return tf.concat(inputs, axis=0)
+
+def num_rows(x):
+    if isinstance(x, tf.RaggedTensor):
+        return x.nrows(out_type=tf.int32)
+    if isinstance(x, tf.SparseTensor):
+        return tf.cast(x.dense_shape[0], tf.int32)
+    return tf.shape(x)[0]
+
+# top k scores per row among the cards where mask is set, rows with fewer than k such
+# cards are padded with -inf scores
+def masked_top_k(scores, mask, k):
+    k = min(k, scores.shape[-1])
+    return tf.math.top_k(tf.where(mask > 0, scores, -np.inf), k=k)
+
+def to_mask(cards, num_cards):
+    if is_sparse(cards):
+        return to_multi_hot(cards, num_cards)
+    return cards
+
 class CubeCobraMLSystem(Model):
     def __init__(self, num_cards):
         super().__init__()
-        self.encoder = Encoder('encoder')
+        self.num_cards = num_cards
+        self.encoder = Encoder('encoder', num_cards)
         self.cube_decoder = Decoder('recommend', num_cards, tf.nn.sigmoid)
         self.draft_decoder = Decoder('draft', num_cards, "linear")
         self.deck_build_decoder = Decoder('deck_build', num_cards, tf.nn.sigmoid)
         self.correlation_decoder = Decoder('correlate', num_cards, tf.nn.softmax)
 
     # inputs is [[cubes], [decks], [[packs], [pools]], [cards]]
+    # every input may be multi-hot rows or card indices, see Encoder.preactivation.
+    # The encoder runs once over the rows of all four tasks, the embeddings are then
+    # split back per task
     @tf.function
     def call(self, inputs, training=None):
+        encoder_inputs = [inputs[0], inputs[1], inputs[2][0], inputs[3]]
+        sizes = [num_rows(x) for x in encoder_inputs]
+        embeddings = tf.split(self.encoder(concat_inputs(encoder_inputs), training=training), sizes)
         return [
-            self.recommend(inputs[0], training=training),
-            self.deck_build(inputs[1], training=training),
-            self.draft(inputs[2][0], inputs[2][1], training=training),
-            self.correlate(inputs[3], training=training)
+            self.decode('recommend', embeddings[0], training=training),
+            self.decode('deck_build', embeddings[1], training=training),
+            self.decode('draft', embeddings[2], packs=inputs[2][1], training=training),
+            self.decode('correlate', embeddings[3], training=training)
         ]
- 
+
+    # Runs the chosen heads on one shared embedding of inputs, or on embedding when the
+    # caller already has it from embed. Returns a dict from head name to output, draft
+    # also needs packs. heads must be a tuple, every distinct tuple is traced once.
+    def infer(self, inputs=None, heads=HEADS, packs=None, embedding=None, training=None):
+        # a tf.function only creates variables on its first trace, so a later tuple of
+        # heads cannot build a decoder the first one left out
+        self.build_components()
+        return self.infer_heads(inputs, heads=heads, packs=packs, embedding=embedding, training=training)
+
+    @tf.function
+    def infer_heads(self, inputs=None, heads=HEADS, packs=None, embedding=None, training=None):
+        if embedding is None:
+            embedding = self.encoder(inputs, training=training)
+        return {head: self.decode(head, embedding, packs=packs, training=training) for head in heads}
+
+    def build_components(self):
+        if not self.encoder.model.built:
+            self.encoder.model.build((None, self.num_cards))
+        for decoder in [self.cube_decoder, self.draft_decoder, self.deck_build_decoder, self.correlation_decoder]:
+            if not decoder.model.built:
+                decoder.model.build((None, 128))
+
+    @tf.function
+    def embed(self, inputs, training=None):
+        return self.encoder(inputs, training=training)
+
+    def decode(self, head, embedding, packs=None, training=None):
+        if head == 'recommend':
+            return self.cube_decoder(embedding, training=training)
+        if head == 'deck_build':
+            return self.deck_build_decoder(embedding, training=training)
+        if head == 'draft':
+            if packs is None:
+                raise ValueError('the draft head needs packs')
+            best_possible_picks = self.draft_decoder(embedding, training=training)
+            if is_sparse(packs):
+                packs = to_multi_hot(packs, self.num_cards)
+            packs = tf.cast(packs, best_possible_picks.dtype)
+            mask = 1e9 * (1-packs)
+            return tf.nn.softmax(best_possible_picks * packs - mask)
+        if head == 'correlate':
+            return self.correlation_decoder(embedding, training=training)
+        raise ValueError('unknown head {}, expected one of {}'.format(head, HEADS))
+
     @tf.function
     def recommend(self, cubes, training=None):
         embedding = self.encoder(cubes, training=training)
-        return self.cube_decoder(embedding, training=training)
+        return self.decode('recommend', embedding, training=training)
     
     @tf.function
     def deck_build(self, pools, training=None):
         embedding = self.encoder(pools, training=training)
-        return self.deck_build_decoder(embedding, training=training)
+        return self.decode('deck_build', embedding, training=training)
 
     @tf.function
     def draft(self, pools, packs, training=None):
         embedding = self.encoder(pools, training=training)
-        best_possible_picks = self.draft_decoder(embedding, training=training)
-        mask = 1e9 * (1-packs)
-        return tf.nn.softmax(best_possible_picks * packs - mask)
+        return self.decode('draft', embedding, packs=packs, training=training)
     
     @tf.function
     def correlate(self, inputs, training=None):
         embedding = self.encoder(inputs, training=training)
-        return self.correlation_decoder(embedding, training=training)
+        return self.decode('correlate', embedding, training=training)
     
+    # Candidate-restricted variants of draft and deck_build. packs and pools are card
+    # indices, only their cards are scored and the results are ragged in the same order.
+    # A pack must not repeat a card, the dense path would merge the copies.
+    @tf.function
+    def draft_candidates(self, pools, packs, training=None):
+        embedding = self.encoder(pools, training=training)
+        return ragged_softmax(self.draft_decoder.candidate_logits(embedding, packs, training=training))
+
+    @tf.function
+    def deck_build_candidates(self, pools, training=None):
+        embedding = self.encoder(pools, training=training)
+        logits = self.deck_build_decoder.candidate_logits(embedding, pools, training=training)
+        return tf.ragged.map_flat_values(tf.nn.sigmoid, logits)
+
+    # draft from the encoder's first layer pre-activation of the pools, see DraftSession.
+    # packs are multi-hot rows or card indices, card indices are scored as in draft_candidates
+    @tf.function
+    def draft_from_preactivation(self, preactivation, packs, training=None):
+        embedding = self.encoder.from_preactivation(preactivation)
+        if is_sparse(packs):
+            return ragged_softmax(self.draft_decoder.candidate_logits(embedding, packs, training=training))
+        return self.decode('draft', embedding, packs=packs, training=training)
+
+    # Serving variants that only return k card indices and scores per row instead of
+    # num_cards wide outputs. adds are the best cards not in the cube, removes the worst
+    # cards in it, lowest first, as demo/server/ml.js lists them.
+    @tf.function
+    def recommend_top_k(self, cubes, k=100, training=None):
+        scores = self.decode('recommend', self.encoder(cubes, training=training), training=training)
+        mask = to_mask(cubes, self.num_cards)
+
+        adds = masked_top_k(scores, 1 - mask, k)
+        removes = masked_top_k(-scores, mask, k)
+        return {
+            'add_indices': adds.indices,
+            'add_scores': adds.values,
+            'remove_indices': removes.indices,
+            'remove_scores': -removes.values,
+        }
+
+    # the pool ranked by the deck_build head, the first k are the mainboard and the next
+    # sideboard_k the sideboard, both best first
+    @tf.function
+    def deck_build_top_k(self, pools, k=24, sideboard_k=24, training=None):
+        scores = self.decode('deck_build', self.encoder(pools, training=training), training=training)
+        ranked = masked_top_k(scores, to_mask(pools, self.num_cards), k + sideboard_k)
+        return {
+            'mainboard_indices': ranked.indices[:, :k],
+            'mainboard_scores': ranked.values[:, :k],
+            'sideboard_indices': ranked.indices[:, k:],
+            'sideboard_scores': ranked.values[:, k:],
+        }
+
     def save_weights(self, filename):
         self.encoder.save_weights(os.path.join(filename, "encoder", 'model'))
         self.cube_decoder.save_weights(os.path.join(filename, "cube_decoder", 'model'))
@@ -111,9 +324,26 @@ class CubeCobraMLSystem(Model):
         self.correlation_decoder.save_weights(os.path.join(filename, "correlation_decoder", 'model'))
 
     def load_weights(self, filename):
+        self.weights_digest = None
         self.encoder.load_weights(os.path.join(filename, "encoder", 'model'))
         self.cube_decoder.load_weights(os.path.join(filename, "cube_decoder", 'model'))
         self.draft_decoder.load_weights(os.path.join(filename, "draft_decoder", "model"))
         self.deck_build_decoder.load_weights(os.path.join(filename, "deck_build_decoder", 'model'))
         self.correlation_decoder.load_weights(os.path.join(filename, "correlation_decoder", 'model'))
         
+
+    # hash of every weight, result_cache.py keys results by it. load_weights resets it,
+    # weights changed any other way (training) need reset_fingerprint
+    def weights_fingerprint(self):
+        if getattr(self, 'weights_digest', None) is None:
+            components = [self.encoder, self.cube_decoder, self.draft_decoder, self.deck_build_decoder, self.correlation_decoder]
+            self.build_components()
+            digest = hashlib.blake2b(digest_size=16)
+            for component in components:
+                for weight in component.model.get_weights():
+                    digest.update(weight.tobytes())
+            self.weights_digest = digest.hexdigest()
+        return self.weights_digest
+
+    def reset_fingerprint(self):
+        self.weights_digest = None
@@ -0,0 +1,180 @@
+from encoding import flatten, unique_rows
+import numpy as np
+import json
+
+# Inference for CubeCobraMLSystem with numpy alone. export_numpy.py writes the Dense
+# layers of the encoder and every decoder to one file: an 8 byte magic, the header
+# length, a JSON header with the offset, shape and dtype of each array, then the arrays
+# aligned to ALIGNMENT bytes. The file is memory-mapped read-only, so opening it only
+# parses the header and every process serving from it shares the same weight pages.
+# Kernels may be stored as float16, or as int8 with a float32 scale per output column
+# (see quantize.py), they are converted to float32 a block at a time as they are used.
+
+MAGIC = b'CCMLWTS1'
+ALIGNMENT = 64
+
+COMPONENTS = {
+    'encoder': 'encoder',
+    'recommend': 'cube_decoder',
+    'deck_build': 'deck_build_decoder',
+    'draft': 'draft_decoder',
+    'correlate': 'correlation_decoder',
+}
+
+
+def relu(x):
+    return np.maximum(x, 0)
+
+
+def sigmoid(x):
+    return 0.5 * (np.tanh(0.5 * x) + 1)
+
+
+def softmax(x):
+    exp = np.exp(x - x.max(axis=-1, keepdims=True))
+    return exp / exp.sum(axis=-1, keepdims=True)
+
+
+ACTIVATIONS = {'relu': relu, 'linear': lambda x: x, 'sigmoid': sigmoid, 'softmax': softmax}
+
+BLOCK = 4096
+
+
+def dequantize(kernel, scale=None):
+    kernel = kernel.astype(np.float32)
+    if scale is not None:
+        kernel *= scale
+    return kernel
+
+
+# x @ kernel for float32, float16 and int8 kernels. Quantized kernels are converted in
+# blocks of BLOCK rows or columns, whichever side is longer, so only one block is ever
+# held as float32. Per column scales commute with the product and are applied last
+def matmul(x, kernel, scale=None):
+    if kernel.dtype == np.float32:
+        return x @ kernel
+
+    if kernel.shape[0] >= kernel.shape[1]:
+        out = np.zeros((len(x), kernel.shape[1]), dtype=np.float32)
+        for start in range(0, kernel.shape[0], BLOCK):
+            out += x[:, start:start + BLOCK] @ kernel[start:start + BLOCK].astype(np.float32)
+    else:
+        out = np.empty((len(x), kernel.shape[1]), dtype=np.float32)
+        for start in range(0, kernel.shape[1], BLOCK):
+            out[:, start:start + BLOCK] = x @ kernel[:, start:start + BLOCK].astype(np.float32)
+
+    if scale is not None:
+        out *= scale
+    return out
+
+
+def align(size):
+    return -(-size // ALIGNMENT) * ALIGNMENT
+
+
+# components maps a component name to its layers, each a dict of kernel, bias and activation name
+def write_weights(filename, num_cards, components):
+    header = {'num_cards': num_cards, 'components': {}}
+    arrays = []
+    offset = 0
+    for name, layers in components.items():
+        header['components'][name] = []
+        for layer in layers:
+            entry = {'activation': layer['activation']}
+            for key in ['kernel', 'bias', 'scale']:
+                if layer.get(key) is None:
+                    continue
+                array = np.ascontiguousarray(layer[key])
+                entry[key] = {'offset': offset, 'shape': list(array.shape), 'dtype': array.dtype.str}
+                arrays.append((offset, array))
+                offset = align(offset + array.nbytes)
+            header['components'][name].append(entry)
+
+    header_bytes = json.dumps(header).encode('utf-8')
+    data_start = align(len(MAGIC) + 8 + len(header_bytes))
+
+    with open(filename, 'wb') as f:
+        f.write(MAGIC)
+        f.write(np.uint64(len(header_bytes)).tobytes())
+        f.write(header_bytes)
+        for array_offset, array in arrays:
+            f.seek(data_start + array_offset)
+            f.write(array.tobytes())
+        f.truncate(data_start + offset)
+
+
+class NumpyEngine:
+    def __init__(self, filename):
+        with open(filename, 'rb') as f:
+            if f.read(len(MAGIC)) != MAGIC:
+                raise ValueError('{} is not a weight file written by export_numpy.py'.format(filename))
+            header_length = int(np.frombuffer(f.read(8), dtype=np.uint64)[0])
+            header = json.loads(f.read(header_length))
+
+        self.filename = filename
+        self.num_cards = header['num_cards']
+        self.data = np.memmap(filename, dtype=np.uint8, mode='r', offset=align(len(MAGIC) + 8 + header_length))
+
+        self.components = {}
+        for name, layers in header['components'].items():
+            self.components[name] = [
+                (self.array(layer['kernel']), self.array(layer['bias']), layer['activation'], self.array(layer.get('scale')))
+                for layer in layers
+            ]
+
+    def array(self, spec):
+        if spec is None:
+            return None
+        return np.ndarray(spec['shape'], dtype=np.dtype(spec['dtype']), buffer=self.data, offset=spec['offset'])
+
+    def run(self, name, x, start=0):
+        for kernel, bias, activation, scale in self.components[name][start:]:
+            x = ACTIVATIONS[activation](matmul(x, kernel, scale) + bias)
+        return x
+
+    # inputs are multi-hot rows or lists of card indices per row. Card indices sum the
+    # kernel rows of their cards instead of multiplying a num_cards wide row
+    def encode(self, inputs):
+        if isinstance(inputs, np.ndarray) and inputs.ndim == 2:
+            return self.run('encoder', inputs.astype(np.float32, copy=False))
+
+        kernel, bias, activation, scale = self.components['encoder'][0]
+        flat, offsets = unique_rows(*flatten(inputs), self.num_cards)
+        preactivation = np.tile(bias.astype(np.float32), (len(offsets) - 1, 1))
+        nonempty = np.diff(offsets) > 0
+        if len(flat):
+            preactivation[nonempty] += np.add.reduceat(dequantize(kernel[flat], scale), offsets[:-1][nonempty], axis=0)
+        return self.run('encoder', ACTIVATIONS[activation](preactivation), start=1)
+
+    def decode(self, head, embedding):
+        return self.run(COMPONENTS[head], embedding)
+
+    def recommend(self, cubes):
+        return self.decode('recommend', self.encode(cubes))
+
+    def deck_build(self, pools):
+        return self.decode('deck_build', self.encode(pools))
+
+    def correlate(self, cards):
+        return self.decode('correlate', self.encode(cards))
+
+    # packs are multi-hot rows, or lists of card indices, then only those cards are
+    # scored and each row's probabilities are returned in the order of its pack
+    def draft(self, pools, packs):
+        embedding = self.encode(pools)
+        if isinstance(packs, np.ndarray) and packs.ndim == 2:
+            logits = self.decode('draft', embedding)
+            return softmax(logits * packs - 1e9 * (1 - packs))
+
+        layers = self.components['draft_decoder']
+        hidden = embedding
+        for kernel, bias, activation, scale in layers[:-1]:
+            hidden = ACTIVATIONS[activation](matmul(hidden, kernel, scale) + bias)
+        kernel, bias, _, scale = layers[-1]
+
+        probabilities = []
+        for row, pack in zip(hidden, packs):
+            pack = np.asarray(pack, dtype=np.int64)
+            columns = dequantize(kernel[:, pack], None if scale is None else scale[pack])
+            probabilities.append(softmax(row @ columns + bias[pack]))
+        return probabilities
@@ -0,0 +1,174 @@
+from augment import make_rng
+from dataset import COLLECTIONS
+import tensorflow as tf
+import numpy as np
+import time
+
+AUTOTUNE = tf.data.AUTOTUNE
+
+# tf.data version of the generator_disk / generator_binary batches. Shards are read by
+# parallel interleaved readers, records are shuffled and batched, encoding and noise run
+# in a parallel map and finished batches are prefetched, so batch construction overlaps
+# the train step instead of running in front of it. The generator supplies the data
+# (num_shards / read_shard), batch sizes, augmenter, correlations and seed.
+
+
+def slice_rows(indices, start, end):
+    flat, offsets = indices
+    return flat[offsets[start]:offsets[end]], offsets[start:end + 1] - offsets[start]
+
+
+def record_dataset(generator, collection, cycle_length, block_size, shuffle_buffer, seed):
+    columns = list(COLLECTIONS[collection])
+
+    # one shard, handed to tf.data in blocks of records to keep the python overhead per record low
+    def read(shard):
+        data = generator.read_shard(collection, int(shard))
+        num_records = len(data[columns[0]][1]) - 1
+        for start in range(0, num_records, block_size):
+            end = min(start + block_size, num_records)
+            yield tuple(part for name in columns for part in slice_rows(data[name], start, end))
+
+    signature = tuple(spec for _ in columns for spec in (tf.TensorSpec([None], tf.int32), tf.TensorSpec([None], tf.int64)))
+
+    def to_records(*parts):
+        return tuple(tf.RaggedTensor.from_row_splits(parts[2 * i], parts[2 * i + 1], validate=False) for i in range(len(columns)))
+
+    def read_shard(shard):
+        return tf.data.Dataset.from_generator(read, args=(shard,), output_signature=signature).map(to_records).unbatch()
+
+    num_shards = generator.num_shards(collection)
+    return (
+        tf.data.Dataset.range(num_shards)
+        .shuffle(num_shards, seed=seed)
+        .repeat()
+        .interleave(read_shard, cycle_length=min(cycle_length, num_shards), num_parallel_calls=AUTOTUNE, deterministic=False)
+        .shuffle(shuffle_buffer, seed=seed)
+    )
+
+
+# The batches are encoded with TensorFlow ops, which release the GIL, so the parallel
+# map really runs side by side. Only two steps stay in python, through tf.py_function,
+# and they hold the GIL: the cube corruption, which draws from the batch's numpy rng,
+# and the correlation rows, kept as a numpy CSR matrix. Both return card lists or
+# nonzero entries, the dense rows are built by scatters outside the GIL.
+
+# the card lists of parts merged row by row, as (flat, offsets) of sorted cards without
+# duplicates, union_rows and unique_rows of encoding.py with TensorFlow ops
+def tf_union_rows(parts, num_cards):
+    keys = tf.concat([tf.ragged.row_splits_to_segment_ids(offsets) * num_cards + tf.cast(flat, tf.int64) for flat, offsets in parts], 0)
+    keys = tf.sort(tf.unique(keys).y)
+    batch_size = tf.size(parts[0][1], out_type=tf.int64) - 1
+    offsets = tf.searchsorted(keys // num_cards, tf.range(batch_size + 1), out_type=tf.int64)
+    return tf.cast(keys % num_cards, tf.int32), offsets
+
+
+# multi_hot of the card lists of parts into the same rows, repeated cards stay 1
+def tf_multi_hot(parts, num_cards, batch_size, dtype=tf.float32):
+    positions = tf.concat([
+        tf.stack([tf.ragged.row_splits_to_segment_ids(offsets), tf.cast(flat, tf.int64)], axis=1)
+        for flat, offsets in parts
+    ], 0)
+    zeros = tf.zeros([batch_size, num_cards], dtype)
+    return tf.tensor_scatter_nd_max(zeros, positions, tf.ones(tf.shape(positions)[:1], dtype))
+
+
+# corrupted cube inputs and targets of the step's batch, from its own rng as in the generators
+def corrupt_cubes(generator, step, flat, offsets):
+    epoch, batch_number = divmod(int(step), len(generator))
+    x, y = generator.augmenter.corrupt(flat.numpy(), offsets.numpy(), generator.num_cards, make_rng(generator.seed, epoch, batch_number))
+    return [*x, *y]
+
+
+def correlation_entries(generator, cards):
+    row_ids, columns, values = generator.card_correlations.entries(cards.numpy())
+    return np.stack((row_ids, columns), axis=1).astype(np.int64), values.astype(np.float32)
+
+
+def encode_dataset(batches, generator, collection, batch_size):
+    num_cards = generator.num_cards
+    input_dtype = tf.as_dtype(generator.input_dtype)
+
+    # the model input of the union of the card lists in parts
+    def encode_input(*parts):
+        if generator.sparse_inputs:
+            return tf.RaggedTensor.from_row_splits(*tf_union_rows(parts, num_cards), validate=False)
+        return tf_multi_hot(parts, num_cards, batch_size, input_dtype)
+
+    def encode_target(*parts):
+        return tf_multi_hot(parts, num_cards, batch_size)
+
+    def structure(step, batch):
+        if collection == 'correlations':
+            positions, values = tf.py_function(lambda cards: correlation_entries(generator, cards), [batch], [tf.int64, tf.float32])
+            cards = (tf.cast(batch, tf.int32), tf.range(tf.size(batch, out_type=tf.int64) + 1))
+            return encode_input(cards), tf.scatter_nd(positions, values, [batch_size, num_cards])
+
+        columns = [(column.values, column.row_splits) for column in batch]
+        if collection == 'cubes':
+            parts = tf.py_function(lambda step, *parts: corrupt_cubes(generator, step, *parts), [step, *columns[0]], [tf.int32, tf.int64] * 2)
+            return encode_input(parts[:2]), encode_target(parts[2:])
+        if collection == 'decks':
+            mainboards, sideboards = columns
+            return encode_input(mainboards, sideboards), encode_target(mainboards)
+        pools, packs, pick = columns
+        return (encode_input(pools), encode_input(packs)), encode_target(pick)
+
+    return batches.enumerate().map(structure, num_parallel_calls=AUTOTUNE, deterministic=False)
+
+
+def make_dataset(generator, cycle_length=4, block_size=256, shuffle_buffer=10000):
+    seed = generator.seed % (2 ** 31)
+
+    collections = []
+    for collection, batch_size in [
+        ('cubes', generator.cube_batch_size),
+        ('decks', generator.deck_batch_size),
+        ('picks', generator.pick_batch_size),
+    ]:
+        records = record_dataset(generator, collection, cycle_length, block_size, shuffle_buffer, seed)
+        collections.append(encode_dataset(records.ragged_batch(batch_size, drop_remainder=True), generator, collection, batch_size))
+
+    corr = (
+        tf.data.Dataset.range(generator.num_cards)
+        .shuffle(generator.num_cards, seed=seed)
+        .repeat()
+        .batch(generator.corr_batch_size, drop_remainder=True)
+    )
+    collections.append(encode_dataset(corr, generator, 'correlations', generator.corr_batch_size))
+
+    return (
+        tf.data.Dataset.zip(tuple(collections))
+        .map(lambda cubes, decks, picks, corr: (
+            (cubes[0], decks[0], picks[0], corr[0]),
+            (cubes[1], decks[1], picks[1], corr[1]),
+        ))
+        .prefetch(AUTOTUNE)
+    )
+
+
+# one compiled train step on an (x, y) batch. train_on_batch would refuse the batches,
+# it wants the same number of rows in every input and the heads' batch sizes differ
+def make_train_step(model):
+    train_step = tf.function(model.train_step)
+    return lambda x, y: {name: float(value) for name, value in train_step((x, y)).items()}
+
+
+# runs steps train steps from an iterator of (x, y) batches and returns the mean time a
+# step spent waiting for its batch and the mean time of the whole step, in seconds
+def time_steps(model, batches, steps):
+    train_step = make_train_step(model)
+    x, y = next(batches)
+    train_step(x, y)
+
+    waits = []
+    totals = []
+    for _ in range(steps):
+        start = time.perf_counter()
+        x, y = next(batches)
+        ready = time.perf_counter()
+        train_step(x, y)
+        waits.append(ready - start)
+        totals.append(time.perf_counter() - start)
+
+    return np.mean(waits), np.mean(totals)
@@ -0,0 +1,182 @@
+from numpy_engine import NumpyEngine, write_weights
+from dataset import load_collection
+from encoding import union_rows, multi_hot
+from metrics import top_rated_percent, relative_pick
+import numpy as np
+import argparse
+import os
+import sys
+import time
+
+# Post-training quantization of a weight file written by export_numpy.py. The num_cards
+# wide layers, the encoder's first layer and the last layer of every decoder, hold
+# nearly all of the weights. They are stored as float16, or as int8 with a float32 scale
+# per output column, the column's largest absolute weight / 127. The small hidden layers
+# stay float32. The quantized weights are scored against the float ones with the
+# metrics of test.py on test data and only written when no metric drops by more than
+# --max-drop.
+
+MODES = ['int8', 'float16']
+
+
+def quantize_kernel(kernel, mode):
+    if mode == 'float16':
+        return kernel.astype(np.float16), None
+    scale = np.abs(kernel).max(axis=0) / 127
+    scale[scale == 0] = 1
+    return np.round(kernel / scale).astype(np.int8), scale.astype(np.float32)
+
+
+def quantize_components(engine, mode):
+    components = {}
+    for name, layers in engine.components.items():
+        components[name] = []
+        for kernel, bias, activation, scale in layers:
+            if scale is not None or kernel.dtype != np.float32:
+                raise ValueError('{} is already quantized'.format(engine.filename))
+            layer = {'kernel': kernel, 'bias': bias, 'activation': activation}
+            if engine.num_cards in kernel.shape:
+                layer['kernel'], layer['scale'] = quantize_kernel(kernel, mode)
+            components[name].append(layer)
+    return components
+
+
+def split(flat, offsets):
+    return np.split(flat, offsets[1:-1])
+
+
+# the first num_samples records of every test collection, as test.py scores them
+def load_test_data(data_dir, num_samples):
+    cubes = load_collection(os.path.join(data_dir, 'cubes'), 'cubes')
+    decks = load_collection(os.path.join(data_dir, 'decks'), 'decks')
+    picks = load_collection(os.path.join(data_dir, 'picks'), 'picks')
+    return {
+        'cubes': cubes['cards'].take(np.arange(min(num_samples, len(cubes)))),
+        'decks': [column.take(np.arange(min(num_samples, len(decks)))) for column in [decks['mainboard'], decks['sideboard']]],
+        'picks': [column.take(np.arange(min(num_samples, len(picks)))) for column in [picks['pool'], picks['pack'], picks['pick']]],
+    }
+
+
+def slice_rows(flat, offsets, start, stop):
+    return flat[offsets[start]:offsets[stop]], offsets[start:stop + 1] - offsets[start]
+
+
+def batched_mean(metric, num_rows, batch_size):
+    total = 0
+    for start in range(0, num_rows, batch_size):
+        stop = min(start + batch_size, num_rows)
+        total += metric(start, stop) * (stop - start)
+    return total / max(num_rows, 1)
+
+
+def evaluate(engine, data, batch_size):
+    num_cards = engine.num_cards
+
+    def cubes(start, stop):
+        rows = slice_rows(*data['cubes'], start, stop)
+        return top_rated_percent(multi_hot(*rows, num_cards), engine.recommend(split(*rows)))
+
+    def decks(start, stop):
+        mainboards = slice_rows(*data['decks'][0], start, stop)
+        sideboards = slice_rows(*data['decks'][1], start, stop)
+        pools = split(*union_rows(mainboards, sideboards, num_cards))
+        return top_rated_percent(multi_hot(*mainboards, num_cards), engine.deck_build(pools))
+
+    def draft(start, stop):
+        pools = split(*slice_rows(*data['picks'][0], start, stop))
+        packs = multi_hot(*slice_rows(*data['picks'][1], start, stop), num_cards)
+        picks = multi_hot(*slice_rows(*data['picks'][2], start, stop), num_cards)
+        return picks, engine.draft(pools, packs)
+
+    # top1 and top3 from one draft of the batch, batched_mean averages both at once
+    def picks(start, stop):
+        y_true, y_pred = draft(start, stop)
+        return np.array([relative_pick(y_true, y_pred, 1), relative_pick(y_true, y_pred, 3)])
+
+    num_cubes = len(data['cubes'][1]) - 1
+    num_decks = len(data['decks'][0][1]) - 1
+    num_picks = len(data['picks'][0][1]) - 1
+    top1, top3 = batched_mean(picks, num_picks, batch_size)
+    return {
+        'cubes': batched_mean(cubes, num_cubes, batch_size),
+        'decks': batched_mean(decks, num_decks, batch_size),
+        'picks top1': top1,
+        'picks top3': top3,
+    }
+
+
+def timed(fn, repeats):
+    start = time.perf_counter()
+    for _ in range(repeats):
+        fn()
+    return (time.perf_counter() - start) / repeats
+
+
+# opening parses the header, the first batch pages the weights in, then steady state
+def measure(filename, cubes, repeats):
+    start = time.perf_counter()
+    engine = NumpyEngine(filename)
+    open_time = time.perf_counter() - start
+    first_batch = timed(lambda: engine.recommend(cubes), 1)
+    return {
+        'size': os.path.getsize(filename),
+        'open': open_time,
+        'first batch': first_batch,
+        'batch': timed(lambda: engine.recommend(cubes), repeats),
+    }
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('weights', nargs='?', default='./model/weights.bin', help='float weight file written by export_numpy.py')
+    parser.add_argument('out_file', nargs='?', default=None, help='defaults to weights.<mode>.bin next to the float weights')
+    parser.add_argument('--mode', choices=MODES, default='int8')
+    parser.add_argument('--data-dir', default='../data/test/')
+    parser.add_argument('--samples', type=int, default=4096, help='test records of each collection to score')
+    parser.add_argument('--batch-size', type=int, default=256)
+    parser.add_argument('--max-drop', type=float, default=0.01, help='largest allowed drop of any metric')
+    parser.add_argument('--repeats', type=int, default=10)
+    params = parser.parse_args()
+
+    out_file = params.out_file or os.path.join(os.path.dirname(params.weights), 'weights.{}.bin'.format(params.mode))
+    pending_file = out_file + '.tmp'
+
+    engine = NumpyEngine(params.weights)
+    print('Quantizing {} to {}...\n'.format(params.weights, params.mode))
+    write_weights(pending_file, engine.num_cards, quantize_components(engine, params.mode))
+    quantized = NumpyEngine(pending_file)
+
+    print('Loading Data...\n')
+    data = load_test_data(params.data_dir, params.samples)
+
+    print('\nEvaluating...\n')
+    float_metrics = evaluate(engine, data, params.batch_size)
+    quantized_metrics = evaluate(quantized, data, params.batch_size)
+
+    print('{:<16}{:>12}{:>12}{:>12}'.format('metric', 'float32', params.mode, 'drop'))
+    failed = []
+    for name in float_metrics:
+        drop = float_metrics[name] - quantized_metrics[name]
+        print('{:<16}{:>12.4f}{:>12.4f}{:>12.4f}'.format(name, float_metrics[name], quantized_metrics[name], drop))
+        if drop > params.max_drop:
+            failed.append(name)
+
+    cubes = split(*slice_rows(*data['cubes'], 0, min(params.batch_size, len(data['cubes'][1]) - 1)))
+    float_cost = measure(params.weights, cubes, params.repeats)
+    quantized_cost = measure(pending_file, cubes, params.repeats)
+
+    print('\n{:<16}{:>12}{:>12}{:>12}'.format('', 'float32', params.mode, 'ratio'))
+    print('{:<16}{:>10.1f}MB{:>10.1f}MB{:>11.2f}x'.format(
+        'size', float_cost['size'] / 2**20, quantized_cost['size'] / 2**20, float_cost['size'] / quantized_cost['size']))
+    for name in ['open', 'first batch', 'batch']:
+        print('{:<16}{:>10.1f}ms{:>10.1f}ms{:>11.2f}x'.format(
+            name, float_cost[name] * 1000, quantized_cost[name] * 1000, float_cost[name] / quantized_cost[name]))
+    print('batch is recommend on {} cubes'.format(len(cubes)))
+
+    if failed:
+        os.remove(pending_file)
+        print('\n{} dropped by more than {}, not writing {}\n'.format(', '.join(failed), params.max_drop, out_file))
+        sys.exit(1)
+
+    os.replace(pending_file, out_file)
+    print('\nWrote {}\n'.format(out_file))
@@ -0,0 +1,256 @@
+from collections import OrderedDict
+import tensorflow as tf
+import numpy as np
+import hashlib
+import sqlite3
+import io
+import time
+
+# Cache of per-row inference results. A row's key hashes the head and its options, the
+# model's weights_fingerprint and the sorted distinct card indices of each input, so
+# the same cube in any order or with repeated cards is one entry. Entries live in an
+# LRU bounded by bytes, like ShardCache, and optionally in a SQLite file that survives
+# restarts. As soon as the model reports a new fingerprint the in-memory LRU is dropped
+# and the rows of other weights are deleted from the file.
+
+
+def canonical(cards):
+    return np.unique(np.asarray(cards, dtype=np.int64))
+
+
+def row_key(head, fingerprint, cards):
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update('{}|{}'.format(head, fingerprint).encode('utf-8'))
+    for part in cards:
+        digest.update(b'|')
+        digest.update(part.astype(np.int32).tobytes())
+    return digest.digest()
+
+
+def result_nbytes(result):
+    if isinstance(result, dict):
+        return sum(value.nbytes for value in result.values())
+    return result.nbytes
+
+
+# results as .npy bytes, or .npz for dicts of arrays, so loading never unpickles
+def encode(result):
+    buffer = io.BytesIO()
+    if isinstance(result, dict):
+        np.savez(buffer, **result)
+    else:
+        np.save(buffer, result, allow_pickle=False)
+    return buffer.getvalue()
+
+
+def decode(value):
+    loaded = np.load(io.BytesIO(value), allow_pickle=False)
+    if isinstance(loaded, np.lib.npyio.NpzFile):
+        with loaded:
+            return {name: loaded[name] for name in loaded.files}
+    return loaded
+
+
+# Results on disk, each row tagged with the fingerprint it was computed with. Rows of
+# other fingerprints are purged when the model changes and past max_bytes of values the
+# oldest written rows go first.
+class DiskStore:
+    def __init__(self, path, max_bytes=2**30):
+        self.max_bytes = max_bytes
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        columns = [row[1] for row in self.db.execute('PRAGMA table_info(results)')]
+        if columns and 'fingerprint' not in columns:
+            # pickled rows of the first version of this cache
+            self.db.execute('DROP TABLE results')
+        self.db.execute('CREATE TABLE IF NOT EXISTS results (key BLOB PRIMARY KEY, fingerprint TEXT, size INTEGER, value BLOB)')
+        self.db.commit()
+
+    def get(self, key):
+        row = self.db.execute('SELECT value FROM results WHERE key = ?', (key,)).fetchone()
+        return None if row is None else decode(row[0])
+
+    def put(self, items, fingerprint):
+        encoded = [(key, encode(value)) for key, value in items]
+        self.db.executemany('INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?)', [(key, fingerprint, len(value), value) for key, value in encoded])
+        # a replaced row gets a new rowid, so rowid order is write order
+        self.db.execute(
+            'DELETE FROM results WHERE rowid IN (SELECT rowid FROM '
+            '(SELECT rowid, SUM(size) OVER (ORDER BY rowid DESC) AS newer FROM results) WHERE newer > ?)',
+            (self.max_bytes,))
+        self.db.commit()
+
+    def purge(self, fingerprint):
+        self.db.execute('DELETE FROM results WHERE fingerprint != ?', (fingerprint,))
+        self.db.commit()
+
+    def nbytes(self):
+        return self.db.execute('SELECT COALESCE(SUM(size), 0) FROM results').fetchone()[0]
+
+    def close(self):
+        self.db.close()
+
+
+class ResultCache:
+    def __init__(self, max_bytes=256 * 2**20, path=None, max_disk_bytes=2**30):
+        self.max_bytes = max_bytes
+        self.store = DiskStore(path, max_disk_bytes) if path else None
+        self.results = OrderedDict()
+        self.fingerprint = None
+
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.bytes_resident = 0
+        # time spent computing missed rows, to estimate what the hits saved
+        self.compute_seconds = 0.0
+
+    def __len__(self):
+        return len(self.results)
+
+    def check_fingerprint(self, fingerprint):
+        if fingerprint != self.fingerprint:
+            self.clear()
+            self.fingerprint = fingerprint
+            if self.store is not None:
+                self.store.purge(fingerprint)
+
+    def get(self, key):
+        if key in self.results:
+            self.hits += 1
+            self.results.move_to_end(key)
+            return self.results[key]
+        if self.store is not None:
+            result = self.store.get(key)
+            if result is not None:
+                self.disk_hits += 1
+                self.remember(key, result)
+                return result
+        return None
+
+    def remember(self, key, result):
+        self.results[key] = result
+        self.bytes_resident += result_nbytes(result)
+        while self.bytes_resident > self.max_bytes and len(self.results) > 1:
+            _, evicted = self.results.popitem(last=False)
+            self.bytes_resident -= result_nbytes(evicted)
+            self.evictions += 1
+
+    # results of every row, compute(rows) runs the misses as one batch. A key missed by
+    # several rows of the batch is computed once, the repeats count as hits.
+    def lookup(self, keys, rows, compute):
+        results = []
+        missing = OrderedDict()
+        for i, key in enumerate(keys):
+            if key in missing:
+                self.hits += 1
+                results.append(None)
+                continue
+            results.append(self.get(key))
+            if results[i] is None:
+                missing[key] = i
+        self.misses += len(missing)
+        if not missing:
+            return results
+
+        start = time.perf_counter()
+        computed = dict(zip(missing, compute([rows[i] for i in missing.values()])))
+        self.compute_seconds += time.perf_counter() - start
+
+        for key, result in computed.items():
+            self.remember(key, result)
+        if self.store is not None:
+            self.store.put(computed.items(), self.fingerprint)
+        return [computed[key] if result is None else result for key, result in zip(keys, results)]
+
+    def stats(self):
+        requests = self.hits + self.disk_hits + self.misses
+        seconds_per_row = self.compute_seconds / self.misses if self.misses else 0.0
+        return {
+            'hits': self.hits,
+            'disk_hits': self.disk_hits,
+            'misses': self.misses,
+            'hit_rate': (self.hits + self.disk_hits) / requests if requests else 0.0,
+            'evictions': self.evictions,
+            'entries': len(self.results),
+            'bytes_resident': self.bytes_resident,
+            'max_bytes': self.max_bytes,
+            'disk_bytes': self.store.nbytes() if self.store is not None else 0,
+            'compute_seconds': self.compute_seconds,
+            'saved_seconds': (self.hits + self.disk_hits) * seconds_per_row,
+        }
+
+    def clear(self):
+        self.results.clear()
+        self.bytes_resident = 0
+
+
+# independent copies of the rows of a batch result, so a cached row does not keep the
+# whole batch alive
+def split_rows(batch):
+    if isinstance(batch, dict):
+        return [{name: value[i].copy() for name, value in batch.items()} for i in range(len(next(iter(batch.values()))))]
+    return [row.copy() for row in batch]
+
+
+def ragged(rows):
+    lengths = np.array([len(row) for row in rows], dtype=np.int64)
+    flat = np.concatenate(rows) if len(rows) else np.zeros(0, dtype=np.int64)
+    return tf.RaggedTensor.from_row_lengths(flat, lengths, validate=False)
+
+
+# CubeCobraMLSystem inference through a ResultCache. Inputs are lists of card index
+# lists, results are one numpy array, or dict of arrays, per row. Results over the
+# cards of an input are in the order of its sorted distinct cards.
+class CachedModel:
+    def __init__(self, model, cache=None):
+        self.model = model
+        self.cache = ResultCache() if cache is None else cache
+
+    @property
+    def num_cards(self):
+        return self.model.num_cards
+
+    def load_weights(self, filename):
+        self.model.load_weights(filename)
+
+    def rows(self, head, inputs, compute):
+        fingerprint = self.model.weights_fingerprint()
+        self.cache.check_fingerprint(fingerprint)
+        rows = [tuple(canonical(cards) for cards in row) for row in zip(*inputs)]
+        keys = [row_key(head, fingerprint, row) for row in rows]
+        return self.cache.lookup(keys, rows, lambda missing: compute(*[list(part) for part in zip(*missing)]))
+
+    def embed(self, cards):
+        return self.rows('embed', [cards], lambda cards: split_rows(self.model.embed(ragged(cards)).numpy()))
+
+    def recommend(self, cubes):
+        return self.rows('recommend', [cubes], lambda cubes: split_rows(self.model.recommend(ragged(cubes)).numpy()))
+
+    def deck_build(self, pools):
+        return self.rows('deck_build', [pools], lambda pools: split_rows(self.model.deck_build(ragged(pools)).numpy()))
+
+    def recommend_top_k(self, cubes, k=100):
+        def compute(cubes):
+            return split_rows({name: value.numpy() for name, value in self.model.recommend_top_k(ragged(cubes), k=k).items()})
+        return self.rows('recommend_top_k:{}'.format(k), [cubes], compute)
+
+    def deck_build_top_k(self, pools, k=24, sideboard_k=24):
+        def compute(pools):
+            return split_rows({name: value.numpy() for name, value in self.model.deck_build_top_k(ragged(pools), k=k, sideboard_k=sideboard_k).items()})
+        return self.rows('deck_build_top_k:{}:{}'.format(k, sideboard_k), [pools], compute)
+
+    # deck_build scores of only the pool's cards
+    def deck_build_candidates(self, pools):
+        return self.rows('deck_build_candidates', [pools], lambda pools: [np.asarray(row, dtype=np.float32) for row in self.model.deck_build_candidates(ragged(pools)).to_list()])
+
+    # pick probabilities of only the pack's cards
+    def draft(self, pools, packs):
+        return self.rows('draft', [pools, packs], lambda pools, packs: [np.asarray(row, dtype=np.float32) for row in self.model.draft_candidates(ragged(pools), ragged(packs)).to_list()])
+
+    # draft logits of every card, before the pack mask
+    def draft_logits(self, pools):
+        return self.rows('draft_logits', [pools], lambda pools: split_rows(self.model.draft_decoder(self.model.embed(ragged(pools))).numpy()))
+
+    def stats(self):
+        return self.cache.stats()
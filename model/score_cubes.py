@@ -0,0 +1,211 @@
+from model import CubeCobraMLSystem
+from shard_index import load_index, scan_shard
+from encoding import flatten, unique_rows
+import tensorflow as tf
+import multiprocessing
+import numpy as np
+import argparse
+import json
+import os
+import time
+
+# Precomputes the top k adds and removes of every cube. Cubes come from a directory of
+# JSON shards as process_data.js writes them, or from one JSON file holding a list of
+# cubes. The byte span of every cube is known up front (ShardIndex, or one scan of the
+# file), so the work is cut into chunks of cubes that are each read with one seek.
+# Results go to [num_cubes, k] .npy files opened as memmaps, each worker writes its
+# chunks' rows in place. Chunks finished are recorded in progress.json after their rows
+# are flushed, so an interrupted run picks up with the chunks that are left, as long as
+# meta.json matches: the same cubes, options, model_dir and weights fingerprint. Cubes
+# with fewer than k adds or removes are padded with index -1, at -inf add scores and inf
+# remove scores.
+
+OUTPUTS = {
+    'add_indices': np.int32,
+    'add_scores': np.float32,
+    'remove_indices': np.int32,
+    'remove_scores': np.float32,
+}
+# the fill of the columns past the last candidate
+PADDING = {
+    'add_indices': -1,
+    'add_scores': -np.inf,
+    'remove_indices': -1,
+    'remove_scores': np.inf,
+}
+META_FILE = 'meta.json'
+PROGRESS_FILE = 'progress.json'
+
+
+# (filename, first cube, byte start, byte end) of every chunk, cubes are numbered in file order
+def list_chunks(path, chunk_size):
+    if os.path.isdir(path):
+        index = load_index(path)
+        files = [(os.path.join(path, file), index.spans[index.shard_offsets[i]:index.shard_offsets[i + 1]]) for i, file in enumerate(index.files)]
+    else:
+        files = [(path, scan_shard(path))]
+
+    chunks = []
+    row = 0
+    for filename, spans in files:
+        for start in range(0, len(spans), chunk_size):
+            stop = min(start + chunk_size, len(spans))
+            chunks.append((filename, row, int(spans[start, 0]), int(spans[stop - 1, 1])))
+            row += stop - start
+    return chunks, row
+
+
+# the records between the two offsets are separated by commas, so they parse as a list
+def read_cubes(filename, start, end):
+    with open(filename, 'rb') as f:
+        f.seek(start)
+        return json.loads(b'[' + f.read(end - start) + b']')
+
+
+def create_outputs(out_dir, num_cubes, k):
+    for name, dtype in OUTPUTS.items():
+        np.lib.format.open_memmap(os.path.join(out_dir, name + '.npy'), mode='w+', dtype=dtype, shape=(num_cubes, k)).flush()
+
+
+def open_outputs(out_dir, mode='r+'):
+    return {name: np.lib.format.open_memmap(os.path.join(out_dir, name + '.npy'), mode=mode) for name in OUTPUTS}
+
+
+def write_json(filename, value):
+    with open(filename + '.tmp', 'w') as f:
+        json.dump(value, f)
+    os.replace(filename + '.tmp', filename)
+
+
+class CubeScorer:
+    def __init__(self, model, outputs, k, batch_size):
+        self.model = model
+        self.outputs = outputs
+        self.k = k
+        self.batch_size = batch_size
+
+    def score(self, cubes, row):
+        flat, offsets = unique_rows(*flatten(cubes), self.model.num_cards)
+        for start in range(0, len(cubes), self.batch_size):
+            stop = min(start + self.batch_size, len(cubes))
+            batch = tf.RaggedTensor.from_row_splits(flat[offsets[start]:offsets[stop]], offsets[start:stop + 1] - offsets[start], validate=False)
+            results = {name: value.numpy() for name, value in self.model.recommend_top_k(batch, k=self.k).items()}
+
+            # top k pads rows short of candidates with infinite scores but real card indices
+            for kind in ['add', 'remove']:
+                results[kind + '_indices'][~np.isfinite(results[kind + '_scores'])] = -1
+            for name, value in results.items():
+                self.outputs[name][row + start:row + stop, :value.shape[1]] = value
+                # k above the number of cards
+                self.outputs[name][row + start:row + stop, value.shape[1]:] = PADDING[name]
+
+        for output in self.outputs.values():
+            output.flush()
+
+
+# one scorer per process, set up by init_worker
+scorer = None
+
+
+def load_model(model_dir, num_cards):
+    model = CubeCobraMLSystem(num_cards)
+    model.load_weights(model_dir)
+    return model
+
+
+# workers load the weights again, fingerprint makes sure they are the ones run checked
+def init_worker(params, num_cards, fingerprint, model=None):
+    global scorer
+    if model is None:
+        model = load_model(params['model_dir'], num_cards)
+        if model.weights_fingerprint() != fingerprint:
+            raise ValueError('the weights in {} changed while scoring'.format(params['model_dir']))
+    outputs = open_outputs(params['out_dir'])
+    scorer = CubeScorer(model, outputs, params['k'], params['batch_size'])
+
+
+def score_chunk(chunk):
+    number, (filename, row, start, end) = chunk
+    cubes = read_cubes(filename, start, end)
+    scorer.score(cubes, row)
+    return number, len(cubes)
+
+
+def run(params):
+    with open(params['freq_path']) as f:
+        num_cards = len(json.load(f))
+
+    # the results of other weights cannot be mixed in, so the model is part of meta
+    model = load_model(params['model_dir'], num_cards)
+    fingerprint = model.weights_fingerprint()
+
+    chunks, num_cubes = list_chunks(params['cubes'], params['chunk_size'])
+    meta = {
+        'num_cubes': num_cubes,
+        'k': params['k'],
+        'chunk_size': params['chunk_size'],
+        'num_chunks': len(chunks),
+        'model_dir': os.path.abspath(params['model_dir']),
+        'weights_fingerprint': fingerprint,
+        'padding': 'add_indices and remove_indices are -1 where add_scores are -inf and remove_scores are inf',
+    }
+
+    os.makedirs(params['out_dir'], exist_ok=True)
+    meta_file = os.path.join(params['out_dir'], META_FILE)
+    progress_file = os.path.join(params['out_dir'], PROGRESS_FILE)
+
+    done = set()
+    if not params['restart'] and os.path.exists(meta_file):
+        with open(meta_file) as f:
+            if json.load(f) != meta:
+                raise ValueError('{} was written for other cubes, weights or options, pass --restart to start over'.format(params['out_dir']))
+        with open(progress_file) as f:
+            done = set(json.load(f)['done'])
+    else:
+        create_outputs(params['out_dir'], num_cubes, params['k'])
+        write_json(progress_file, {'done': []})
+        write_json(meta_file, meta)
+
+    pending = [(number, chunk) for number, chunk in enumerate(chunks) if number not in done]
+    print('{} cubes in {} chunks, {} left to score\n'.format(num_cubes, len(chunks), len(pending)))
+
+    if params['workers'] > 1:
+        # TensorFlow does not survive fork, every worker starts a fresh interpreter
+        pool = multiprocessing.get_context('spawn').Pool(params['workers'], init_worker, (params, num_cards, fingerprint))
+        results = pool.imap_unordered(score_chunk, pending)
+    else:
+        pool = None
+        init_worker(params, num_cards, fingerprint, model)
+        results = map(score_chunk, pending)
+
+    scored = 0
+    start = time.perf_counter()
+    try:
+        for number, count in results:
+            done.add(number)
+            write_json(progress_file, {'done': sorted(done)})
+            scored += count
+            elapsed = time.perf_counter() - start
+            print('Scored {} of {} chunks, {} cubes, {:.0f} cubes/s'.format(len(done), len(chunks), scored, scored / elapsed))
+    finally:
+        if pool is not None:
+            pool.terminate()
+
+    return num_cubes
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('cubes', help='directory of cube shards, or a JSON file with a list of cubes')
+    parser.add_argument('out_dir')
+    parser.add_argument('--k', type=int, default=100, help='adds and removes kept per cube')
+    parser.add_argument('--batch-size', type=int, default=1024)
+    parser.add_argument('--chunk-size', type=int, default=10000, help='cubes per checkpointed chunk')
+    parser.add_argument('--workers', type=int, default=1)
+    parser.add_argument('--restart', action='store_true', help='ignore the progress of an earlier run')
+    parser.add_argument('--model-dir', default='./model/')
+    parser.add_argument('--freq-path', default='../data/train/oracleFrequency.json')
+    params = parser.parse_args()
+
+    run(vars(params))
+    print('\nWrote {}\n'.format(', '.join(name + '.npy' for name in OUTPUTS)))
@@ -0,0 +1,303 @@
+from model import CubeCobraMLSystem
+from result_cache import CachedModel, ResultCache, canonical
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import argparse
+import asyncio
+import bisect
+import json
+import time
+
+# HTTP inference service for CubeCobraMLSystem with the endpoints of demo/server/ml.js,
+# taking and returning oracle ids. Requests to an endpoint wait in a queue, a batcher
+# takes up to max_batch_size of them, waiting at most max_wait after the first one,
+# and runs them as one model call on a worker thread so the event loop keeps accepting
+# requests. GET /metrics returns a latency histogram and the batch sizes of every
+# endpoint and the hit rate of the result cache. HTTP is served with the standard
+# library alone:
+#
+#   POST /api/recommend  {"cards": [...]}                 -> {"adds": [...], "removes": [...]}
+#   POST /api/deckbuild  {"cards": [...]}                 -> {"mainboard": [...], "sideboard": [...]}
+#   POST /api/draft      {"pack": [...], "pool": [...]}   -> {"picks": [...]}
+#   POST /api/rotodraft  {"pool": [...], "picks": 250}    -> {"picks": [...]}
+#   POST /api/embed      {"cards": [...]}                 -> {"embedding": [...]}
+#
+# cards in results are {"oracle": id, "rating": score} ordered as ml.js orders them.
+
+LATENCY_BUCKETS_MS = [0.5, 1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000]
+
+
+class Histogram:
+    def __init__(self, bounds):
+        self.bounds = bounds
+        # the last count is everything above the last bound
+        self.counts = [0] * (len(bounds) + 1)
+        self.total = 0
+
+    def add(self, value):
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.total += 1
+
+    # upper bound of the bucket holding the q quantile
+    def quantile(self, q):
+        seen = 0
+        for bound, count in zip(self.bounds + [float('inf')], self.counts):
+            seen += count
+            if seen >= q * self.total and count:
+                return bound
+        return 0
+
+    def summary(self):
+        return {
+            'count': self.total,
+            'buckets': self.bounds,
+            'counts': self.counts,
+            'p50': self.quantile(0.5),
+            'p90': self.quantile(0.9),
+            'p99': self.quantile(0.99),
+        }
+
+
+class MicroBatcher:
+    def __init__(self, run_batch, executor, max_batch_size=64, max_wait=0.005):
+        self.run_batch = run_batch
+        self.executor = executor
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self.queue = asyncio.Queue()
+
+        self.latency = Histogram(LATENCY_BUCKETS_MS)
+        self.batch_sizes = {}
+
+    async def submit(self, request):
+        start = time.perf_counter()
+        future = asyncio.get_running_loop().create_future()
+        await self.queue.put((request, future))
+        try:
+            return await future
+        finally:
+            self.latency.add((time.perf_counter() - start) * 1000)
+
+    async def take_batch(self):
+        batch = [await self.queue.get()]
+        deadline = asyncio.get_running_loop().time() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            timeout = deadline - asyncio.get_running_loop().time()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self.queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = await self.take_batch()
+            self.batch_sizes[len(batch)] = self.batch_sizes.get(len(batch), 0) + 1
+            try:
+                results = await loop.run_in_executor(self.executor, self.run_batch, [request for request, _ in batch])
+                for (_, future), result in zip(batch, results):
+                    future.set_result(result)
+            except Exception as error:
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(error)
+
+    def summary(self):
+        return {'latency_ms': self.latency.summary(), 'batch_sizes': dict(sorted(self.batch_sizes.items()))}
+
+
+def rated(oracles, indices, ratings):
+    return [{'oracle': oracles[index], 'rating': float(rating)} for index, rating in zip(indices, ratings)]
+
+
+# batched versions of the ml.js functions, each takes the request bodies of a batch and
+# returns their responses. model is a CachedModel, so repeated card sets skip the model
+class Predictor:
+    def __init__(self, model, oracles, k=100, deck_size=24):
+        self.model = model
+        self.oracles = oracles
+        self.oracle_to_index = {oracle: index for index, oracle in enumerate(oracles)}
+        self.k = k
+        self.deck_size = deck_size
+
+    # sorted distinct card indices, the order CachedModel returns per card results in.
+    # unknown oracles are skipped like index.js does
+    def indices(self, lists):
+        return [canonical([self.oracle_to_index[oracle] for oracle in row if oracle in self.oracle_to_index]) for row in lists]
+
+    def recommend(self, requests):
+        responses = []
+        for result in self.model.recommend_top_k(self.indices([r['cards'] for r in requests]), k=self.k):
+            # cubes of fewer than k cards have removes padded with infinite scores
+            removes = np.isfinite(result['remove_scores'])
+            responses.append({
+                'adds': rated(self.oracles, result['add_indices'], result['add_scores']),
+                'removes': rated(self.oracles, result['remove_indices'][removes], result['remove_scores'][removes]),
+            })
+        return responses
+
+    # the pool best first, the first deck_size cards are the mainboard and the rest,
+    # worst first, the sideboard
+    def deck_build(self, requests):
+        pools = self.indices([r['cards'] for r in requests])
+        responses = []
+        for cards, ratings in zip(pools, self.model.deck_build_candidates(pools)):
+            order = np.argsort(-ratings, kind='stable')
+            ranked = rated(self.oracles, cards[order], ratings[order])
+            responses.append({'mainboard': ranked[:self.deck_size], 'sideboard': ranked[self.deck_size:][::-1]})
+        return responses
+
+    def draft(self, requests):
+        packs = self.indices([r['pack'] for r in requests])
+        responses = []
+        for cards, ratings in zip(packs, self.model.draft(self.indices([r['pool'] for r in requests]), packs)):
+            order = np.argsort(-ratings, kind='stable')
+            responses.append({'picks': rated(self.oracles, cards[order], ratings[order])})
+        return responses
+
+    # the best draft logits among the cards not in the pool
+    def rotodraft(self, requests):
+        pools = self.indices([r['pool'] for r in requests])
+        responses = []
+        for logits, pool, request in zip(self.model.draft_logits(pools), pools, requests):
+            row = logits.copy()
+            row[pool] = -np.inf
+            picks = min(request.get('picks', 250), len(row) - len(pool))
+            top = np.argpartition(-row, picks - 1)[:picks] if picks > 0 else np.zeros(0, dtype=np.int64)
+            top = top[np.argsort(-row[top], kind='stable')]
+            responses.append({'picks': rated(self.oracles, top, row[top])})
+        return responses
+
+    def embed(self, requests):
+        return [{'embedding': embedding.tolist()} for embedding in self.model.embed(self.indices([r['cards'] for r in requests]))]
+
+
+# request fields that must be lists of oracle ids, checked before a request joins a
+# batch so one malformed request cannot fail the others
+FIELDS = {
+    '/api/recommend': ['cards'],
+    '/api/deckbuild': ['cards'],
+    '/api/draft': ['pack', 'pool'],
+    '/api/rotodraft': ['pool'],
+    '/api/embed': ['cards'],
+}
+
+STATUS = {200: 'OK', 400: 'Bad Request', 404: 'Not Found', 500: 'Internal Server Error'}
+
+
+class Server:
+    def __init__(self, predictor, max_batch_size=64, max_wait=0.005):
+        self.predictor = predictor
+        # one thread runs every model call, batches of different endpoints take turns
+        self.executor = ThreadPoolExecutor(1)
+        self.batchers = {
+            '/api/' + name: MicroBatcher(fn, self.executor, max_batch_size, max_wait)
+            for name, fn in [
+                ('recommend', predictor.recommend),
+                ('deckbuild', predictor.deck_build),
+                ('draft', predictor.draft),
+                ('rotodraft', predictor.rotodraft),
+                ('embed', predictor.embed),
+            ]
+        }
+
+    # the cache and its SQLite connection belong to the executor thread, so its stats are
+    # read there, the batchers' counters belong to the event loop
+    async def metrics(self):
+        cache = await asyncio.get_running_loop().run_in_executor(self.executor, self.predictor.model.stats)
+        return {**{path: batcher.summary() for path, batcher in self.batchers.items()}, 'cache': cache}
+
+    async def respond(self, method, path, body):
+        if method == 'GET' and path == '/metrics':
+            return 200, await self.metrics()
+        if method != 'POST' or path not in self.batchers:
+            return 404, {'error': '{} {} not found'.format(method, path)}
+        try:
+            request = json.loads(body)
+        except ValueError as error:
+            return 400, {'error': str(error)}
+        for field in FIELDS[path]:
+            if not isinstance(request, dict) or not isinstance(request.get(field), list) or not all(isinstance(oracle, str) for oracle in request[field]):
+                return 400, {'error': '{} needs a list of oracle ids as {}'.format(path, field)}
+        # bool is a subclass of int, true is not a count
+        picks = request.get('picks', 0)
+        if not isinstance(picks, int) or isinstance(picks, bool) or picks < 0:
+            return 400, {'error': 'picks must be a non-negative integer'}
+        try:
+            return 200, await self.batchers[path].submit(request)
+        except Exception as error:
+            return 500, {'error': repr(error)}
+
+    # HTTP/1.1 with keep-alive, bodies need a Content-Length
+    async def handle(self, reader, writer):
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line.strip():
+                    break
+                method, path, _ = request_line.decode('latin-1').split(' ', 2)
+
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b'\r\n', b'\n', b''):
+                        break
+                    name, _, value = line.decode('latin-1').partition(':')
+                    headers[name.strip().lower()] = value.strip()
+                body = await reader.readexactly(int(headers.get('content-length', 0)))
+
+                status, response = await self.respond(method, path, body)
+                payload = json.dumps(response).encode('utf-8')
+                writer.write('HTTP/1.1 {} {}\r\nContent-Type: application/json\r\nContent-Length: {}\r\n\r\n'.format(
+                    status, STATUS[status], len(payload)).encode('latin-1') + payload)
+                await writer.drain()
+
+                if headers.get('connection', '').lower() == 'close':
+                    break
+        except (asyncio.IncompleteReadError, ConnectionError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+    async def serve(self, host, port):
+        tasks = [asyncio.ensure_future(batcher.run()) for batcher in self.batchers.values()]
+        server = await asyncio.start_server(self.handle, host, port)
+        print('Serving on http://{}:{}\n'.format(host, port))
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            for task in tasks:
+                task.cancel()
+
+
+def load_oracles(path):
+    with open(path) as f:
+        index_to_oracle = json.load(f)
+    return [index_to_oracle[str(i)] for i in range(len(index_to_oracle))]
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--model-dir', default='./model/')
+    parser.add_argument('--oracle-map', default='../demo/server/indexToOracleMap.json')
+    parser.add_argument('--max-batch-size', type=int, default=64)
+    parser.add_argument('--max-wait-ms', type=float, default=5, help='longest a request waits for others to batch with')
+    parser.add_argument('--k', type=int, default=100, help='adds and removes returned by recommend')
+    parser.add_argument('--cache-mb', type=float, default=256, help='memory for cached results')
+    parser.add_argument('--cache-path', default=None, help='also keep cached results in this SQLite file across restarts')
+    parser.add_argument('--cache-disk-mb', type=float, default=1024, help='largest size of the cached results in --cache-path')
+    params = parser.parse_args()
+
+    oracles = load_oracles(params.oracle_map)
+    model = CubeCobraMLSystem(len(oracles))
+    model.load_weights(params.model_dir)
+
+    cache = ResultCache(int(params.cache_mb * 2**20), params.cache_path, int(params.cache_disk_mb * 2**20))
+    server = Server(Predictor(CachedModel(model, cache), oracles, k=params.k), params.max_batch_size, params.max_wait_ms / 1000)
+    asyncio.run(server.serve(params.host, params.port))
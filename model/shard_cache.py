@@ -0,0 +1,60 @@
+from collections import OrderedDict
+from dataset import decode_shard
+
+# LRU cache of decoded shards, bounded by the bytes of the decoded arrays rather than
+# the number of shards. One cache is shared by cubes, decks and picks so the budget
+# covers everything a generator keeps resident.
+class ShardCache:
+    def __init__(self, max_bytes, load=decode_shard):
+        self.max_bytes = max_bytes
+        self.load = load
+        self.shards = OrderedDict()
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.bytes_resident = 0
+        self.bytes_loaded = 0
+
+    def __len__(self):
+        return len(self.shards)
+
+    def __contains__(self, path):
+        return path in self.shards
+
+    def get(self, path, collection):
+        if path in self.shards:
+            self.hits += 1
+            self.shards.move_to_end(path)
+            return self.shards[path]
+
+        self.misses += 1
+        shard = self.load(path, collection)
+        self.shards[path] = shard
+        self.bytes_resident += shard.nbytes
+        self.bytes_loaded += shard.nbytes
+
+        # always keep the shard we just loaded, even if it alone is over budget
+        while self.bytes_resident > self.max_bytes and len(self.shards) > 1:
+            _, evicted = self.shards.popitem(last=False)
+            self.bytes_resident -= evicted.nbytes
+            self.evictions += 1
+
+        return shard
+
+    def stats(self):
+        requests = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / requests if requests else 0.0,
+            'evictions': self.evictions,
+            'shards_resident': len(self.shards),
+            'bytes_resident': self.bytes_resident,
+            'bytes_loaded': self.bytes_loaded,
+            'max_bytes': self.max_bytes,
+        }
+
+    def clear(self):
+        self.shards.clear()
+        self.bytes_resident = 0
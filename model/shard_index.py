@@ -0,0 +1,153 @@
+from dataset import iter_json_spans, list_shards, pack_records
+import numpy as np
+import json
+import os
+import sys
+
+# Persistent index over a directory of JSON shards, saved next to it as
+# <dir>.index.npz. For every shard it keeps the file size and mtime it was built
+# from and the byte span of each record, so the exact number of records is known
+# without parsing anything and any record can be read with one seek. Reloading
+# only rescans shards that were added or changed since the index was written.
+
+def index_filename(path):
+    return os.path.normpath(path) + '.index.npz'
+
+
+def scan_shard(filename):
+    spans = np.array([(start, end) for _, start, end in iter_json_spans(filename)], dtype=np.int64)
+    return spans.reshape(-1, 2)
+
+
+class ShardIndex:
+    def __init__(self, path, files, sizes, mtimes, shard_offsets, spans):
+        self.path = path
+        self.files = files
+        self.sizes = sizes
+        self.mtimes = mtimes
+        # records of shard i are shard_offsets[i]:shard_offsets[i + 1]
+        self.shard_offsets = shard_offsets
+        self.spans = spans
+
+    def __len__(self):
+        return int(self.shard_offsets[-1])
+
+    @property
+    def num_shards(self):
+        return len(self.files)
+
+    def shard_records(self, shard):
+        return int(self.shard_offsets[shard + 1] - self.shard_offsets[shard])
+
+    def locate(self, row):
+        shard = int(np.searchsorted(self.shard_offsets, row, side='right')) - 1
+        start, end = self.spans[row]
+        return os.path.join(self.path, self.files[shard]), int(start), int(end)
+
+    def read_record(self, row):
+        filename, start, end = self.locate(row)
+        with open(filename, 'rb') as f:
+            f.seek(start)
+            return json.loads(f.read(end - start))
+
+    # reads rows in file order, opening each shard once, and returns them in the order asked for
+    def read_records(self, rows):
+        rows = np.asarray(rows, dtype=np.int64)
+        shards = np.searchsorted(self.shard_offsets, rows, side='right') - 1
+        records = [None] * len(rows)
+
+        f = None
+        current = -1
+        try:
+            for i in np.lexsort((self.spans[rows, 0], shards)):
+                if shards[i] != current:
+                    if f is not None:
+                        f.close()
+                    current = shards[i]
+                    f = open(os.path.join(self.path, self.files[current]), 'rb')
+                start, end = self.spans[rows[i]]
+                f.seek(start)
+                records[i] = json.loads(f.read(end - start))
+        finally:
+            if f is not None:
+                f.close()
+
+        return records
+
+    # the rows of a batch in the (flat, offsets) layout of CSRColumn.take
+    def take(self, rows, collection):
+        columns = pack_records(collection, self.read_records(rows))
+        return {name: column.take(np.arange(len(rows))) for name, column in columns.items()}
+
+    def save(self):
+        np.savez(
+            index_filename(self.path),
+            files=np.array(self.files, dtype=str),
+            sizes=self.sizes,
+            mtimes=self.mtimes,
+            shard_offsets=self.shard_offsets,
+            spans=self.spans,
+        )
+
+
+def read_index(path):
+    filename = index_filename(path)
+    if not os.path.exists(filename):
+        return None
+    with np.load(filename) as index:
+        return ShardIndex(path, list(index['files']), index['sizes'], index['mtimes'], index['shard_offsets'], index['spans'])
+
+
+# loads the index of path, rescanning the shards that changed and saving it if anything did
+def load_index(path):
+    old = read_index(path)
+    reusable = {}
+    if old is not None:
+        for shard, file in enumerate(old.files):
+            start, end = old.shard_offsets[shard], old.shard_offsets[shard + 1]
+            reusable[(file, old.sizes[shard], old.mtimes[shard])] = old.spans[start:end]
+
+    files = list_shards(path)
+    sizes = np.zeros(len(files), dtype=np.int64)
+    mtimes = np.zeros(len(files), dtype=np.int64)
+    spans = []
+    scanned = 0
+
+    for i, file in enumerate(files):
+        stat = os.stat(os.path.join(path, file))
+        sizes[i], mtimes[i] = stat.st_size, stat.st_mtime_ns
+
+        shard_spans = reusable.get((file, sizes[i], mtimes[i]))
+        if shard_spans is None:
+            print("Indexing {} of {} from {}: {}".format(i + 1, len(files), path, file))
+            shard_spans = scan_shard(os.path.join(path, file))
+            scanned += 1
+        spans.append(shard_spans)
+
+    shard_offsets = np.zeros(len(files) + 1, dtype=np.int64)
+    np.cumsum([len(shard_spans) for shard_spans in spans], out=shard_offsets[1:])
+    spans = np.concatenate(spans) if spans else np.zeros((0, 2), dtype=np.int64)
+
+    index = ShardIndex(path, files, sizes, mtimes, shard_offsets, spans)
+    if scanned or old is None or old.files != files:
+        index.save()
+        print("Indexed {} records in {} shards of {}, rescanned {}".format(len(index), len(files), path, scanned))
+    return index
+
+
+# usage: python shard_index.py [data_dir]
+# indexes every collection and writes the same metadata.json as create_metadata.js
+if __name__ == '__main__':
+    data_dir = sys.argv[1] if len(sys.argv) > 1 else '../data/train/'
+
+    metadata = {}
+    oracle_path = os.path.join(data_dir, 'oracleDict.json')
+    if os.path.exists(oracle_path):
+        with open(oracle_path) as f:
+            metadata['numOracles'] = len(json.load(f))
+    for collection, key in [('cubes', 'numCubes'), ('decks', 'numDecks'), ('picks', 'numPicks')]:
+        metadata[key] = len(load_index(os.path.join(data_dir, collection)))
+
+    with open(os.path.join(data_dir, 'metadata.json'), 'w') as f:
+        json.dump(metadata, f)
+    print('Wrote {}'.format(metadata))
@@ -0,0 +1,133 @@
+from model import CubeCobraMLSystem
+from draft_session import DraftSession
+import tensorflow as tf
+import numpy as np
+import argparse
+import json
+import os
+import time
+
+# Runs many bot drafts at once. Every seat of every draft is one DraftSession row, so
+# each pick step is one batched model call for all of them, dealing, removing picked
+# cards and passing packs are numpy operations on a [drafts, seats, pack_size] array
+# of card indices, -1 where a card was already taken. Packs pass left, right, left...
+
+
+# deals every draft its own packs, seats * packs * pack_size distinct cards of the cube
+def deal(cube, num_drafts, seats, packs, pack_size, rng):
+    cube = np.asarray(cube, dtype=np.int64)
+    needed = seats * packs * pack_size
+    if needed > len(cube):
+        raise ValueError('{} seats of {} packs of {} cards need {} cards, the cube has {}'.format(seats, packs, pack_size, needed, len(cube)))
+    order = np.argsort(rng.random((num_drafts, len(cube))), axis=1)[:, :needed]
+    return cube[order].reshape(num_drafts, packs, seats, pack_size)
+
+
+def to_ragged(packs):
+    present = packs >= 0
+    return tf.RaggedTensor.from_row_lengths(packs[present], present.sum(axis=1))
+
+
+# pick records in the format of process_data.js, {pool, pick, pack} with the pool before
+# the pick and the pack including the picked card, packs of a single card are skipped
+def pick_records(pools, packs, picks):
+    records = []
+    for pool, pack, pick in zip(pools, packs, picks):
+        pack = pack[pack >= 0]
+        if len(pack) > 1 and pick >= 0:
+            records.append({'pool': pool.tolist(), 'pick': int(pick), 'pack': pack.tolist()})
+    return records
+
+
+def simulate(model, cube, num_drafts, seats=8, packs=3, pack_size=15, rng=None, greedy=False, emit=None):
+    rng = np.random.default_rng() if rng is None else rng
+    dealt = deal(cube, num_drafts, seats, packs, pack_size, rng)
+    session = DraftSession(model, num_drafts * seats)
+
+    for pack_number in range(packs):
+        current = dealt[:, pack_number].copy()
+        direction = 1 if pack_number % 2 == 0 else -1
+
+        for _ in range(pack_size):
+            flat = current.reshape(num_drafts * seats, pack_size)
+            pools = session.pools() if emit is not None else None
+
+            picks = session.pick(to_ragged(flat), rng=None if greedy else rng)
+            if emit is not None:
+                emit(pick_records(pools, flat, picks))
+
+            # take the picked card out of its pack, then pass every pack one seat on
+            taken = flat == picks[:, None]
+            has_pick = taken.any(axis=1)
+            flat[np.flatnonzero(has_pick), taken.argmax(axis=1)[has_pick]] = -1
+            current = np.roll(current, direction, axis=1)
+
+    return session.pools()
+
+
+# writes records as JSON shards of shard_size records named like process_data.js does
+class ShardWriter:
+    def __init__(self, path, shard_size=10000):
+        os.makedirs(path, exist_ok=True)
+        self.path = path
+        self.shard_size = shard_size
+        self.shards = 0
+        self.pending = []
+        self.num_records = 0
+
+    def __call__(self, records):
+        self.pending += records
+        self.num_records += len(records)
+        while len(self.pending) >= self.shard_size:
+            self.write(self.pending[:self.shard_size])
+            self.pending = self.pending[self.shard_size:]
+
+    def write(self, records):
+        with open(os.path.join(self.path, '{:04d}.json'.format(self.shards)), 'w') as f:
+            json.dump(records, f)
+        self.shards += 1
+
+    def close(self):
+        if self.pending:
+            self.write(self.pending)
+            self.pending = []
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('cube', help='JSON list of the card indices of the cube')
+    parser.add_argument('num_drafts', type=int)
+    parser.add_argument('--seats', type=int, default=8)
+    parser.add_argument('--packs', type=int, default=3)
+    parser.add_argument('--pack-size', type=int, default=15)
+    parser.add_argument('--batch-drafts', type=int, default=256, help='drafts simulated together')
+    parser.add_argument('--greedy', action='store_true', help='always take the most likely card instead of sampling')
+    parser.add_argument('--seed', type=int, default=None)
+    parser.add_argument('--model-dir', default='./model/')
+    parser.add_argument('--freq-path', default='../data/train/oracleFrequency.json')
+    parser.add_argument('--out', default=None, help='write the pick records as JSON shards to this folder')
+    params = parser.parse_args()
+
+    with open(params.cube) as f:
+        cube = json.load(f)
+    with open(params.freq_path) as f:
+        num_cards = len(json.load(f))
+
+    model = CubeCobraMLSystem(num_cards)
+    model.load_weights(params.model_dir)
+
+    rng = np.random.default_rng(params.seed)
+    writer = ShardWriter(params.out) if params.out else None
+
+    start = time.perf_counter()
+    done = 0
+    while done < params.num_drafts:
+        batch = min(params.batch_drafts, params.num_drafts - done)
+        simulate(model, cube, batch, params.seats, params.packs, params.pack_size, rng, params.greedy, writer)
+        done += batch
+        elapsed = time.perf_counter() - start
+        print('Drafted {} of {}, {:.1f} drafts/s'.format(done, params.num_drafts, done / elapsed))
+
+    if writer is not None:
+        writer.close()
+        print('Wrote {} pick records to {}'.format(writer.num_records, params.out))
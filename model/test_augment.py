@@ -0,0 +1,58 @@
+import unittest
+import numpy as np
+from augment import NoiseAugmenter, build_alias_table, make_rng
+from encoding import flatten
+
+class TestAugment(unittest.TestCase):
+    def setUp(self):
+        self.weights = np.array([1, 2, 3, 4, 10, 0.5, 0.5, 79], dtype=np.float64)
+        self.augmenter = NoiseAugmenter(self.weights)
+
+    def test_alias_table(self):
+        prob, alias = build_alias_table(self.weights)
+        # each card's mass is its own column's prob plus what other columns alias to it
+        n = len(self.weights)
+        mass = prob / n
+        np.add.at(mass, alias, (1 - prob) / n)
+        np.testing.assert_allclose(mass, self.weights / self.weights.sum())
+
+    def test_sample_frequencies(self):
+        draws = 200000
+        cards = self.augmenter.sample(draws, make_rng(0))
+        frequencies = np.bincount(cards, minlength=len(self.weights)) / draws
+        expected = self.weights / self.weights.sum()
+        # within 4 standard deviations of a binomial
+        np.testing.assert_array_less(np.abs(frequencies - expected), 4 * np.sqrt(expected * (1 - expected) / draws))
+
+    def test_sample_excluding(self):
+        num_cards = len(self.weights)
+        rows = np.repeat(np.arange(2), 1000)
+        # the heaviest card is in every cube
+        cube_keys = np.array([0 * num_cards + 7, 1 * num_cards + 4, 1 * num_cards + 7])
+        cards = self.augmenter.sample_excluding(rows, cube_keys, num_cards, make_rng(1))
+        self.assertFalse(np.any(cards == 7))
+        self.assertFalse(np.any(cards[rows == 1] == 4))
+
+    def test_corrupt(self):
+        num_cards = 1000
+        rng = make_rng(2)
+        cubes = [rng.choice(num_cards, size, replace=False) for size in [0, 10, 45, 360]]
+        augmenter = NoiseAugmenter(np.ones(num_cards), noise=0.2, noise_std=0.1)
+        (x_flat, x_offsets), (y_flat, y_offsets) = augmenter.corrupt(*flatten(cubes), num_cards, make_rng(3))
+
+        for row, cube in enumerate(cubes):
+            x = x_flat[x_offsets[row]:x_offsets[row + 1]]
+            y = y_flat[y_offsets[row]:y_offsets[row + 1]]
+            # targets only lose cards, inputs swap cuts for as many new cards at most
+            self.assertTrue(set(y) <= set(cube))
+            self.assertLessEqual(len(x), len(cube) + int(len(cube) * 0.8))
+            self.assertEqual(len(np.unique(x)), len(x))
+            if len(cube) >= 20:
+                self.assertTrue(set(x) - set(cube))
+
+        # the same rng key gives the same batch
+        again = augmenter.corrupt(*flatten(cubes), num_cards, make_rng(3))
+        np.testing.assert_array_equal(again[0][0], x_flat)
+
+if __name__ == "__main__":
+    unittest.main()
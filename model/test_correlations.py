@@ -0,0 +1,58 @@
+import unittest
+import numpy as np
+import tempfile
+import json
+import os
+from correlations import convert_correlations, from_rows, iter_json_rows, load_correlations, save_correlations
+
+NUM_CARDS = 25
+
+# the dense normalized matrix the old generator_reg.py built from the flat JSON list
+def dense_correlations(counts, epsilon=1):
+    return counts / (counts.sum(axis=1, keepdims=True) + epsilon)
+
+class TestCorrelations(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        rng = np.random.default_rng(0)
+        counts = rng.integers(1, 1000, (NUM_CARDS, NUM_CARDS)) * (rng.random((NUM_CARDS, NUM_CARDS)) < 0.2)
+        # empty rows, the last one included
+        counts[[3, 4, NUM_CARDS - 1]] = 0
+        self.counts = counts
+        self.json_path = os.path.join(self.dir.name, 'correlations.json')
+        with open(self.json_path, 'w') as f:
+            f.write('[\n' + ', '.join(map(str, counts.ravel().tolist())) + '\n]')
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def test_iter_json_rows(self):
+        # chunks smaller than a row, numbers are cut between chunks
+        for chunk_size in [7, 64, 1 << 20]:
+            rows = list(iter_json_rows(self.json_path, NUM_CARDS, chunk_size=chunk_size))
+            np.testing.assert_array_equal(np.array(rows), self.counts)
+
+    def test_round_trip(self):
+        expected = dense_correlations(self.counts)
+        matrix = from_rows(iter_json_rows(self.json_path, NUM_CARDS, chunk_size=100), NUM_CARDS)
+        self.assertEqual(matrix.nnz, np.count_nonzero(self.counts))
+        np.testing.assert_array_equal(matrix.row_sums, self.counts.sum(axis=1))
+
+        path = os.path.join(self.dir.name, 'correlations')
+        save_correlations(matrix, path)
+        for loaded in [matrix, load_correlations(path, NUM_CARDS), load_correlations(self.json_path, NUM_CARDS)]:
+            np.testing.assert_allclose(loaded.rows(np.arange(NUM_CARDS)), expected, rtol=1e-6)
+            # any rows in any order, repeated
+            rows = np.array([5, 3, 5, NUM_CARDS - 1, 0])
+            np.testing.assert_allclose(loaded.rows(rows, dtype=np.float64), expected[rows], rtol=1e-12)
+
+        with self.assertRaises(ValueError):
+            load_correlations(path, NUM_CARDS + 1)
+
+    def test_convert(self):
+        path = os.path.join(self.dir.name, 'converted')
+        self.assertEqual(convert_correlations(self.json_path, path, NUM_CARDS), np.count_nonzero(self.counts))
+        np.testing.assert_allclose(load_correlations(path, NUM_CARDS).rows(np.arange(NUM_CARDS)), dense_correlations(self.counts), rtol=1e-6)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,86 @@
+import unittest
+import numpy as np
+import tempfile
+import json
+import os
+from dataset import CSRDataset, CSRWriter, convert_collection, iter_json_records, load_collection
+
+CUBES = [[3, 1, 4], [], [1, 5, 9, 2, 6]]
+DECKS = [
+    {'mainboard': [0, 1], 'sideboard': [2]},
+    {'mainboard': [], 'sideboard': [3, 4, 5]},
+    {'mainboard': [6], 'sideboard': []},
+]
+PICKS = [
+    {'pool': [1, 2], 'pack': [3, 4, 5], 'pick': 4},
+    {'pool': [], 'pack': [7], 'pick': 7},
+]
+
+class TestCSRDataset(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.path = self.dir.name
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def write_shards(self, name, shards):
+        path = os.path.join(self.path, name)
+        os.makedirs(path)
+        for i, records in enumerate(shards):
+            with open(os.path.join(path, '{}.json'.format(i)), 'w') as f:
+                json.dump(records, f)
+        return path
+
+    def test_round_trip(self):
+        for collection, records in [('cubes', CUBES), ('decks', DECKS), ('picks', PICKS)]:
+            path = os.path.join(self.path, collection)
+            writer = CSRWriter(path, collection)
+            # two appends, offsets of the second continue from the first
+            writer.append(records[:1])
+            writer.append(records[1:])
+            writer.close()
+
+            dataset = CSRDataset(path)
+            self.assertEqual(len(dataset), len(records))
+            for row, record in enumerate(records):
+                if collection == 'cubes':
+                    self.assertEqual(dataset['cards'][row].tolist(), record)
+                    continue
+                for name, value in record.items():
+                    expected = [value] if name == 'pick' else value
+                    self.assertEqual(dataset[name][row].tolist(), expected)
+
+    def test_take(self):
+        writer = CSRWriter(self.path, 'cubes')
+        writer.append(CUBES)
+        writer.close()
+
+        flat, offsets = CSRDataset(self.path)['cards'].take([2, 0, 1, 2])
+        self.assertEqual(offsets.tolist(), [0, 5, 8, 8, 13])
+        self.assertEqual(flat.tolist(), CUBES[2] + CUBES[0] + CUBES[2])
+        self.assertEqual(flat.dtype, np.int32)
+
+    def test_convert_collection(self):
+        json_path = self.write_shards('decks', [DECKS[:2], DECKS[2:]])
+        out_path = os.path.join(self.path, 'bin')
+        self.assertEqual(convert_collection(json_path, out_path, 'decks'), len(DECKS))
+
+        dataset = CSRDataset(out_path)
+        self.assertEqual([dataset['sideboard'][row].tolist() for row in range(len(DECKS))], [deck['sideboard'] for deck in DECKS])
+
+    def test_load_collection(self):
+        path = self.write_shards('picks', [PICKS, PICKS])
+        shard = load_collection(path, 'picks')
+        self.assertEqual(len(shard), 2 * len(PICKS))
+        self.assertEqual(shard['pack'][3].tolist(), PICKS[1]['pack'])
+        self.assertEqual(shard['pick'].indices.tolist(), [4, 7, 4, 7])
+
+    def test_iter_json_records_small_chunks(self):
+        path = self.write_shards('cubes', [CUBES])
+        # chunks shorter than a record make every record span a buffer refill
+        records = list(iter_json_records(os.path.join(path, '0.json'), chunk_size=4))
+        self.assertEqual(records, CUBES)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,91 @@
+import unittest
+import numpy as np
+import tempfile
+import tensorflow as tf
+from dtype_policy import POLICIES, set_policy, train_steps, max_difference
+from model import CubeCobraMLSystem
+from test_pipeline import write_dataset
+import generator_disk
+import os
+
+NUM_CARDS = 60
+
+class TestDtypePolicy(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.dir = tempfile.TemporaryDirectory()
+        write_dataset(cls.dir.name, np.random.default_rng(0))
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.dir.cleanup()
+
+    def tearDown(self):
+        set_policy('float32')
+
+    def generator(self, policy, **kwargs):
+        path = self.dir.name
+        return generator_disk.DataGenerator(
+            os.path.join(path, 'cubes'),
+            os.path.join(path, 'decks'),
+            os.path.join(path, 'picks'),
+            os.path.join(path, 'oracleFrequency.json'),
+            os.path.join(path, 'correlations'),
+            num_batches=4,
+            seed=0,
+            input_dtype=POLICIES[policy]['inputs'],
+            **kwargs
+        )
+
+    def create_model(self, policy):
+        set_policy(policy)
+        model = CubeCobraMLSystem(NUM_CARDS)
+        model.compile(optimizer='adam', loss=['binary_crossentropy', 'binary_crossentropy', 'categorical_crossentropy', 'kullback_leibler_divergence'])
+        return model
+
+    def test_set_policy(self):
+        for name, policy in POLICIES.items():
+            self.assertIs(set_policy(name), policy)
+            self.assertEqual(tf.keras.mixed_precision.global_policy().name, policy['keras'])
+
+    def test_sparse_encoder(self):
+        rng = np.random.default_rng(1)
+        rows = [np.sort(rng.choice(NUM_CARDS, 12, replace=False)) for _ in range(5)]
+        indices = tf.ragged.constant(rows, dtype=tf.int32)
+        dense = np.zeros((len(rows), NUM_CARDS), dtype=np.float32)
+        for row, cards in zip(dense, rows):
+            row[cards] = 1
+
+        weights = None
+        for name, policy in POLICIES.items():
+            model = self.create_model(name)
+            model.build_components()
+            if weights is None:
+                weights = model.get_weights()
+            model.set_weights(weights)
+            # card indices and the multi-hot rows of the policy give the same embedding
+            sparse = model.embed(indices)
+            expected = model.embed(tf.constant(dense.astype(policy['inputs'])))
+            self.assertEqual(sparse.dtype, model.encoder.compute_dtype)
+            np.testing.assert_allclose(tf.cast(sparse, tf.float32).numpy(), tf.cast(expected, tf.float32).numpy(), atol=0.05)
+
+    def test_train_steps(self):
+        for name in ['float32', 'mixed_bfloat16']:
+            for sparse_inputs in [False, True]:
+                generator = self.generator(name, sparse_inputs=sparse_inputs)
+                model = self.create_model(name)
+                samples_per_second, nbytes, results = train_steps(model, generator, 2)
+                self.assertGreater(samples_per_second, 0)
+                self.assertGreater(nbytes, 0)
+                self.assertIn('loss', results)
+                self.assertTrue(np.isfinite(results['loss']))
+
+    def test_max_difference(self):
+        baseline = {'loss': 2.0, 'output_1_loss': 1.0, 'output_1_accuracy': 0.5}
+        self.assertEqual(max_difference(baseline, baseline), 0)
+        # relative for the loss, absolute for metrics, per-head losses are left out
+        self.assertAlmostEqual(max_difference({'loss': 2.1, 'output_1_loss': 9.0, 'output_1_accuracy': 0.52}, baseline), 0.05)
+        self.assertAlmostEqual(max_difference({'loss': 2.0, 'output_1_loss': 1.0, 'output_1_accuracy': 0.4}, baseline), 0.1)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,57 @@
+import unittest
+import numpy as np
+import tempfile
+import os
+from embedding_index import IVFIndex, exact_top_k, normalize, recall, similar_cards
+
+# cards around a few directions, like the clusters the encoder embeddings form
+def clustered_embeddings(rng, num_cards=2000, dim=32, num_clusters=20):
+    centers = rng.normal(size=(num_clusters, dim))
+    return normalize(centers[rng.integers(num_clusters, size=num_cards)] + 0.3 * rng.normal(size=(num_cards, dim)))
+
+class TestEmbeddingIndex(unittest.TestCase):
+    def setUp(self):
+        rng = np.random.default_rng(0)
+        self.embeddings = clustered_embeddings(rng)
+        self.queries = normalize(self.embeddings[rng.choice(len(self.embeddings), 100, replace=False)] + 0.1 * rng.normal(size=(100, 32)))
+        self.index = IVFIndex.build(self.embeddings, num_probes=4)
+
+    def test_lists(self):
+        self.assertEqual(sorted(self.index.order.tolist()), list(range(len(self.embeddings))))
+        self.assertEqual(self.index.offsets[-1], len(self.embeddings))
+
+    def test_all_probes_is_exact(self):
+        exact_indices, exact_scores = exact_top_k(self.embeddings, self.queries, 10)
+        indices, scores = self.index.search(self.embeddings, self.queries, 10, num_probes=self.index.num_lists)
+        np.testing.assert_array_equal(indices, exact_indices)
+        np.testing.assert_allclose(scores, exact_scores, rtol=1e-5)
+
+    def test_recall(self):
+        exact_indices, _ = exact_top_k(self.embeddings, self.queries, 10)
+        indices, scores = self.index.search(self.embeddings, self.queries, 10)
+        self.assertGreater(recall(exact_indices, indices), 0.9)
+        # scores are the real cosine similarities of the cards returned
+        np.testing.assert_allclose(scores, np.einsum('ijk,ik->ij', self.embeddings[indices], self.queries), rtol=1e-5)
+
+    def test_short_lists_are_padded(self):
+        indices, scores = self.index.search(self.embeddings, self.queries[:3], len(self.embeddings), num_probes=1)
+        self.assertTrue(np.all((indices == -1) == np.isinf(scores)))
+        self.assertTrue(np.all(indices[:, 0] >= 0))
+
+    def test_save_load(self):
+        with tempfile.TemporaryDirectory() as path:
+            filename = os.path.join(path, 'index.npz')
+            self.index.save(filename)
+            loaded = IVFIndex.load(filename, num_probes=4)
+        np.testing.assert_array_equal(loaded.search(self.embeddings, self.queries, 10)[0], self.index.search(self.embeddings, self.queries, 10)[0])
+
+    def test_similar_cards(self):
+        cards = np.arange(0, 2000, 100)
+        for index in [None, self.index]:
+            indices, scores = similar_cards(self.embeddings, cards, 5, index=index)
+            self.assertEqual(indices.shape, (len(cards), 5))
+            self.assertFalse(np.any(indices == cards[:, None]))
+            self.assertTrue(np.all(np.diff(scores, axis=1) <= 0))
+
+if __name__ == "__main__":
+    unittest.main()
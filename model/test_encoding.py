@@ -0,0 +1,78 @@
+import unittest
+import numpy as np
+from encoding import BatchEncoder, concat_rows, flatten, multi_hot, multi_hot_lists, union_rows, unique_rows
+
+NUM_CARDS = 30
+
+def random_lists(rng, num_rows, max_size):
+    # repeated cards and empty rows included
+    return [rng.integers(NUM_CARDS, size=rng.integers(0, max_size + 1)).tolist() for _ in range(num_rows)]
+
+def to_lists(flat, offsets):
+    return [flat[offsets[i]:offsets[i + 1]].tolist() for i in range(len(offsets) - 1)]
+
+class TestEncoding(unittest.TestCase):
+    def setUp(self):
+        self.rng = np.random.default_rng(0)
+
+    def test_flatten(self):
+        lists = random_lists(self.rng, 6, 10)
+        flat, offsets = flatten(lists)
+        self.assertEqual((flat.dtype, offsets.dtype), (np.int32, np.int64))
+        self.assertEqual(to_lists(flat, offsets), lists)
+        self.assertEqual(to_lists(*flatten([])), [])
+
+        parts = [flatten(random_lists(self.rng, rows, 5)) for rows in [3, 0, 4]]
+        self.assertEqual(to_lists(*concat_rows(parts)), [row for part in parts for row in to_lists(*part)])
+        self.assertEqual(to_lists(*concat_rows([])), [])
+
+    def test_unique_rows(self):
+        lists = random_lists(self.rng, 20, 40)
+        flat, offsets = unique_rows(*flatten(lists), NUM_CARDS)
+        self.assertEqual((flat.dtype, offsets.dtype), (np.int32, np.int64))
+        self.assertEqual(to_lists(flat, offsets), [sorted(set(row)) for row in lists])
+
+    def test_union_rows(self):
+        a = random_lists(self.rng, 20, 15)
+        b = random_lists(self.rng, 20, 15)
+        flat, offsets = union_rows(flatten(a), flatten(b), NUM_CARDS)
+        self.assertEqual(to_lists(flat, offsets), [sorted(set(x) | set(y)) for x, y in zip(a, b)])
+
+    def test_multi_hot(self):
+        lists = random_lists(self.rng, 5, 10)
+        rows = multi_hot_lists(lists, NUM_CARDS, batch_size=7, dtype=np.uint8)
+        self.assertEqual((rows.shape, rows.dtype), ((7, NUM_CARDS), np.uint8))
+        for row, cards in zip(rows, lists + [[], []]):
+            self.assertEqual(np.flatnonzero(row).tolist(), sorted(set(cards)))
+
+        with self.assertRaises(ValueError):
+            multi_hot(*flatten(lists), NUM_CARDS, out=np.zeros((4, NUM_CARDS), dtype=np.float32))
+
+    def test_batch_encoder_reuse(self):
+        encoder = BatchEncoder(NUM_CARDS)
+        # full rows first, so any stale entry would show in the emptier batches after
+        batches = [
+            ([list(range(NUM_CARDS))] * 8, None),
+            (random_lists(self.rng, 8, 3), None),
+            (random_lists(self.rng, 4, 20), None),
+            (random_lists(self.rng, 8, 3), None),
+            (random_lists(self.rng, 5, 3), 8),
+            ([], 8),
+        ]
+        buffers = []
+        for lists, batch_size in batches:
+            encoded = encoder.encode_lists('x', lists, batch_size=batch_size)
+            np.testing.assert_array_equal(encoded, multi_hot_lists(lists, NUM_CARDS, batch_size=batch_size))
+            buffers.append(encoded)
+
+        # batches of the same size share the buffer, a new size replaces it
+        self.assertIs(buffers[1], buffers[0])
+        self.assertIsNot(buffers[2], buffers[1])
+        self.assertIs(buffers[5], buffers[3])
+
+        other = encoder.encode('y', *flatten([[1]]), dtype=np.uint8)
+        self.assertEqual(other.dtype, np.uint8)
+        self.assertIsNot(encoder.encode('y', *flatten([[2]])), other)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,48 @@
+import unittest
+import numpy as np
+import tempfile
+import os
+from model import CubeCobraMLSystem
+from evaluate import HEADS, evaluate, parse_params, results_json
+from test_pipeline import NUM_CARDS, write_dataset
+
+class TestEvaluate(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.dir = tempfile.TemporaryDirectory()
+        path = cls.dir.name
+        write_dataset(os.path.join(path, 'data'), np.random.default_rng(0))
+        model = CubeCobraMLSystem(NUM_CARDS)
+        model.build_components()
+        model.save_weights(os.path.join(path, 'model'))
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.dir.cleanup()
+
+    def test_workers(self):
+        path = self.dir.name
+        params = vars(parse_params([
+            '--model-dir', os.path.join(path, 'model'),
+            '--data-dir', os.path.join(path, 'data'),
+            '--freq-path', os.path.join(path, 'data', 'oracleFrequency.json'),
+            # batches that do not divide the 40 records of a shard
+            '--batch-size', '16',
+            '--noise', '0.2',
+        ]))
+
+        single = results_json(evaluate(params))
+        self.assertEqual(sorted(single), sorted(HEADS))
+        self.assertTrue(all(result['samples'] == 80 for result in single.values()))
+
+        # every worker scores one of the two shards of each collection
+        for num_workers in [2, 3]:
+            spawned = results_json(evaluate(params, num_workers))
+            for head, result in single.items():
+                self.assertEqual(spawned[head]['samples'], result['samples'])
+                for name, value in result.items():
+                    if name not in ['samples', 'seconds']:
+                        self.assertAlmostEqual(spawned[head][name], value, places=6, msg='{} {}'.format(head, name))
+
+if __name__ == "__main__":
+    unittest.main()
@@ -2,7 +2,7 @@ import unittest
 import numpy as np
 import os
 import json
-from generator import DataGenerator  # Assuming the class name is Generator
+from generator_disk import DataGenerator
 
 class TestGenerator(unittest.TestCase):
     def setUp(self):
@@ -12,10 +12,11 @@ class TestGenerator(unittest.TestCase):
         self.metadata_path = "../data/train/metadata.json"
         
         
-        with open("../data/train/oracleFrequency.json") as f:
+        self.freq_path = "../data/train/oracleFrequency.json"
+        self.correlations_path = "../data/train/correlations.json"
+
+        with open(self.freq_path) as f:
             self.card_freqs = json.load(f)
-        with open("../data/train/correlations.json") as f:
-            self.card_correlations = json.load(f)
 
         self.batch_size = 128
         self.noise = 0.2
@@ -25,16 +26,15 @@ class TestGenerator(unittest.TestCase):
             self.cubes_path,
             self.decks_path,
             self.picks_pack,
-            self.metadata_path,
-            self.card_freqs,
-            self.card_correlations,
-            self.batch_size,
-            self.noise,
-            self.noise_std
+            self.freq_path,
+            self.correlations_path,
+            num_batches=self.batch_size,
+            noise=self.noise,
+            noise_std=self.noise_std,
         )
 
     def test_init(self):
-        self.assertEqual(self.generator.batch_size, self.batch_size)
+        self.assertEqual(self.generator.num_batches, self.batch_size)
         self.assertEqual(self.generator.noise, self.noise)
         self.assertEqual(self.generator.noise_std, self.noise_std)
         self.assertEqual(self.generator.num_cards, len(self.card_freqs))
@@ -53,20 +53,35 @@ class TestGenerator(unittest.TestCase):
         self.assertEqual(len(self.generator.x_decks_files), len(os.listdir(self.decks_path)))
         self.assertEqual(len(self.generator.x_picks_files), len(os.listdir(self.picks_pack)))
 
-        self.assertEqual(len(self.generator.cube_indices), len(os.listdir(self.cubes_path)))
-        self.assertEqual(len(self.generator.deck_indices), len(os.listdir(self.decks_path)))
-        self.assertEqual(len(self.generator.pick_indices), len(os.listdir(self.picks_pack)))
+        # the epoch's record order holds every record once
+        self.assertEqual(sorted(self.generator.cube_indices), list(range(metadata['numCubes'])))
+        self.assertEqual(sorted(self.generator.deck_indices), list(range(metadata['numDecks'])))
+        self.assertEqual(sorted(self.generator.pick_indices), list(range(metadata['numPicks'])))
         self.assertEqual(len(self.generator.corr_indices), len(self.card_freqs))
 
         self.assertEqual(self.generator.samples_per_epoch, max(metadata['numCubes'], metadata['numDecks'], metadata['numPicks']))
     
     def test_getitem(self):
         self.generator.prep_next_epoch()
-        result = self.generator.__getitem__(0)
-        self.assertIsInstance(result, tuple)
-        self.assertEqual(len(result), 5)
-        for item in result:
-            self.assertEqual(len(item), self.batch_size)
+        inputs, targets = self.generator.__getitem__(0)
+        self.assertEqual(len(inputs), 4)
+        self.assertEqual(len(targets), 4)
+
+        x_cubes, x_decks, (x_pools, x_packs), x_corr = inputs
+        y_cubes, y_decks, y_picks, y_corr = targets
+        rows = [
+            (self.generator.cube_batch_size, [x_cubes, y_cubes]),
+            (self.generator.deck_batch_size, [x_decks, y_decks]),
+            (self.generator.pick_batch_size, [x_pools, x_packs, y_picks]),
+            (self.generator.corr_batch_size, [x_corr, y_corr]),
+        ]
+        for batch_size, items in rows:
+            for item in items:
+                self.assertEqual(item.shape, (batch_size, len(self.card_freqs)))
+
+        # one pick per row, correlation targets are distributions
+        np.testing.assert_array_equal(y_picks.sum(axis=1), 1)
+        np.testing.assert_allclose(y_corr.sum(axis=1)[y_corr.sum(axis=1) > 0], 1, atol=0.05)
 
 if __name__ == "__main__":
     unittest.main()
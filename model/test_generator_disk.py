@@ -0,0 +1,82 @@
+import unittest
+import numpy as np
+import tempfile
+import json
+import os
+from test_pipeline import cards, write_dataset
+import generator_disk
+
+# shard sizes of the cubes, 7 shards so groups of 3 leave a partial last group
+CUBE_SHARDS = [40, 40, 13, 1, 0, 27, 5]
+
+class TestGeneratorDisk(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.dir = tempfile.TemporaryDirectory()
+        rng = np.random.default_rng(0)
+        write_dataset(cls.dir.name, rng)
+        for shard, size in enumerate(CUBE_SHARDS):
+            with open(os.path.join(cls.dir.name, 'cubes', '{}.json'.format(shard)), 'w') as f:
+                json.dump([cards(rng, int(rng.integers(10, 40))) for _ in range(size)], f)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.dir.cleanup()
+
+    def generator(self, **kwargs):
+        path = self.dir.name
+        return generator_disk.DataGenerator(
+            os.path.join(path, 'cubes'),
+            os.path.join(path, 'decks'),
+            os.path.join(path, 'picks'),
+            os.path.join(path, 'oracleFrequency.json'),
+            os.path.join(path, 'correlations'),
+            num_batches=4,
+            seed=0,
+            shards_per_batch=3,
+            **kwargs
+        )
+
+    def test_epoch_order(self):
+        generator = self.generator()
+        index = generator.cube_index
+        self.assertEqual(generator.x_cubes, sum(CUBE_SHARDS))
+        shard_of = np.searchsorted(index.shard_offsets, np.arange(len(index)), side='right') - 1
+
+        orders = []
+        for _ in range(3):
+            order = generator.cube_indices
+            # every record exactly once
+            np.testing.assert_array_equal(np.sort(order), np.arange(sum(CUBE_SHARDS)))
+            # cut the order wherever the shards read so far are complete, the groups
+            # of shards_per_batch are unions of these segments
+            shards = shard_of[order]
+            sizes = np.bincount(shards, minlength=len(CUBE_SHARDS))
+            segments = []
+            seen = {}
+            for shard in shards:
+                seen[shard] = seen.get(shard, 0) + 1
+                if all(count == sizes[seen_shard] for seen_shard, count in seen.items()):
+                    segments.append(set(seen))
+                    seen = {}
+            self.assertEqual(seen, {})
+            self.assertTrue(all(len(segment) <= 3 for segment in segments))
+            self.assertEqual(sum(len(segment) for segment in segments), np.count_nonzero(CUBE_SHARDS))
+            orders.append(order.copy())
+            generator.on_epoch_end()
+
+        # a new shuffle every epoch
+        self.assertFalse(np.array_equal(orders[0], orders[1]))
+
+    def test_samples_per_epoch(self):
+        generator = self.generator()
+        self.assertEqual(generator.samples_per_epoch, max(sum(CUBE_SHARDS), generator.x_decks, generator.x_picks))
+        for name in ['cube', 'deck', 'pick']:
+            self.assertEqual(len(getattr(generator, name + '_indices')), getattr(generator, 'x_' + name + 's'))
+
+        # record_shuffle orders cover the same records
+        generator = self.generator(record_shuffle=True)
+        np.testing.assert_array_equal(np.sort(generator.cube_indices), np.arange(sum(CUBE_SHARDS)))
+
+if __name__ == "__main__":
+    unittest.main()
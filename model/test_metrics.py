@@ -0,0 +1,78 @@
+import unittest
+import numpy as np
+import math
+from metrics import RelativePick, RelativePickMetric, TopRatedPercent, TopRatedPercentMetric, relative_pick, top_rated_percent
+
+NUM_CARDS = 200
+# multiples of 5 are where float32 1.2 * size rounds past the integer
+SIZES = [1, 5, 7, 25, 45, 50, 85, 90, 100, 133]
+
+# the per-row loops of the original test.py
+def loop_top_rated_percent(y_true, y_pred):
+    accuracies = []
+    for i in range(len(y_true)):
+        true_cube = [j for j, x in enumerate(y_true[i]) if x == 1]
+        pred_cube = np.argpartition(y_pred[i], -math.ceil(len(true_cube) * 1.2))[-math.ceil(len(true_cube) * 1.2):]
+        accuracies.append((len(set(true_cube) & set(pred_cube)) + 1) / (len(true_cube) + 1))
+    return np.mean(accuracies)
+
+def loop_relative_pick(y_true, y_pred, k):
+    accuracies = []
+    for i in range(len(y_true)):
+        true_top = np.argpartition(y_true[i], -1)[-1:]
+        pred_top = np.argpartition(y_pred[i], -k)[-k:]
+        accuracies.append(1 if true_top in pred_top else 0)
+    return np.mean(accuracies)
+
+class TestMetrics(unittest.TestCase):
+    def setUp(self):
+        rng = np.random.default_rng(0)
+        self.y_true = np.zeros((len(SIZES), NUM_CARDS), dtype=np.float32)
+        for row, size in zip(self.y_true, SIZES):
+            row[rng.choice(NUM_CARDS, size, replace=False)] = 1
+        # predictions close to the cube so the cutoff decides hits, no ties
+        self.y_pred = (self.y_true * 0.5 + rng.random((len(SIZES), NUM_CARDS))).astype(np.float32)
+
+        self.picks = np.zeros((len(SIZES), NUM_CARDS), dtype=np.float32)
+        self.picks[np.arange(len(SIZES)), rng.integers(NUM_CARDS, size=len(SIZES))] = 1
+        self.pick_pred = (self.picks * 0.3 + rng.random((len(SIZES), NUM_CARDS))).astype(np.float32)
+
+    def test_top_rated_percent(self):
+        expected = loop_top_rated_percent(self.y_true, self.y_pred)
+        self.assertAlmostEqual(top_rated_percent(self.y_true, self.y_pred), expected)
+
+        streaming = TopRatedPercent()
+        streaming.update(self.y_true[:4], self.y_pred[:4])
+        streaming.merge(TopRatedPercent()).update(self.y_true[4:], self.y_pred[4:])
+        self.assertAlmostEqual(streaming.result(), expected)
+
+        metric = TopRatedPercentMetric()
+        metric.update_state(self.y_true[:4], self.y_pred[:4])
+        metric.update_state(self.y_true[4:], self.y_pred[4:])
+        self.assertAlmostEqual(float(metric.result()), expected, places=6)
+
+    def test_top_rated_percent_per_size(self):
+        # one row at a time, so a wrong cutoff for any size cannot average out
+        for i, size in enumerate(SIZES):
+            y_true, y_pred = self.y_true[i:i + 1], self.y_pred[i:i + 1]
+            expected = loop_top_rated_percent(y_true, y_pred)
+            metric = TopRatedPercentMetric()
+            metric.update_state(y_true, y_pred)
+            self.assertAlmostEqual(top_rated_percent(y_true, y_pred), expected, msg=size)
+            self.assertAlmostEqual(float(metric.result()), expected, places=6, msg=size)
+
+    def test_relative_pick(self):
+        for k in [1, 3]:
+            expected = loop_relative_pick(self.picks, self.pick_pred, k)
+            self.assertAlmostEqual(relative_pick(self.picks, self.pick_pred, k), expected)
+
+            streaming = RelativePick(k)
+            streaming.update(self.picks, self.pick_pred)
+            self.assertAlmostEqual(streaming.result(), expected)
+
+            metric = RelativePickMetric(k)
+            metric.update_state(self.picks, self.pick_pred)
+            self.assertAlmostEqual(float(metric.result()), expected, places=6)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,142 @@
+import unittest
+import numpy as np
+import tensorflow as tf
+from model import CubeCobraMLSystem
+from draft_session import DraftSession
+
+NUM_CARDS = 50
+
+def multi_hot(rng, batch_size, size):
+    rows = np.zeros((batch_size, NUM_CARDS), dtype=np.float32)
+    for row in rows:
+        row[rng.choice(NUM_CARDS, size, replace=False)] = 1
+    return tf.constant(rows)
+
+def to_indices(rows):
+    cards = tf.where(rows > 0)
+    return tf.RaggedTensor.from_value_rowids(cards[:, 1], cards[:, 0], nrows=rows.shape[0])
+
+class TestModel(unittest.TestCase):
+    def setUp(self):
+        rng = np.random.default_rng(0)
+        self.model = CubeCobraMLSystem(NUM_CARDS)
+        self.pools = multi_hot(rng, 6, 20)
+        self.packs = multi_hot(rng, 6, 8)
+
+    def test_infer(self):
+        separate = {
+            'recommend': lambda: self.model.recommend(self.pools),
+            'deck_build': lambda: self.model.deck_build(self.pools),
+            'draft': lambda: self.model.draft(self.pools, self.packs),
+            'correlate': lambda: self.model.correlate(self.pools),
+        }
+        # the first tuple of heads leaves decoders out, the second still builds
+        for heads in [('recommend', 'deck_build'), ('recommend', 'deck_build', 'draft', 'correlate')]:
+            outputs = self.model.infer(self.pools, heads=heads, packs=self.packs)
+            self.assertEqual(sorted(outputs), sorted(heads))
+            for head in heads:
+                np.testing.assert_allclose(outputs[head].numpy(), separate[head]().numpy(), atol=1e-5)
+
+        embedding = self.model.embed(self.pools)
+        outputs = self.model.infer(heads=('draft',), packs=self.packs, embedding=embedding)
+        np.testing.assert_allclose(outputs['draft'].numpy(), separate['draft']().numpy(), atol=1e-5)
+
+    def test_candidates(self):
+        rng = np.random.default_rng(1)
+        # 48 and 640 pack cards, both sides of TRANSPOSE_CANDIDATES
+        for batch_size in [6, 80]:
+            pools = multi_hot(rng, batch_size, 20)
+            packs = multi_hot(rng, batch_size, 8)
+            pool_indices = to_indices(pools)
+            pack_indices = to_indices(packs)
+
+            dense = self.model.draft(pools, packs).numpy()
+            candidates = self.model.draft_candidates(pool_indices, pack_indices)
+            deck_dense = self.model.deck_build(pools).numpy()
+            deck_candidates = self.model.deck_build_candidates(pool_indices)
+            for row in range(batch_size):
+                np.testing.assert_allclose(candidates[row].numpy(), dense[row, pack_indices[row].numpy()], atol=1e-5)
+                np.testing.assert_allclose(deck_candidates[row].numpy(), deck_dense[row, pool_indices[row].numpy()], atol=1e-5)
+
+    def test_top_k(self):
+        rng = np.random.default_rng(3)
+        # cube sizes on both sides of k, the last cube holds every card
+        cubes = np.zeros((4, NUM_CARDS), dtype=np.float32)
+        for row, size in zip(cubes, [5, 20, 45, 50]):
+            row[rng.choice(NUM_CARDS, size, replace=False)] = 1
+        cubes = tf.constant(cubes)
+        scores = self.model.recommend(cubes).numpy()
+        deck_scores = self.model.deck_build(cubes).numpy()
+
+        # k above the number of cards is cut to num_cards columns
+        for k in [10, 40, 80]:
+            for inputs in [cubes, to_indices(cubes)]:
+                results = {name: value.numpy() for name, value in self.model.recommend_top_k(inputs, k=k).items()}
+                self.assertEqual(results['add_indices'].shape, (4, min(k, NUM_CARDS)))
+                for row, cube in enumerate(cubes.numpy()):
+                    in_cube = set(np.flatnonzero(cube).tolist())
+                    for kind, eligible, padding in [('add', NUM_CARDS - len(in_cube), -np.inf), ('remove', len(in_cube), np.inf)]:
+                        indices = results[kind + '_indices'][row]
+                        found = results[kind + '_scores'][row]
+                        finite = np.isfinite(found)
+                        # the real candidates first, then padding
+                        self.assertEqual(finite.sum(), min(k, eligible))
+                        self.assertTrue(np.all(finite[:finite.sum()]))
+                        self.assertTrue(np.all(found[~finite] == padding))
+                        self.assertEqual(len(set(indices[finite].tolist())), finite.sum())
+                        if kind == 'add':
+                            self.assertFalse(set(indices[finite].tolist()) & in_cube)
+                        else:
+                            self.assertLessEqual(set(indices[finite].tolist()), in_cube)
+                        np.testing.assert_allclose(found[finite], scores[row, indices[finite]], atol=1e-6)
+                        order = found[finite] if kind == 'add' else -found[finite]
+                        self.assertTrue(np.all(np.diff(order) <= 0))
+
+            for inputs in [cubes, to_indices(cubes)]:
+                results = {name: value.numpy() for name, value in self.model.deck_build_top_k(inputs, k=k, sideboard_k=k).items()}
+                for row, cube in enumerate(cubes.numpy()):
+                    pool = set(np.flatnonzero(cube).tolist())
+                    indices = np.concatenate([results['mainboard_indices'][row], results['sideboard_indices'][row]])
+                    found = np.concatenate([results['mainboard_scores'][row], results['sideboard_scores'][row]])
+                    finite = np.isfinite(found)
+                    self.assertEqual(finite.sum(), min(2 * k, NUM_CARDS, len(pool)))
+                    self.assertTrue(np.all(found[~finite] == -np.inf))
+                    self.assertLessEqual(set(indices[finite].tolist()), pool)
+                    np.testing.assert_allclose(found[finite], deck_scores[row, indices[finite]], atol=1e-6)
+
+    def test_draft_session(self):
+        rng = np.random.default_rng(2)
+        # starting pools of 0 to 9 cards, packs of 15 down to 12 cards that run out at
+        # different picks
+        order = [rng.permutation(NUM_CARDS) for _ in range(4)]
+        pools = [card_order[:3 * i].tolist() for i, card_order in enumerate(order)]
+        packs = [card_order[10:25 - i].tolist() for i, card_order in enumerate(order)]
+        session = DraftSession(self.model, pools=pools)
+
+        for _ in range(16):
+            pack_indices = tf.ragged.constant(packs, dtype=tf.int64, ragged_rank=1)
+            dense_pools = np.zeros((4, NUM_CARDS), dtype=np.float32)
+            dense_packs = np.zeros((4, NUM_CARDS), dtype=np.float32)
+            for i in range(4):
+                dense_pools[i, pools[i]] = 1
+                dense_packs[i, packs[i]] = 1
+            dense = self.model.draft(tf.constant(dense_pools), tf.constant(dense_packs)).numpy()
+
+            probabilities = session.pick_probabilities(pack_indices)
+            picks = session.pick(pack_indices)
+            for i in range(4):
+                expected = dense[i, packs[i]]
+                np.testing.assert_allclose(probabilities[i].numpy(), expected, atol=1e-5)
+                if packs[i]:
+                    self.assertEqual(picks[i], packs[i][int(np.argmax(expected))])
+                    pools[i].append(packs[i].pop(int(np.argmax(expected))))
+                else:
+                    self.assertEqual(picks[i], -1)
+
+            for pool, session_pool in zip(pools, session.pools()):
+                self.assertEqual(sorted(pool), session_pool.tolist())
+
+        self.assertFalse(any(packs))
+
+if __name__ == "__main__":
+    unittest.main()
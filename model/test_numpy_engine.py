@@ -0,0 +1,87 @@
+import unittest
+import numpy as np
+import tempfile
+import os
+from model import CubeCobraMLSystem
+from numpy_engine import ALIGNMENT, NumpyEngine, write_weights
+from export_numpy import model_components
+
+NUM_CARDS = 70
+
+class TestNumpyEngine(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.dir = tempfile.TemporaryDirectory()
+        cls.model = CubeCobraMLSystem(NUM_CARDS)
+        cls.model.build_components()
+        cls.filename = os.path.join(cls.dir.name, 'weights.bin')
+        write_weights(cls.filename, NUM_CARDS, model_components(cls.model))
+
+        rng = np.random.default_rng(0)
+        cls.pools = np.zeros((8, NUM_CARDS), dtype=np.float32)
+        cls.packs = np.zeros((8, NUM_CARDS), dtype=np.float32)
+        for i in range(8):
+            cls.pools[i, rng.choice(NUM_CARDS, 3 + 5 * i, replace=False)] = 1
+            cls.packs[i, rng.choice(NUM_CARDS, 15, replace=False)] = 1
+        # an empty pool, the embedding of the biases alone
+        cls.pools[0] = 0
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.dir.cleanup()
+
+    def test_layout(self):
+        engine = NumpyEngine(self.filename)
+        self.assertEqual(engine.num_cards, NUM_CARDS)
+        weights = model_components(self.model)
+        for name, layers in weights.items():
+            self.assertEqual(len(engine.components[name]), len(layers))
+            for (kernel, bias, activation, scale), layer in zip(engine.components[name], layers):
+                np.testing.assert_array_equal(kernel, layer['kernel'])
+                np.testing.assert_array_equal(bias, layer['bias'])
+                self.assertEqual(activation, layer['activation'])
+                self.assertIsNone(scale)
+                self.assertEqual((kernel.ctypes.data - engine.data.ctypes.data) % ALIGNMENT, 0)
+
+    def test_heads(self):
+        engine = NumpyEngine(self.filename)
+        indices = [np.flatnonzero(row) for row in self.pools]
+        checks = [
+            (engine.encode(self.pools), self.model.embed(self.pools)),
+            (engine.encode(indices), self.model.embed(self.pools)),
+            (engine.recommend(self.pools), self.model.recommend(self.pools)),
+            (engine.deck_build(indices), self.model.deck_build(self.pools)),
+            (engine.draft(self.pools, self.packs), self.model.draft(self.pools, self.packs)),
+            (engine.correlate(self.pools), self.model.correlate(self.pools)),
+        ]
+        for numpy_result, tf_result in checks:
+            self.assertEqual(numpy_result.shape, tuple(tf_result.shape))
+            np.testing.assert_allclose(numpy_result, tf_result.numpy(), atol=1e-5)
+
+        # pack card indices are scored in the order of the pack
+        packs = [np.flatnonzero(row)[::-1] for row in self.packs]
+        dense = self.model.draft(self.pools, self.packs).numpy()
+        for row, probabilities in enumerate(engine.draft(indices, packs)):
+            np.testing.assert_allclose(probabilities, dense[row, packs[row]], atol=1e-5)
+
+    def test_float16(self):
+        components = model_components(self.model)
+        for layers in components.values():
+            for layer in layers:
+                layer['kernel'] = layer['kernel'].astype(np.float16)
+        filename = os.path.join(self.dir.name, 'weights.float16.bin')
+        write_weights(filename, NUM_CARDS, components)
+
+        engine = NumpyEngine(filename)
+        self.assertEqual(engine.components['encoder'][0][0].dtype, np.float16)
+        np.testing.assert_allclose(engine.recommend(self.pools), self.model.recommend(self.pools).numpy(), atol=1e-2)
+
+    def test_not_a_weight_file(self):
+        filename = os.path.join(self.dir.name, 'other.bin')
+        with open(filename, 'wb') as f:
+            f.write(b'\0' * 64)
+        with self.assertRaises(ValueError):
+            NumpyEngine(filename)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,150 @@
+import unittest
+import numpy as np
+import tempfile
+import json
+import os
+from correlations import CorrelationMatrix, save_correlations
+from pipeline import encode_dataset, make_dataset, tf_multi_hot, tf_union_rows, time_steps
+from encoding import flatten, multi_hot, union_rows, unique_rows
+from workers import ParallelGenerator
+from multiprocessing import shared_memory
+from model import CubeCobraMLSystem
+import generator_disk
+import tensorflow as tf
+
+NUM_CARDS = 60
+
+def cards(rng, size):
+    return rng.choice(NUM_CARDS, size, replace=False).tolist()
+
+# two shards per collection in the process_data.js layout, plus sparse correlations
+def write_dataset(path, rng):
+    records = {
+        'cubes': lambda: cards(rng, int(rng.integers(10, 40))),
+        'decks': lambda: {'mainboard': cards(rng, 8), 'sideboard': cards(rng, 3)},
+        'picks': lambda: {'pool': cards(rng, 5), 'pack': cards(rng, 4), 'pick': 0},
+    }
+    for collection, record in records.items():
+        os.makedirs(os.path.join(path, collection))
+        for shard in range(2):
+            with open(os.path.join(path, collection, '{}.json'.format(shard)), 'w') as f:
+                json.dump([record() for _ in range(40)], f)
+
+    with open(os.path.join(path, 'oracleFrequency.json'), 'w') as f:
+        json.dump(rng.integers(1, 100, NUM_CARDS).tolist(), f)
+
+    indices = np.concatenate([np.sort(cards(rng, 5)) for _ in range(NUM_CARDS)]).astype(np.int32)
+    counts = rng.integers(1, 10, len(indices)).astype(np.int32)
+    save_correlations(CorrelationMatrix(np.arange(NUM_CARDS + 1, dtype=np.int64) * 5, indices, counts, counts.reshape(NUM_CARDS, 5).sum(1)), os.path.join(path, 'correlations'))
+
+class TestPipeline(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.dir = tempfile.TemporaryDirectory()
+        write_dataset(cls.dir.name, np.random.default_rng(0))
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.dir.cleanup()
+
+    def generator(self, **kwargs):
+        path = self.dir.name
+        return generator_disk.DataGenerator(
+            os.path.join(path, 'cubes'),
+            os.path.join(path, 'decks'),
+            os.path.join(path, 'picks'),
+            os.path.join(path, 'oracleFrequency.json'),
+            os.path.join(path, 'correlations'),
+            num_batches=4,
+            seed=0,
+            **kwargs
+        )
+
+    def test_batches_match_sequence(self):
+        generator = self.generator(input_dtype=np.uint8)
+        x, y = next(iter(make_dataset(generator, block_size=16, shuffle_buffer=32)))
+        expected_x, expected_y = generator[0]
+
+        flat_x = tf.nest.flatten(x)
+        self.assertEqual([part.shape for part in flat_x], [part.shape for part in tf.nest.flatten(expected_x)])
+        self.assertEqual([part.shape for part in y], [part.shape for part in expected_y])
+        self.assertTrue(all(part.dtype == tf.uint8 for part in flat_x))
+        self.assertTrue(all(part.dtype == tf.float32 for part in y))
+
+        # every input row holds cards, every correlation target is a distribution
+        for part in flat_x[:-1]:
+            self.assertTrue(np.all(part.numpy().sum(axis=1) > 0))
+        np.testing.assert_allclose(y[3].numpy().sum(axis=1), 1, atol=0.2)
+
+    def test_sparse_batches(self):
+        generator = self.generator(sparse_inputs=True)
+        x, _ = next(iter(make_dataset(generator, block_size=16, shuffle_buffer=32)))
+        expected_x, _ = generator[0]
+        for part, expected in zip(tf.nest.flatten(x, expand_composites=False), tf.nest.flatten(expected_x)):
+            self.assertIsInstance(part, tf.RaggedTensor)
+            self.assertEqual(part.nrows(), expected.nrows())
+
+    def test_tf_encoding(self):
+        rng = np.random.default_rng(1)
+        # repeated cards and empty rows
+        a = flatten([rng.integers(NUM_CARDS, size=rng.integers(0, 30)).tolist() for _ in range(9)])
+        b = flatten([rng.integers(NUM_CARDS, size=rng.integers(0, 10)).tolist() for _ in range(9)])
+        tf_a, tf_b = [(tf.constant(flat), tf.constant(offsets)) for flat, offsets in [a, b]]
+
+        for result, expected in [(tf_union_rows([tf_a], NUM_CARDS), unique_rows(*a, NUM_CARDS)), (tf_union_rows([tf_a, tf_b], NUM_CARDS), union_rows(a, b, NUM_CARDS))]:
+            for part, expected_part in zip(result, expected):
+                self.assertEqual(part.dtype.as_numpy_dtype, expected_part.dtype)
+                np.testing.assert_array_equal(part.numpy(), expected_part)
+
+        for dtype in [np.float32, np.float16, np.uint8]:
+            rows = tf_multi_hot([tf_a, tf_b], NUM_CARDS, 12, tf.as_dtype(dtype)).numpy()
+            np.testing.assert_array_equal(rows, multi_hot(*union_rows(a, b, NUM_CARDS), NUM_CARDS, 12, dtype=dtype))
+
+    def test_correlation_targets(self):
+        generator = self.generator()
+        cards = tf.data.Dataset.from_tensors(tf.constant([3, 0, 59, 3], dtype=tf.int64))
+        x, y = next(iter(encode_dataset(cards, generator, 'correlations', 4)))
+        np.testing.assert_array_equal(x.numpy(), np.eye(NUM_CARDS, dtype=np.float32)[[3, 0, 59, 3]])
+        np.testing.assert_allclose(y.numpy(), generator.card_correlations.rows(np.array([3, 0, 59, 3])), rtol=1e-6)
+
+    def test_time_steps(self):
+        generator = self.generator()
+        model = CubeCobraMLSystem(generator.num_cards)
+        model.compile(optimizer='adam', loss=['binary_crossentropy', 'binary_crossentropy', 'categorical_crossentropy', 'kullback_leibler_divergence'])
+
+        wait, step = time_steps(model, iter(make_dataset(generator, block_size=16, shuffle_buffer=32)), 2)
+        self.assertGreater(step, wait)
+        wait, step = time_steps(model, (generator[i % len(generator)] for i in range(10)), 2)
+        self.assertGreater(step, wait)
+
+    def test_parallel_generator(self):
+        generator = self.generator()
+        # fewer slots than batches, so slots are reused within an epoch
+        parallel = ParallelGenerator(self.generator(), 2, num_slots=3)
+        workers = parallel.workers
+        names = [slot.name for slot in parallel.slots]
+        try:
+            # the workers replay the shuffle of every epoch the parent moves on to
+            for epoch in range(3):
+                for batch_number in range(len(generator)):
+                    expected = tf.nest.flatten(generator[batch_number])
+                    batch = tf.nest.flatten(parallel[batch_number])
+                    self.assertEqual(len(batch), len(expected))
+                    for part, expected_part in zip(batch, expected):
+                        np.testing.assert_array_equal(part, expected_part)
+                # asking for the batch again hands out the same one
+                for part, again in zip(batch, tf.nest.flatten(parallel[len(generator) - 1])):
+                    np.testing.assert_array_equal(part, again)
+                generator.on_epoch_end()
+                parallel.on_epoch_end()
+                self.assertEqual(parallel.generator.epoch, generator.epoch)
+        finally:
+            parallel.close()
+
+        self.assertFalse(any(worker.is_alive() for worker in workers))
+        for name in names:
+            with self.assertRaises(FileNotFoundError):
+                shared_memory.SharedMemory(name=name)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,84 @@
+import unittest
+import numpy as np
+import subprocess
+import tempfile
+import sys
+import os
+from model import CubeCobraMLSystem
+from numpy_engine import NumpyEngine, dequantize, write_weights
+from export_numpy import model_components
+from quantize import quantize_components, quantize_kernel
+from test_pipeline import NUM_CARDS, write_dataset
+
+class TestQuantize(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.dir = tempfile.TemporaryDirectory()
+        path = cls.dir.name
+        write_dataset(os.path.join(path, 'data'), np.random.default_rng(0))
+        model = CubeCobraMLSystem(NUM_CARDS)
+        model.build_components()
+        cls.weights = os.path.join(path, 'weights.bin')
+        write_weights(cls.weights, NUM_CARDS, model_components(model))
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.dir.cleanup()
+
+    def test_quantize_kernel(self):
+        rng = np.random.default_rng(0)
+        # columns of very different magnitudes, one all zero
+        kernel = (rng.normal(size=(300, 40)) * np.logspace(-4, 1, 40)).astype(np.float32)
+        kernel[:, 7] = 0
+
+        quantized, scale = quantize_kernel(kernel, 'int8')
+        self.assertEqual((quantized.dtype, scale.dtype, scale.shape), (np.int8, np.float32, (40,)))
+        self.assertTrue(np.all(np.abs(quantized.astype(np.int32)) <= 127))
+        # every column's largest weight maps to +-127, the error is at most half a step
+        np.testing.assert_array_equal(np.abs(quantized[:, 8:]).max(axis=0), 127)
+        error = np.abs(dequantize(quantized, scale) - kernel)
+        self.assertTrue(np.all(error <= scale * (0.5 + 1e-3)))
+        np.testing.assert_array_equal(dequantize(quantized, scale)[:, 7], 0)
+
+        half, scale = quantize_kernel(kernel, 'float16')
+        self.assertIsNone(scale)
+        np.testing.assert_allclose(dequantize(half), kernel, rtol=2**-11, atol=1e-7)
+
+    def test_quantize_components(self):
+        engine = NumpyEngine(self.weights)
+        components = quantize_components(engine, 'int8')
+        for name, layers in components.items():
+            for layer in layers:
+                # only the num_cards wide layers are quantized
+                wide = NUM_CARDS in layer['kernel'].shape
+                self.assertEqual(layer['kernel'].dtype, np.int8 if wide else np.float32, name)
+                self.assertEqual(layer.get('scale') is not None, wide)
+
+        filename = os.path.join(self.dir.name, 'components.int8.bin')
+        write_weights(filename, NUM_CARDS, components)
+        with self.assertRaises(ValueError):
+            quantize_components(NumpyEngine(filename), 'int8')
+
+    def quantize(self, out_file, max_drop):
+        return subprocess.run(
+            [sys.executable, 'quantize.py', self.weights, out_file, '--data-dir', os.path.join(self.dir.name, 'data'),
+             '--samples', '40', '--batch-size', '16', '--repeats', '1', '--max-drop', str(max_drop)],
+            cwd=os.path.dirname(os.path.abspath(__file__)), capture_output=True, text=True,
+        )
+
+    def test_max_drop(self):
+        out_file = os.path.join(self.dir.name, 'weights.int8.bin')
+        # no drop is below -1, so every metric fails the gate
+        result = self.quantize(out_file, -1)
+        self.assertEqual(result.returncode, 1, result.stderr)
+        self.assertIn('not writing', result.stdout)
+        self.assertFalse(os.path.exists(out_file))
+        self.assertFalse(os.path.exists(out_file + '.tmp'))
+
+        result = self.quantize(out_file, 1)
+        self.assertEqual(result.returncode, 0, result.stderr)
+        self.assertEqual(NumpyEngine(out_file).components['encoder'][0][0].dtype, np.int8)
+        self.assertFalse(os.path.exists(out_file + '.tmp'))
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,66 @@
+import unittest
+import numpy as np
+import tempfile
+import os
+from result_cache import DiskStore, ResultCache
+
+class TestResultCache(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.dir.name, 'cache.db')
+        self.batches = []
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def compute(self, rows):
+        self.batches.append(rows)
+        return [np.full(4, row, dtype=np.float32) for row in rows]
+
+    def test_duplicate_misses(self):
+        cache = ResultCache()
+        cache.check_fingerprint('a')
+        results = cache.lookup([b'x', b'y', b'x'], [1, 2, 1], self.compute)
+        self.assertEqual(self.batches, [[1, 2]])
+        self.assertEqual([result[0] for result in results], [1, 2, 1])
+        self.assertEqual((cache.misses, cache.hits), (2, 1))
+
+        cache.lookup([b'y', b'x'], [2, 1], self.compute)
+        self.assertEqual(len(self.batches), 1)
+
+    def test_disk_round_trip(self):
+        store = DiskStore(self.path)
+        result = {'add_indices': np.arange(3, dtype=np.int32), 'add_scores': np.ones(3, dtype=np.float32)}
+        store.put([(b'dict', result), (b'array', np.arange(5, dtype=np.float32))], 'a')
+        store.close()
+
+        store = DiskStore(self.path)
+        loaded = store.get(b'dict')
+        self.assertEqual(sorted(loaded), sorted(result))
+        for name, value in result.items():
+            np.testing.assert_array_equal(loaded[name], value)
+            self.assertEqual(loaded[name].dtype, value.dtype)
+        np.testing.assert_array_equal(store.get(b'array'), np.arange(5, dtype=np.float32))
+        self.assertIsNone(store.get(b'missing'))
+        store.close()
+
+    def test_new_fingerprint_purges_disk(self):
+        cache = ResultCache(path=self.path)
+        cache.check_fingerprint('a')
+        cache.lookup([b'x'], [1], self.compute)
+        cache.check_fingerprint('b')
+        self.assertEqual(cache.store.nbytes(), 0)
+        self.assertIsNone(cache.get(b'x'))
+
+    def test_disk_limit(self):
+        store = DiskStore(self.path, max_bytes=1000)
+        for i in range(10):
+            store.put([(bytes([i]), np.zeros(50, dtype=np.float32))], 'a')
+        self.assertLessEqual(store.nbytes(), 1000)
+        # the oldest rows went first
+        self.assertIsNone(store.get(bytes([0])))
+        self.assertIsNotNone(store.get(bytes([9])))
+        store.close()
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,94 @@
+import unittest
+import numpy as np
+import tempfile
+import json
+import os
+from model import CubeCobraMLSystem
+import score_cubes
+
+NUM_CARDS = 30
+
+class TestScoreCubes(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.dir = tempfile.TemporaryDirectory()
+        path = cls.dir.name
+        model = CubeCobraMLSystem(NUM_CARDS)
+        model.build_components()
+        model.save_weights(os.path.join(path, 'model'))
+
+        rng = np.random.default_rng(0)
+        cls.cubes = [sorted(rng.choice(NUM_CARDS, rng.integers(1, 20), replace=False).tolist()) for _ in range(23)]
+        # every card in the cube leaves nothing to add
+        cls.cubes[5] = list(range(NUM_CARDS))
+        with open(os.path.join(path, 'cubes.json'), 'w') as f:
+            json.dump(cls.cubes, f)
+        with open(os.path.join(path, 'oracleFrequency.json'), 'w') as f:
+            json.dump([1] * NUM_CARDS, f)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.dir.cleanup()
+
+    def run_scoring(self, out_dir, k=8, restart=False):
+        path = self.dir.name
+        return score_cubes.run({
+            'cubes': os.path.join(path, 'cubes.json'),
+            'out_dir': os.path.join(path, out_dir),
+            'k': k,
+            'batch_size': 4,
+            'chunk_size': 5,
+            'workers': 1,
+            'restart': restart,
+            'model_dir': os.path.join(path, 'model'),
+            'freq_path': os.path.join(path, 'oracleFrequency.json'),
+        })
+
+    def outputs(self, out_dir):
+        return {name: np.array(value) for name, value in score_cubes.open_outputs(os.path.join(self.dir.name, out_dir), mode='r').items()}
+
+    def test_resume(self):
+        self.assertEqual(self.run_scoring('full'), len(self.cubes))
+        expected = self.outputs('full')
+
+        # stop after the first chunk
+        score_chunk = score_cubes.score_chunk
+        calls = []
+        def interrupted(chunk):
+            if calls:
+                raise KeyboardInterrupt
+            calls.append(chunk)
+            return score_chunk(chunk)
+        score_cubes.score_chunk = interrupted
+        try:
+            with self.assertRaises(KeyboardInterrupt):
+                self.run_scoring('resumed')
+        finally:
+            score_cubes.score_chunk = score_chunk
+
+        with open(os.path.join(self.dir.name, 'resumed', score_cubes.PROGRESS_FILE)) as f:
+            self.assertEqual(json.load(f)['done'], [0])
+        self.run_scoring('resumed')
+        with open(os.path.join(self.dir.name, 'resumed', score_cubes.PROGRESS_FILE)) as f:
+            self.assertEqual(json.load(f)['done'], list(range(5)))
+        for name, value in self.outputs('resumed').items():
+            np.testing.assert_array_equal(value, expected[name])
+
+    def test_padding(self):
+        for k in [8, NUM_CARDS + 5]:
+            self.run_scoring('padding', k=k, restart=True)
+            outputs = self.outputs('padding')
+            for kind, padding in [('add', -np.inf), ('remove', np.inf)]:
+                indices, scores = outputs[kind + '_indices'], outputs[kind + '_scores']
+                self.assertTrue(np.all((indices == -1) == (scores == padding)))
+                self.assertTrue(np.all(np.isfinite(scores) | (scores == padding)))
+            for i, cube in enumerate(self.cubes):
+                adds = outputs['add_indices'][i]
+                removes = outputs['remove_indices'][i]
+                self.assertEqual(np.sum(adds >= 0), min(k, NUM_CARDS - len(cube)))
+                self.assertEqual(np.sum(removes >= 0), min(k, len(cube)))
+                self.assertFalse(set(adds[adds >= 0].tolist()) & set(cube))
+                self.assertTrue(set(removes[removes >= 0].tolist()) <= set(cube))
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,151 @@
+import unittest
+import asyncio
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor
+from model import CubeCobraMLSystem
+from result_cache import CachedModel
+from serve import MicroBatcher, Predictor, Server
+
+NUM_CARDS = 40
+ORACLES = ['oracle-{}'.format(i) for i in range(NUM_CARDS)]
+
+class TestMicroBatcher(unittest.TestCase):
+    def setUp(self):
+        self.executor = ThreadPoolExecutor(1)
+        self.batches = []
+
+    def tearDown(self):
+        self.executor.shutdown()
+
+    def run_batch(self, requests):
+        self.batches.append(list(requests))
+        return [request * 2 for request in requests]
+
+    # runs the batcher while main(batcher) submits requests
+    def run_with(self, main, **kwargs):
+        async def run():
+            batcher = MicroBatcher(self.run_batch, self.executor, **kwargs)
+            task = asyncio.ensure_future(batcher.run())
+            try:
+                return batcher, await main(batcher)
+            finally:
+                task.cancel()
+        return asyncio.run(run())
+
+    def test_batches(self):
+        async def main(batcher):
+            return await asyncio.gather(*[batcher.submit(i) for i in range(10)])
+
+        batcher, results = self.run_with(main, max_batch_size=4, max_wait=1)
+        self.assertEqual(results, [2 * i for i in range(10)])
+        self.assertEqual([len(batch) for batch in self.batches], [4, 4, 2])
+        self.assertEqual(batcher.summary()['batch_sizes'], {2: 1, 4: 2})
+        self.assertEqual(batcher.summary()['latency_ms']['count'], 10)
+
+    def test_flush_on_timeout(self):
+        async def main(batcher):
+            start = time.perf_counter()
+            result = await batcher.submit(3)
+            return result, time.perf_counter() - start
+
+        _, (result, seconds) = self.run_with(main, max_batch_size=64, max_wait=0.05)
+        # a lone request waits for max_wait, not for a full batch
+        self.assertEqual(result, 6)
+        self.assertEqual(self.batches, [[3]])
+        self.assertGreaterEqual(seconds, 0.04)
+        self.assertLess(seconds, 1)
+
+    def test_errors_reach_every_request(self):
+        def fail(requests):
+            raise RuntimeError('model failed')
+        self.run_batch = fail
+
+        async def main(batcher):
+            return await asyncio.gather(*[batcher.submit(i) for i in range(3)], return_exceptions=True)
+
+        _, results = self.run_with(main, max_batch_size=8, max_wait=0.01)
+        self.assertTrue(all(isinstance(result, RuntimeError) for result in results))
+
+class TestServer(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        model = CubeCobraMLSystem(NUM_CARDS)
+        model.build_components()
+        cls.predictor = Predictor(CachedModel(model), ORACLES, k=5, deck_size=4)
+
+    def request(self, path, body, method='POST'):
+        async def run():
+            server = Server(self.predictor, max_wait=0.001)
+            tasks = [asyncio.ensure_future(batcher.run()) for batcher in server.batchers.values()]
+            try:
+                return await server.respond(method, path, body if isinstance(body, bytes) else json.dumps(body).encode('utf-8'))
+            finally:
+                for task in tasks:
+                    task.cancel()
+                server.executor.shutdown()
+        return asyncio.run(run())
+
+    def test_validation(self):
+        self.assertEqual(self.request('/api/nothing', {})[0], 404)
+        self.assertEqual(self.request('/api/recommend', {}, method='GET')[0], 404)
+        self.assertEqual(self.request('/api/recommend', b'{not json')[0], 400)
+        self.assertEqual(self.request('/api/recommend', ['oracle-1'])[0], 400)
+        self.assertEqual(self.request('/api/recommend', {'cards': 'oracle-1'})[0], 400)
+        self.assertEqual(self.request('/api/recommend', {'cards': ['oracle-1', 2]})[0], 400)
+        self.assertEqual(self.request('/api/draft', {'pool': []})[0], 400)
+        for picks in [True, -1, 2.5, '3']:
+            status, response = self.request('/api/rotodraft', {'pool': [], 'picks': picks})
+            self.assertEqual(status, 400, picks)
+            self.assertIn('picks', response['error'])
+
+    def test_recommend(self):
+        cube = ORACLES[:3] + ['unknown oracle']
+        status, response = self.request('/api/recommend', {'cards': cube})
+        self.assertEqual(status, 200)
+        self.assertEqual(len(response['adds']), 5)
+        self.assertFalse({card['oracle'] for card in response['adds']} & set(cube))
+        # only the 3 known cards can be removed
+        self.assertEqual(sorted(card['oracle'] for card in response['removes']), ORACLES[:3])
+
+    def test_draft(self):
+        status, response = self.request('/api/draft', {'pack': ORACLES[5:9], 'pool': ORACLES[:3]})
+        self.assertEqual(status, 200)
+        self.assertEqual(sorted(card['oracle'] for card in response['picks']), ORACLES[5:9])
+        self.assertAlmostEqual(sum(card['rating'] for card in response['picks']), 1, places=5)
+
+        status, response = self.request('/api/draft', {'pack': [], 'pool': ORACLES[:3]})
+        self.assertEqual((status, response), (200, {'picks': []}))
+
+    def test_deckbuild(self):
+        # fewer cards than deck_size all go to the mainboard
+        status, response = self.request('/api/deckbuild', {'cards': ORACLES[:3]})
+        self.assertEqual(status, 200)
+        self.assertEqual(len(response['mainboard']), 3)
+        self.assertEqual(response['sideboard'], [])
+
+        status, response = self.request('/api/deckbuild', {'cards': ORACLES[:10]})
+        self.assertEqual((len(response['mainboard']), len(response['sideboard'])), (4, 6))
+        ratings = [card['rating'] for card in response['mainboard']]
+        self.assertEqual(ratings, sorted(ratings, reverse=True))
+        self.assertGreaterEqual(min(ratings), max(card['rating'] for card in response['sideboard']))
+
+        status, response = self.request('/api/deckbuild', {'cards': []})
+        self.assertEqual((status, response), (200, {'mainboard': [], 'sideboard': []}))
+
+    def test_rotodraft(self):
+        status, response = self.request('/api/rotodraft', {'pool': ORACLES[:30], 'picks': 20})
+        self.assertEqual(status, 200)
+        # at most the cards left outside the pool
+        self.assertEqual(len(response['picks']), 10)
+        self.assertFalse({card['oracle'] for card in response['picks']} & set(ORACLES[:30]))
+
+    def test_metrics(self):
+        self.request('/api/embed', {'cards': ORACLES[:2]})
+        status, response = self.request('/metrics', b'', method='GET')
+        self.assertEqual(status, 200)
+        self.assertIn('/api/embed', response)
+        self.assertIn('hit_rate', response['cache'])
+
+if __name__ == "__main__":
+    unittest.main()
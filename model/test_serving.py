@@ -0,0 +1,70 @@
+import unittest
+import numpy as np
+import tempfile
+import tensorflow as tf
+from model import CubeCobraMLSystem
+from export_serving import export_serving
+
+NUM_CARDS = 60
+K = 10
+
+def multi_hot(rng, batch_size, size):
+    rows = np.zeros((batch_size, NUM_CARDS), dtype=np.float32)
+    for row in rows:
+        row[rng.choice(NUM_CARDS, size, replace=False)] = 1
+    return tf.constant(rows)
+
+# the values and row_splits the *_indices signatures take
+def to_indices(rows):
+    cards = tf.where(rows > 0)
+    ragged = tf.RaggedTensor.from_value_rowids(tf.cast(cards[:, 1], tf.int32), cards[:, 0], nrows=rows.shape[0])
+    return ragged, ragged.values, ragged.row_splits
+
+class TestServing(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.dir = tempfile.TemporaryDirectory()
+        cls.model = CubeCobraMLSystem(NUM_CARDS)
+        cls.model.build_components()
+        export_serving(cls.model, cls.dir.name, k=K)
+        cls.signatures = tf.saved_model.load(cls.dir.name).signatures
+
+        rng = np.random.default_rng(0)
+        cls.pools = multi_hot(rng, 5, 30)
+        cls.packs = multi_hot(rng, 5, 8)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.dir.cleanup()
+
+    def assertOutputs(self, outputs, expected):
+        self.assertEqual(sorted(outputs), sorted(expected))
+        for name, value in expected.items():
+            np.testing.assert_allclose(outputs[name].numpy(), value.numpy(), atol=1e-5, err_msg=name)
+
+    def test_dense(self):
+        model, signatures, pools, packs = self.model, self.signatures, self.pools, self.packs
+        self.assertOutputs(signatures['embed'](cards=pools), {'embedding': model.embed(pools)})
+        self.assertOutputs(signatures['recommend'](cubes=pools), {'scores': model.recommend(pools)})
+        self.assertOutputs(signatures['deck_build'](pools=pools), {'scores': model.deck_build(pools)})
+        self.assertOutputs(signatures['draft'](pools=pools, packs=packs), {'probabilities': model.draft(pools, packs)})
+        self.assertOutputs(signatures['recommend_top_k'](cubes=pools), model.recommend_top_k(pools, k=K))
+        self.assertOutputs(signatures['deck_build_top_k'](pools=pools), model.deck_build_top_k(pools))
+
+    def test_indices(self):
+        model, signatures = self.model, self.signatures
+        pools, pool_values, pool_splits = to_indices(self.pools)
+        packs, pack_values, pack_splits = to_indices(self.packs)
+
+        self.assertOutputs(signatures['embed_indices'](cards=pool_values, row_splits=pool_splits), {'embedding': model.embed(pools)})
+        self.assertOutputs(signatures['recommend_indices'](cubes=pool_values, row_splits=pool_splits), {'scores': model.recommend(pools)})
+        self.assertOutputs(signatures['deck_build_indices'](pools=pool_values, row_splits=pool_splits), {'scores': model.deck_build(pools)})
+        self.assertOutputs(signatures['recommend_top_k_indices'](cubes=pool_values, row_splits=pool_splits), model.recommend_top_k(pools, k=K))
+        self.assertOutputs(signatures['deck_build_top_k_indices'](pools=pool_values, row_splits=pool_splits), model.deck_build_top_k(pools))
+
+        probabilities = model.draft_candidates(pools, packs)
+        outputs = signatures['draft_indices'](pools=pool_values, pool_splits=pool_splits, packs=pack_values, pack_splits=pack_splits)
+        self.assertOutputs(outputs, {'probabilities': probabilities.values, 'row_splits': probabilities.row_splits})
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,58 @@
+import unittest
+from shard_cache import ShardCache
+
+class FakeShard:
+    def __init__(self, nbytes):
+        self.nbytes = nbytes
+
+SIZES = {'a': 40, 'b': 40, 'c': 40, 'd': 150}
+
+class TestShardCache(unittest.TestCase):
+    def setUp(self):
+        self.loads = []
+        self.cache = ShardCache(100, load=self.load)
+
+    def load(self, path, collection):
+        self.loads.append((path, collection))
+        return FakeShard(SIZES[path])
+
+    def test_hits(self):
+        shard = self.cache.get('a', 'cubes')
+        self.assertIs(self.cache.get('a', 'cubes'), shard)
+        self.assertEqual(self.loads, [('a', 'cubes')])
+        self.assertEqual((self.cache.hits, self.cache.misses), (1, 1))
+        self.assertEqual(self.cache.stats()['hit_rate'], 0.5)
+
+    def test_eviction_order(self):
+        self.cache.get('a', 'cubes')
+        self.cache.get('b', 'decks')
+        # a was used last, so b is the least recently used
+        self.cache.get('a', 'cubes')
+        self.cache.get('c', 'picks')
+        self.assertEqual(list(self.cache.shards), ['a', 'c'])
+        self.assertEqual(self.cache.bytes_resident, 80)
+        self.assertEqual(self.cache.evictions, 1)
+
+        self.cache.get('b', 'decks')
+        self.assertEqual(list(self.cache.shards), ['c', 'b'])
+
+        # a shard over the whole budget evicts everything else but is kept
+        self.cache.get('d', 'cubes')
+        self.assertEqual(list(self.cache.shards), ['d'])
+        self.assertEqual(self.cache.stats(), {
+            'hits': 1,
+            'misses': 5,
+            'hit_rate': 1 / 6,
+            'evictions': 4,
+            'shards_resident': 1,
+            'bytes_resident': 150,
+            'bytes_loaded': 310,
+            'max_bytes': 100,
+        })
+
+        self.cache.clear()
+        self.assertEqual((len(self.cache), self.cache.bytes_resident), (0, 0))
+        self.assertNotIn('d', self.cache)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,67 @@
+import unittest
+import tempfile
+import json
+import os
+from shard_index import load_index, read_index, scan_shard
+
+DECKS = [
+    [{'mainboard': [1, 2, 3], 'sideboard': []}, {'mainboard': [4], 'sideboard': [5, 6]}],
+    [],
+    [{'mainboard': [], 'sideboard': [7]}, {'mainboard': [8, 9], 'sideboard': [10]}, {'mainboard': [11], 'sideboard': []}],
+]
+
+class TestShardIndex(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.dir.name, 'decks')
+        os.makedirs(self.path)
+        for i, records in enumerate(DECKS):
+            self.write_shard(i, records)
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def write_shard(self, i, records):
+        # indented like a pretty printed file, spans must skip the whitespace
+        with open(os.path.join(self.path, '{}.json'.format(i)), 'w') as f:
+            json.dump(records, f, indent=2 if i % 2 else None)
+
+    def records(self):
+        return [record for records in DECKS for record in records]
+
+    def test_spans(self):
+        for i, records in enumerate(DECKS):
+            filename = os.path.join(self.path, '{}.json'.format(i))
+            with open(filename, 'rb') as f:
+                data = f.read()
+            spans = scan_shard(filename)
+            self.assertEqual(len(spans), len(records))
+            self.assertEqual([json.loads(data[start:end]) for start, end in spans], records)
+
+    def test_index(self):
+        index = load_index(self.path)
+        self.assertEqual(len(index), len(self.records()))
+        self.assertEqual([index.shard_records(i) for i in range(index.num_shards)], [len(records) for records in DECKS])
+        self.assertEqual([index.read_record(row) for row in range(len(index))], self.records())
+
+        rows = [3, 1, 2, 3]
+        self.assertEqual(index.read_records(rows), [self.records()[row] for row in rows])
+        batch = index.take(rows, 'decks')
+        flat, offsets = batch['sideboard']
+        self.assertEqual(flat.tolist(), [10, 5, 6, 7, 10])
+        self.assertEqual(offsets.tolist(), [0, 1, 3, 4, 5])
+
+    def test_reload(self):
+        load_index(self.path)
+        self.assertIsNotNone(read_index(self.path))
+
+        # a changed shard is rescanned, the others are reused
+        DECKS_2 = DECKS[2][:1]
+        self.write_shard(2, DECKS_2)
+        os.utime(os.path.join(self.path, '2.json'), ns=(0, 10 ** 9))
+        index = load_index(self.path)
+        self.assertEqual(len(index), len(DECKS[0]) + len(DECKS_2))
+        self.assertEqual(index.read_record(len(DECKS[0])), DECKS_2[0])
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,79 @@
+import unittest
+import numpy as np
+import tempfile
+import json
+import os
+from model import CubeCobraMLSystem
+from dataset import decode_shard, list_shards
+from simulate_draft import ShardWriter, deal, simulate
+
+NUM_CARDS = 160
+SEATS = 3
+PACKS = 3
+PACK_SIZE = 15
+NUM_DRAFTS = 4
+
+class TestSimulateDraft(unittest.TestCase):
+    def setUp(self):
+        self.model = CubeCobraMLSystem(NUM_CARDS)
+        self.cube = np.arange(5, 150).tolist()
+
+    def test_deal(self):
+        dealt = deal(self.cube, NUM_DRAFTS, SEATS, PACKS, PACK_SIZE, np.random.default_rng(0))
+        self.assertEqual(dealt.shape, (NUM_DRAFTS, PACKS, SEATS, PACK_SIZE))
+        for draft in dealt:
+            self.assertEqual(len(np.unique(draft)), SEATS * PACKS * PACK_SIZE)
+            self.assertTrue(set(draft.ravel().tolist()) <= set(self.cube))
+        with self.assertRaises(ValueError):
+            deal(self.cube[:44], 1, 1, PACKS, PACK_SIZE, np.random.default_rng(0))
+
+    def test_simulate(self):
+        records = []
+        pools = simulate(self.model, self.cube, NUM_DRAFTS, SEATS, PACKS, PACK_SIZE, np.random.default_rng(0), emit=records.extend)
+
+        self.assertEqual(len(pools), NUM_DRAFTS * SEATS)
+        for draft in range(NUM_DRAFTS):
+            seats = pools[draft * SEATS:(draft + 1) * SEATS]
+            self.assertTrue(all(len(pool) == PACKS * PACK_SIZE for pool in seats))
+            # the seats of a draft split its cards between them
+            self.assertEqual(len(np.unique(np.concatenate(seats))), SEATS * PACKS * PACK_SIZE)
+
+        # one record per seat and pick, except the last card of every pack
+        self.assertEqual(len(records), NUM_DRAFTS * SEATS * PACKS * (PACK_SIZE - 1))
+        sizes = np.bincount([len(record['pool']) for record in records], minlength=PACKS * PACK_SIZE)
+        last_picks = [PACK_SIZE * (pack + 1) - 1 for pack in range(PACKS)]
+        for size, count in enumerate(sizes):
+            self.assertEqual(count, 0 if size in last_picks else NUM_DRAFTS * SEATS, size)
+        for record in records:
+            self.assertIn(record['pick'], record['pack'])
+            self.assertFalse(set(record['pack']) & set(record['pool']))
+            self.assertEqual(len(record['pool']) % PACK_SIZE + len(record['pack']), PACK_SIZE)
+
+    def test_shards(self):
+        with tempfile.TemporaryDirectory() as path:
+            writer = ShardWriter(path, shard_size=100)
+            simulate(self.model, self.cube, 2, SEATS, PACKS, PACK_SIZE, np.random.default_rng(1), emit=writer)
+            writer.close()
+
+            files = list_shards(path)
+            self.assertEqual(len(files), -(-writer.num_records // 100))
+            records = []
+            for file in files:
+                with open(os.path.join(path, file)) as f:
+                    records += json.load(f)
+            self.assertEqual(len(records), writer.num_records)
+
+            # the shards read back as process_data.js picks
+            row = 0
+            for file in files:
+                shard = decode_shard(os.path.join(path, file), 'picks')
+                for i in range(len(shard)):
+                    record = records[row + i]
+                    self.assertEqual(shard['pool'][i].tolist(), record['pool'])
+                    self.assertEqual(shard['pack'][i].tolist(), record['pack'])
+                    self.assertEqual(int(shard['pick'][i][0]), record['pick'])
+                row += len(shard)
+            self.assertEqual(row, writer.num_records)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,7 +1,14 @@
 from model import CubeCobraMLSystem
+from pipeline import make_dataset, time_steps
+from workers import ParallelGenerator
+from dtype_policy import POLICIES, set_policy, train_steps, max_difference, reset_peak_memory, peak_memory_mb
 import tensorflow as tf
-from generator_disk import DataGenerator
+import generator_disk
+import generator_binary
 import numpy as np
+import argparse
+import gc
+import itertools
 import json
 import os
 import os.path
@@ -10,12 +17,33 @@ import sys
 from tensorflow.keras.metrics import TopKCategoricalAccuracy
 
 # get params
-params = sys.argv[1:]
+parser = argparse.ArgumentParser()
+parser.add_argument('epochs', type=int)
+parser.add_argument('batch_size', type=int)
+parser.add_argument('continue_training')
+parser.add_argument('loss_weights', type=float)
+parser.add_argument('--data-format', choices=['json', 'binary'], default='json',
+                    help='binary reads the memory-mapped layout written by convert_data.py')
+parser.add_argument('--sparse-inputs', action='store_true',
+                    help='feed the model card indices instead of multi-hot rows')
+parser.add_argument('--pipeline', choices=['sequence', 'tf.data'], default='sequence',
+                    help='tf.data reads, encodes and prefetches batches in parallel with training')
+parser.add_argument('--benchmark-pipelines', type=int, default=0, metavar='STEPS',
+                    help='time STEPS train steps with each pipeline instead of training')
+parser.add_argument('--workers', type=int, default=0,
+                    help='build Sequence batches in this many forked worker processes')
+parser.add_argument('--dtype-policy', choices=list(POLICIES), default='float32',
+                    help='dtype of the multi-hot inputs and Keras compute policy, see dtype_policy.py')
+parser.add_argument('--benchmark-dtype-policies', type=int, default=0, metavar='STEPS',
+                    help='train STEPS steps from the same weights under every dtype policy and compare them with float32')
+parser.add_argument('--dtype-tolerance', type=float, default=0.02,
+                    help='largest relative loss or absolute metric difference from float32 the benchmark accepts')
+params = parser.parse_args()
 
-epochs = int(params[0])
-batch_size = int(params[1])
-continue_training = params[2]
-loss_weights = float(params[3])
+epochs = params.epochs
+batch_size = params.batch_size
+continue_training = params.continue_training
+loss_weights = params.loss_weights
 
 data_dir = '../data/train/'
 model_dir = './model/'
@@ -24,45 +52,124 @@ model_dir = './model/'
 print('Creating Data Generator...\n')
 
 
-generator = DataGenerator(
-    '{}cubes/'.format(data_dir),
-    '{}decks/'.format(data_dir),
-    '{}picks/'.format(data_dir),
-    '{}oracleFrequency.json'.format(data_dir),
-    '{}correlations.json'.format(data_dir),
-    num_batches=batch_size,
-)
+if params.data_format == 'binary':
+    generator = generator_binary.DataGenerator(
+        '{}bin/'.format(data_dir),
+        '{}oracleFrequency.json'.format(data_dir),
+        '{}bin/correlations/'.format(data_dir),
+        num_batches=batch_size,
+        sparse_inputs=params.sparse_inputs,
+        input_dtype=POLICIES[params.dtype_policy]['inputs'],
+    )
+else:
+    generator = generator_disk.DataGenerator(
+        '{}cubes/'.format(data_dir),
+        '{}decks/'.format(data_dir),
+        '{}picks/'.format(data_dir),
+        '{}oracleFrequency.json'.format(data_dir),
+        '{}correlations.json'.format(data_dir),
+        num_batches=batch_size,
+        sparse_inputs=params.sparse_inputs,
+        input_dtype=POLICIES[params.dtype_policy]['inputs'],
+    )
+
+# fork the batch workers before TensorFlow starts its runtime threads
+batches = generator
+if params.workers:
+    batches = ParallelGenerator(generator, params.workers)
+
+def create_model(policy):
+    set_policy(policy)
+    model = CubeCobraMLSystem(generator.num_cards)
+
+    # mixed_float16 models get a LossScaleOptimizer from compile
+    model.compile(
+        optimizer='adam',
+        loss=['binary_crossentropy', 'binary_crossentropy', 'categorical_crossentropy', 'kullback_leibler_divergence'],
+        loss_weights=[loss_weights, loss_weights, loss_weights, loss_weights],
+        metrics={
+            'output_1': 'accuracy',
+            'output_2': 'accuracy',
+            'output_3': [
+                TopKCategoricalAccuracy(k=1, name="top1"),
+                TopKCategoricalAccuracy(k=3, name="top3")
+            ],
+            'output_4': 'accuracy'
+        }
+    )
+    # top_k_categorical_accuracy
+    return model
+
+if params.benchmark_dtype_policies:
+    print('Training {} steps per dtype policy...\n'.format(params.benchmark_dtype_policies))
+    print('{:<16}{:>10}{:>12}{:>12}{:>10}{:>10}{:>8}'.format('policy', 'batch MB', 'samples/s', 'peak +MB', 'loss', 'diff', ''))
+    baseline = None
+    mismatches = 0
+    for policy in POLICIES:
+        generator.input_dtype = POLICIES[policy]['inputs']
+        # the previous policy's model is freed first, peak +MB is what this one allocates
+        # on top of what is left
+        model = None
+        gc.collect()
+        start_mb = reset_peak_memory()
+        model = create_model(policy)
+
+        # every policy starts from the weights of the float32 model
+        x, _ = generator[0]
+        model(x)
+        if baseline is None:
+            weights = model.get_weights()
+        else:
+            model.set_weights(weights)
+
+        samples_per_second, nbytes, results = train_steps(model, generator, params.benchmark_dtype_policies)
+        if baseline is None:
+            baseline = results
+        difference = max_difference(results, baseline)
+        match = difference <= params.dtype_tolerance
+        mismatches += not match
+        print('{:<16}{:>10.1f}{:>12.0f}{:>12.0f}{:>10.4f}{:>10.4f}{:>8}'.format(
+            policy, nbytes / 2**20, samples_per_second, peak_memory_mb() - start_mb, results['loss'], difference, 'ok' if match else 'DIFFERS'))
+    sys.exit(1 if mismatches else 0)
 
 print('Creating Model...\n')
 
-model = CubeCobraMLSystem(generator.num_cards)
-
-model.compile(
-    optimizer='adam',
-    loss=['binary_crossentropy', 'binary_crossentropy', 'categorical_crossentropy', 'kullback_leibler_divergence'],
-    loss_weights=[loss_weights, loss_weights, loss_weights, loss_weights],
-    metrics={
-        'output_1': 'accuracy',
-        'output_2': 'accuracy',
-        'output_3': [
-            TopKCategoricalAccuracy(k=1, name="top1"),
-            TopKCategoricalAccuracy(k=3, name="top3")
-        ],
-        'output_4': 'accuracy'
-    }
-)
-# top_k_categorical_accuracy
+model = create_model(params.dtype_policy)
 
 if continue_training == 'true':
     print('Loading Model...\n')
     model.load_weights(model_dir)
 
+if params.benchmark_pipelines:
+    print('Timing {} steps per pipeline...\n'.format(params.benchmark_pipelines))
+    pipelines = [
+        ('sequence', (batches[i % len(batches)] for i in itertools.count())),
+        ('tf.data', iter(make_dataset(generator))),
+    ]
+    print('{:<12}{:>12}{:>18}{:>10}'.format('pipeline', 'step ms', 'input wait ms', 'wait %'))
+    for name, iterator in pipelines:
+        wait, step = time_steps(model, iterator, params.benchmark_pipelines)
+        print('{:<12}{:>12.1f}{:>18.1f}{:>10.1f}'.format(name, step * 1000, wait * 1000, 100 * wait / step))
+    sys.exit()
+
 print('Training Model...\n')
 
-model.fit(
-    generator,
-    epochs=epochs
-)
+if params.pipeline == 'tf.data':
+    model.fit(
+        make_dataset(generator),
+        epochs=epochs,
+        steps_per_epoch=len(generator),
+    )
+else:
+    # the generators shuffle records every epoch, batch workers prefetch batches in order
+    model.fit(
+        batches,
+        epochs=epochs,
+        shuffle=not params.workers,
+    )
+
+if params.workers:
+    batches.close()
 
 print('Saving Model to {}...\n'.format(model_dir))
 model.save_weights(model_dir)
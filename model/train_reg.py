@@ -2,6 +2,7 @@ from model import RegularizationSystem
 import tensorflow as tf
 from generator_reg import DataGenerator
 import numpy as np
+import argparse
 import json
 import os
 import os.path
@@ -10,12 +11,19 @@ import sys
 from tensorflow.keras.metrics import TopKCategoricalAccuracy
 
 # get params
-params = sys.argv[1:]
+parser = argparse.ArgumentParser()
+parser.add_argument('epochs', type=int)
+parser.add_argument('batch_size', type=int)
+parser.add_argument('continue_training')
+parser.add_argument('loss_weights', type=float)
+parser.add_argument('--sparse-inputs', action='store_true',
+                    help='feed the model card indices instead of identity rows')
+params = parser.parse_args()
 
-epochs = int(params[0])
-batch_size = int(params[1])
-continue_training = params[2]
-loss_weights = float(params[3])
+epochs = params.epochs
+batch_size = params.batch_size
+continue_training = params.continue_training
+loss_weights = params.loss_weights
 
 data_dir = '../data/train/'
 model_dir = './model/'
@@ -28,6 +36,7 @@ generator = DataGenerator(
     '{}oracleFrequency.json'.format(data_dir),
     '{}correlations.json'.format(data_dir),
     batch_size=batch_size,
+    sparse_inputs=params.sparse_inputs,
 )
 
 print('Creating Model...\n')
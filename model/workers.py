@@ -0,0 +1,206 @@
+from tensorflow.keras.utils import Sequence
+from multiprocessing import shared_memory
+import multiprocessing
+from encoding import BatchEncoder
+import numpy as np
+import threading
+import traceback
+
+# Builds a generator's batches in forked worker processes. Batch construction is
+# numpy and python work that holds the GIL, so threads do not scale past a core or two.
+# Workers are forked from the process that owns the generator, so memory-mapped data
+# (generator_binary) and in-memory arrays (generator) are shared, not copied, and every
+# worker holds the same shuffle state. Each batch is written straight into one slot of
+# a ring of shared memory buffers, only (epoch, batch_number, slot) goes through the
+# queues. Batches come from batch_rng(batch_number) and the epoch's shuffle, so they
+# are identical whatever the number of workers. Batches are prefetched in order, so
+# fit must not shuffle them (the generators already shuffle records every epoch). Dense inputs only, sparse batches do
+# not have a fixed size to reserve. generator_disk keeps one shard cache per worker.
+
+ALIGNMENT = 64
+
+
+def batch_structure(batch):
+    if isinstance(batch, np.ndarray):
+        return (batch.shape, batch.dtype)
+    if isinstance(batch, (list, tuple)):
+        return [batch_structure(part) for part in batch]
+    raise ValueError('ParallelGenerator needs dense numpy batches, got {}'.format(type(batch).__name__))
+
+
+def flatten_batch(batch):
+    if isinstance(batch, np.ndarray):
+        return [batch]
+    return [array for part in batch for array in flatten_batch(part)]
+
+
+def flatten_structure(structure):
+    if isinstance(structure, tuple):
+        return [structure]
+    return [spec for part in structure for spec in flatten_structure(part)]
+
+
+def rebuild_batch(structure, arrays):
+    if isinstance(structure, tuple):
+        return next(arrays)
+    return [rebuild_batch(part, arrays) for part in structure]
+
+
+# byte offset of each array within a slot, and the slot size
+def slot_layout(specs):
+    offsets = []
+    size = 0
+    for shape, dtype in specs:
+        offsets.append(size)
+        nbytes = int(np.prod(shape)) * np.dtype(dtype).itemsize
+        size += -(-nbytes // ALIGNMENT) * ALIGNMENT
+    return offsets, max(size, 1)
+
+
+def worker_main(generator, views, tasks, done):
+    try:
+        # each batch is copied into its slot before the next one is built, so the
+        # generator can build them all in the same buffers
+        if hasattr(generator, 'encoder'):
+            generator.encoder = BatchEncoder(generator.num_cards)
+        while True:
+            task = tasks.get()
+            if task is None:
+                break
+
+            epoch, batch_number, slot = task
+            # replay the epoch shuffles the parent has done since the fork
+            while generator.epoch < epoch:
+                generator.epoch += 1
+                generator.prep_next_epoch()
+
+            for out, array in zip(views[slot], flatten_batch(generator[batch_number])):
+                np.copyto(out, array)
+            done.put((epoch, batch_number, slot))
+    except Exception:
+        done.put(('error', traceback.format_exc(), None))
+
+
+class ParallelGenerator(Sequence):
+    def __init__(self, generator, num_workers=None, num_slots=None):
+        super().__init__()
+
+        if getattr(generator, 'sparse_inputs', False):
+            raise ValueError('ParallelGenerator needs dense inputs, sparse batches have no fixed size')
+        if not hasattr(generator, 'batch_rng'):
+            raise ValueError('{} does not derive its batches from (seed, epoch, batch_number)'.format(type(generator).__name__))
+
+        self.generator = generator
+        self.num_workers = num_workers or multiprocessing.cpu_count()
+        self.num_slots = num_slots or 2 * self.num_workers
+
+        # the first batch gives the shapes to reserve, batch sizes are fixed per generator
+        self.structure = batch_structure(generator[0])
+        specs = flatten_structure(self.structure)
+        offsets, slot_bytes = slot_layout(specs)
+
+        self.slots = [shared_memory.SharedMemory(create=True, size=slot_bytes) for _ in range(self.num_slots)]
+        self.views = [
+            [np.ndarray(shape, dtype=dtype, buffer=slot.buf, offset=offset) for (shape, dtype), offset in zip(specs, offsets)]
+            for slot in self.slots
+        ]
+        print('Batch workers: {}, {} slots of {:.1f} MB'.format(self.num_workers, self.num_slots, slot_bytes / 2**20))
+
+        self.lock = threading.Lock()
+        self.free_slots = list(range(self.num_slots))
+        self.submitted = {}
+        self.ready = {}
+        # the batch handed out last, Keras asks for the first batch twice, once to peek at it
+        self.last = None
+
+        context = multiprocessing.get_context('fork')
+        self.tasks = context.Queue()
+        self.done = context.Queue()
+        self.workers = [
+            context.Process(target=worker_main, args=(generator, self.views, self.tasks, self.done), daemon=True)
+            for _ in range(self.num_workers)
+        ]
+        for worker in self.workers:
+            worker.start()
+
+        self.prefetch(0)
+
+    def __len__(self):
+        return len(self.generator)
+
+    def collect(self):
+        epoch, batch_number, slot = self.done.get()
+        if epoch == 'error':
+            raise RuntimeError('Batch worker failed:\n{}'.format(batch_number))
+        self.ready[(epoch, batch_number)] = self.submitted.pop((epoch, batch_number))
+
+    # A free slot for a new batch. Finished batches of earlier epochs, which nobody will
+    # ask for, are dropped first, otherwise this waits for the batches in flight. Batches
+    # must be asked for in order (fit(shuffle=False)), then every slot never ends up
+    # holding finished batches of this epoch that are not wanted yet. When they do, out
+    # of order, the one furthest ahead is dropped and built again when asked for.
+    def acquire_slot(self):
+        while not self.free_slots:
+            stale = [key for key in self.ready if key[0] < self.generator.epoch]
+            if stale:
+                self.free_slots.append(self.ready.pop(stale[0]))
+            elif self.submitted:
+                self.collect()
+            else:
+                self.free_slots.append(self.ready.pop(max(self.ready)))
+        return self.free_slots.pop()
+
+    def submit(self, epoch, batch_number):
+        key = (epoch, batch_number)
+        if key in self.submitted or key in self.ready:
+            return
+        slot = self.acquire_slot()
+        self.submitted[key] = slot
+        self.tasks.put((epoch, batch_number, slot))
+
+    # queues the batches after start for as long as there are free slots
+    def prefetch(self, start):
+        epoch = self.generator.epoch
+        for batch_number in range(start, len(self)):
+            if not self.free_slots:
+                break
+            self.submit(epoch, batch_number)
+
+    def __getitem__(self, batch_number):
+        with self.lock:
+            key = (self.generator.epoch, batch_number)
+            if self.last is not None and self.last[0] == key:
+                return rebuild_batch(self.structure, iter(self.last[1]))
+
+            self.submit(*key)
+            while key not in self.ready:
+                self.collect()
+
+            slot = self.ready.pop(key)
+            # one copy out of the slot so it can be reused while the trainer holds the batch
+            arrays = [np.array(view) for view in self.views[slot]]
+            self.free_slots.append(slot)
+            self.last = (key, arrays)
+
+            self.prefetch(batch_number + 1)
+
+        return rebuild_batch(self.structure, iter(arrays))
+
+    def on_epoch_end(self):
+        with self.lock:
+            self.generator.on_epoch_end()
+            for key in [key for key in self.ready if key[0] < self.generator.epoch]:
+                self.free_slots.append(self.ready.pop(key))
+            self.prefetch(0)
+
+    def close(self):
+        for _ in self.workers:
+            self.tasks.put(None)
+        for worker in self.workers:
+            worker.join()
+        self.views = []
+        for slot in self.slots:
+            slot.close()
+            slot.unlink()
+        self.workers = []
+        self.slots = []